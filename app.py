@@ -6,12 +6,15 @@ from io import BytesIO
 
 # --- Custom Module Imports ---
 from config import (
-    DROPBOX_ROOT_PATH, DAR_PDFS_PATH, MCM_DATA_PATH,
+    DROPBOX_ROOT_PATH, DAR_PDFS_PATH,
     LOG_SHEET_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH,
-    OFFICE_ORDERS_PATH
+    OFFICE_ORDERS_PATH, MCM_DATA_PARTITIONS_PATH, LOGIN_LOG_PATH, LOGIN_LOG_EVENTS_PATH
 )
 from css_styles import load_custom_css
-from dropbox_utils import get_dropbox_client, create_folder, upload_file
+from dropbox_utils import (
+    get_dropbox_client, create_folders, get_metadata_batch, upload_file, migrate_master_to_partitions,
+    start_journal_compaction_scheduler, log_activity, start_login_log_rollup_scheduler
+)
 from ui_login import login_page
 from ui_pco import pco_dashboard
 from ui_audit_group import audit_group_dashboard
@@ -29,6 +32,7 @@ def initialize_session_state():
         'audit_group_no': None,
         'dbx': None,
         'dropbox_initialized': False,
+        'login_logged': False,
         'app_mode': "e-mcm"
     }
     for key, value in states.items():
@@ -37,6 +41,31 @@ def initialize_session_state():
 
 initialize_session_state()
 
+# --- Dropbox Structure Initialization (once per process, shared by all sessions) ---
+@st.cache_resource(show_spinner=False)
+def initialize_dropbox_structure(_dbx):
+    """Creates the app's folders and empty workbooks if missing, and runs one-time migrations."""
+    # Create all necessary folders in one batch call
+    if not create_folders(_dbx, [DROPBOX_ROOT_PATH, DAR_PDFS_PATH, OFFICE_ORDERS_PATH, MCM_DATA_PARTITIONS_PATH,
+                                LOGIN_LOG_PATH, LOGIN_LOG_EVENTS_PATH]):
+        return False
+
+    # Initialize centralized Excel files if they don't exist (one listing of the root folder)
+    existing_files = get_metadata_batch(_dbx, [LOG_SHEET_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH])
+    for path, metadata in existing_files.items():
+        if metadata is None:
+            output = BytesIO()
+            pd.DataFrame().to_excel(output, index=False, engine='xlsxwriter')
+            upload_file(_dbx, output.getvalue(), path)
+
+    # Split the legacy single DAR workbook into per-period partitions (first run only)
+    migrate_master_to_partitions(_dbx)
+    # Fold pending submission journal deltas into period files in the background
+    start_journal_compaction_scheduler(_dbx)
+    # Fold buffered login events into the login log rollup in the background
+    start_login_log_rollup_scheduler(_dbx)
+    return True
+
 # --- RED BANNER: App Moved Notice ---
 st.markdown(
     """
@@ -73,26 +102,18 @@ else:
     if st.session_state.dbx:
         if not st.session_state.dropbox_initialized:
             with st.spinner("Initializing Dropbox structure..."):
-                dbx = st.session_state.dbx
-                # Create all necessary folders
-                for folder_path in [DROPBOX_ROOT_PATH, DAR_PDFS_PATH, OFFICE_ORDERS_PATH]:
-                    create_folder(dbx, folder_path)
-                
-                # Initialize centralized Excel files if they don't exist
-                for path in [MCM_DATA_PATH, LOG_SHEET_PATH, SMART_AUDIT_DATA_PATH, MCM_PERIODS_INFO_PATH]:
-                    try:
-                        dbx.files_get_metadata(path)
-                    except Exception:
-                        output = BytesIO()
-                        pd.DataFrame().to_excel(output, index=False, engine='xlsxwriter')
-                        file_content = output.getvalue()
-                        upload_file(dbx, file_content, path)
-
-                st.session_state.dropbox_initialized = True
-                st.rerun()
+                if initialize_dropbox_structure(st.session_state.dbx):
+                    st.session_state.dropbox_initialized = True
+                    st.rerun()
+                else:
+                    # Do not cache a failed initialization; the next session retries it
+                    initialize_dropbox_structure.clear()
 
         if st.session_state.dropbox_initialized:
             dbx = st.session_state.dbx
+            if not st.session_state.login_logged:
+                log_activity(dbx, st.session_state.username, st.session_state.role)
+                st.session_state.login_logged = True
             if st.session_state.app_mode == "smart_audit_tracker":
                 if st.session_state.role == "PCO":
                     smart_audit_tracker_dashboard(dbx)
@@ -0,0 +1,108 @@
+# benchmark_excel.py
+"""
+Times each Excel reader engine on synthetic workbooks shaped like the DAR data
+(SHEET_DATA_COLUMNS_ORDER), to choose the order of EXCEL_READ_ENGINES in config.py.
+
+Run from the app folder (config.py reads .streamlit/secrets.toml):
+
+    python benchmark_excel.py --rows 1000 10000 100000 --repeat 3
+
+Engines that are not installed (e.g. calamine without python-calamine) are reported and skipped.
+"openpyxl-readonly" is not a pandas engine: it streams the rows with openpyxl's read-only
+mode directly, to show what pandas' own openpyxl reader adds on top of it.
+"""
+import argparse
+import time
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from config import SHEET_DATA_COLUMNS_ORDER, EXCEL_READ_ENGINES, DAR_PDFS_PATH
+
+def make_sheet_rows(num_rows, seed=0):
+    """Synthetic DAR rows with the stored column order and realistic value types."""
+    rng = np.random.default_rng(seed)
+    dar_ids = rng.integers(0, max(1, num_rows // 4), num_rows)
+    group_numbers = rng.integers(1, 31, num_rows)
+    columns = {
+        'mcm_period': rng.choice(['April 2025', 'May 2025', 'June 2025'], num_rows),
+        'audit_group_number': group_numbers,
+        'audit_circle_number': (group_numbers + 2) // 3,
+        'gstin': [f"33ABCDE{i:04d}F1Z5" for i in dar_ids],
+        'trade_name': [f"M/s. Trade Name {i}" for i in dar_ids],
+        'category': rng.choice(['Large', 'Medium', 'Small'], num_rows),
+        'taxpayer_classification': rng.choice(['Manufacturing', 'Other Traders', 'Service Providers'], num_rows),
+        'total_amount_detected_overall_rs': rng.random(num_rows) * 5e6,
+        'total_amount_recovered_overall_rs': rng.random(num_rows) * 1e6,
+        'audit_para_number': rng.integers(1, 15, num_rows),
+        'audit_para_heading': [f"Short payment of tax on supply of item {i}" for i in range(num_rows)],
+        'revenue_involved_rs': rng.random(num_rows) * 1e6,
+        'revenue_recovered_rs': rng.random(num_rows) * 2e5,
+        'status_of_para': rng.choice(['Agreed and Paid', 'Not agreed', 'Agreed yet to pay'], num_rows),
+        'para_classification_code': rng.choice(['TP01', 'RC02', 'IT03', 'CV04'], num_rows),
+        'risk_flags_data': [None] * num_rows,
+        'dar_pdf_path': [f"{DAR_PDFS_PATH}/AG1_dar_{i}.pdf" for i in dar_ids],
+        'dar_pdf_url': [f"https://www.dropbox.com/scl/fi/{i:08x}/AG1_dar_{i}.pdf?dl=0" for i in dar_ids],
+        'record_created_date': [f"2025-01-{1 + i % 28:02d} 10:00:00" for i in range(num_rows)],
+    }
+    return pd.DataFrame(columns)[SHEET_DATA_COLUMNS_ORDER]
+
+def read_openpyxl_readonly(workbook_bytes):
+    """The first sheet as a DataFrame, streamed row by row with openpyxl's read-only mode."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(BytesIO(workbook_bytes), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        return pd.DataFrame(rows, columns=header)
+    finally:
+        workbook.close()
+
+STREAMING_READERS = {'openpyxl-readonly': read_openpyxl_readonly}
+
+def time_engine(workbook_bytes, engine, repeat):
+    """Best-of-`repeat` seconds for pd.read_excel with `engine` (or a STREAMING_READERS reader), or None if it is not installed."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            if engine in STREAMING_READERS:
+                STREAMING_READERS[engine](workbook_bytes)
+            else:
+                pd.read_excel(BytesIO(workbook_bytes), engine=engine)
+        except ImportError:
+            return None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engines', nargs='+', default=list(dict.fromkeys(EXCEL_READ_ENGINES + ['openpyxl'] + list(STREAMING_READERS))))
+    args = parser.parse_args()
+
+    results = []
+    for num_rows in args.rows:
+        output = BytesIO()
+        make_sheet_rows(num_rows).to_excel(output, index=False, engine='xlsxwriter')
+        workbook_bytes = output.getvalue()
+        print(f"{num_rows} rows ({len(workbook_bytes) / 1e6:.1f} MB workbook) ...")
+        for engine in args.engines:
+            seconds = time_engine(workbook_bytes, engine, args.repeat)
+            if seconds is None:
+                print(f"  {engine}: not installed, skipped")
+                continue
+            results.append({'rows': num_rows, 'engine': engine, 'seconds': seconds,
+                            'rows_per_s': num_rows / seconds})
+
+    if results:
+        summary = pd.DataFrame(results).pivot(index='rows', columns='engine', values='seconds')
+        print(f"\nBest of {args.repeat} runs, seconds per read:")
+        print(summary.round(3).to_string())
+        print(f"\nConfigured order (EXCEL_READ_ENGINES): {EXCEL_READ_ENGINES}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# benchmark_flows.py
+"""
+Benchmarks the submit, agenda and report flows end to end on the local storage backend,
+splitting each flow's wall time into storage time (incl. injected latency) and CPU time.
+
+Run from the app folder (config.py reads .streamlit/secrets.toml):
+
+    python benchmark_flows.py --latency 0.15 --periods 6 --rows 2000
+
+Streamlit prints "missing ScriptRunContext" warnings in bare mode; they can be ignored.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import dropbox_utils
+from dropbox_utils import (
+    append_period_rows, read_period_data, read_all_period_data, patch_rows, upload_large_file,
+    compact_period_journal, export_dataframe_to_excel, is_gstin_submitted, MCM_ROW_KEY_COLUMNS
+)
+from storage_backends import LocalStorageClient, TimedStorageClient
+from config import DAR_PDFS_PATH
+
+def make_rows(mcm_period, num_rows, seed):
+    """Synthetic DAR rows shaped like the app's submissions."""
+    rng = np.random.default_rng(seed)
+    num_dars = max(1, num_rows // 4)
+    dar_ids = rng.integers(0, num_dars, num_rows)
+    return pd.DataFrame({
+        'mcm_period': mcm_period,
+        'audit_group_number': rng.integers(1, 31, num_rows).astype(float),
+        'audit_circle_number': rng.integers(1, 11, num_rows).astype(float),
+        'gstin': [f"33ABCDE{i:04d}F1Z5" for i in dar_ids],
+        'trade_name': [f"Trade Name {i}" for i in dar_ids],
+        'category': rng.choice(['Large', 'Medium', 'Small'], num_rows),
+        'audit_para_number': rng.integers(1, 15, num_rows).astype(float),
+        'audit_para_heading': [f"Short payment of tax on item {i}" for i in range(num_rows)],
+        'revenue_involved_lakhs_rs': rng.random(num_rows) * 50,
+        'revenue_recovered_lakhs_rs': rng.random(num_rows) * 10,
+        'status_of_para': rng.choice(['Agreed and Paid', 'Not agreed', 'Agreed yet to pay'], num_rows),
+        'record_created_date': [f"2025-01-{1 + i % 28:02d} 10:00:00" for i in range(num_rows)],
+        'dar_pdf_path': [f"{DAR_PDFS_PATH}/AG1_dar_{i}.pdf" for i in dar_ids],
+    })
+
+def timed_flow(client, name, flow_fn, results):
+    client.reset_stats()
+    start = time.perf_counter()
+    flow_fn()
+    wall = time.perf_counter() - start
+    storage = client.total_seconds()
+    calls = sum(op['calls'] for op in client.get_stats().values())
+    results.append({'flow': name, 'wall_s': wall, 'storage_s': storage,
+                    'cpu_s': max(wall - storage, 0.0), 'storage_calls': calls})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.1, help="Injected seconds per storage call")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="Injected bandwidth in Mbit/s (0 = unlimited)")
+    parser.add_argument('--periods', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=1000, help="Rows per period")
+    parser.add_argument('--pdf-mb', type=float, default=5.0, help="Size of the uploaded DAR PDF")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root_dir = tempfile.mkdtemp(prefix="e_mcm_benchmark_")
+    client = TimedStorageClient(LocalStorageClient(root_dir, args.latency, args.bandwidth), 'local')
+    try:
+        periods = [f"Period{i} 2025" for i in range(args.periods)]
+        print(f"Seeding {args.periods} periods x {args.rows} rows in {root_dir} ...")
+        for i, mcm_period in enumerate(periods):
+            append_period_rows(client, mcm_period, make_rows(mcm_period, args.rows, seed=i))
+            compact_period_journal(client, mcm_period)
+        current = periods[-1]
+        pdf_bytes = os.urandom(int(args.pdf_mb * 1024 * 1024))
+
+        def submit_flow():
+            # Mirrors upload_dar_tab: duplicate check, PDF upload, final check, append
+            is_gstin_submitted(client, current, "33ZZZZZ9999Z1Z5")
+            upload_large_file(client, pdf_bytes, f"{DAR_PDFS_PATH}/AG1_benchmark.pdf")
+            is_gstin_submitted(client, current, "33ZZZZZ9999Z1Z5")
+            append_period_rows(client, current, make_rows(current, 8, seed=int(time.time())))
+
+        def agenda_flow():
+            # Mirrors mcm_agenda_tab: load the period, save decisions for one assessee
+            df_period = read_period_data(client, current)
+            first_dar = df_period[df_period['gstin'] == df_period['gstin'].iloc[0]]
+            updates = [{**{col: row[col] for col in MCM_ROW_KEY_COLUMNS}, 'mcm_decision': 'Para closed'}
+                       for _, row in first_dar.iterrows()]
+            patch_rows(client, current, MCM_ROW_KEY_COLUMNS, updates)
+
+        def report_flow():
+            # Mirrors the PCO export of all periods
+            export_dataframe_to_excel(read_all_period_data(client))
+
+        results = []
+        for _ in range(args.repeat):
+            for name, flow_fn in [('submit', submit_flow), ('agenda', agenda_flow), ('report', report_flow)]:
+                timed_flow(client, name, flow_fn, results)
+
+        summary = pd.DataFrame(results).groupby('flow', sort=False).mean()
+        print(f"\nLatency {args.latency}s/call, bandwidth {args.bandwidth or 'unlimited'} Mbit/s, mean of {args.repeat} runs:")
+        print(summary.round(3).to_string())
+        print("\nDownload cache:", dropbox_utils.get_download_cache_stats())
+    finally:
+        shutil.rmtree(root_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
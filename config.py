@@ -1,4 +1,6 @@
 # # config.py
+import os
+import tempfile
 import streamlit as st
 
 # --- Dropbox Configuration ---
@@ -14,8 +16,90 @@ OFFICE_ORDERS_PATH = f"{DROPBOX_ROOT_PATH}/Office_Orders" # Path for allocation/
 MCM_DATA_PATH = f"{DROPBOX_ROOT_PATH}/mcm_dar_data.xlsx"
 LOG_SHEET_PATH = f"{DROPBOX_ROOT_PATH}/log_sheet.xlsx"
 LOG_FILE_PATH = f"{DROPBOX_ROOT_PATH}/log_sheet.xlsx"
+# Login activity: each flush of the in-memory buffer writes one small NDJSON file to the
+# events folder; a periodic rollup folds them into rollup.json. log_sheet.xlsx above is
+# the legacy log, read once to seed the rollup.
+LOGIN_LOG_PATH = f"{DROPBOX_ROOT_PATH}/login_log"
+LOGIN_LOG_EVENTS_PATH = f"{LOGIN_LOG_PATH}/events"
+LOGIN_LOG_ROLLUP_PATH = f"{LOGIN_LOG_PATH}/rollup.json"
+LOGIN_LOG_FLUSH_MAX_RECORDS = 20
+LOGIN_LOG_FLUSH_INTERVAL_SECONDS = 30
+LOGIN_LOG_ROLLUP_INTERVAL_SECONDS = 60 * 60
 SMART_AUDIT_DATA_PATH = f"{DROPBOX_ROOT_PATH}/smart_audit_data.xlsx"
 MCM_PERIODS_INFO_PATH = f"{DROPBOX_ROOT_PATH}/mcm_periods_info.xlsx"
+# Period-partitioned DAR data: one file per MCM period plus a small JSON manifest.
+# MCM_DATA_PATH above is the legacy single workbook, kept only for one-time migration.
+MCM_DATA_PARTITIONS_PATH = f"{DROPBOX_ROOT_PATH}/mcm_dar_data"
+MCM_DATA_MANIFEST_PATH = f"{MCM_DATA_PARTITIONS_PATH}/manifest.json"
+# Compact index of submitted GSTINs per MCM period, for instant duplicate checks
+MCM_DATA_KEY_INDEX_PATH = f"{MCM_DATA_PARTITIONS_PATH}/submitted_gstins.json"
+# Storage format for the period partitions: "parquet" (typed, columnar) or "xlsx".
+# Excel is still available to users through the "Download as Excel" export.
+MCM_DATA_STORAGE_FORMAT = "parquet"
+# Append-only submission journal: each DAR submission is a small immutable delta file,
+# folded into its period partition once enough deltas pile up (or on the periodic schedule).
+MCM_DATA_JOURNAL_PATH = f"{MCM_DATA_PARTITIONS_PATH}/journal"
+MCM_JOURNAL_COMPACTION_THRESHOLD = 20
+# Version history: partition files are immutable and are not deleted when replaced; every
+# commit is recorded per period in MCM_DATA_HISTORY_PATH, and compacted journal deltas are
+# moved to the archive, so any past state can be read, diffed or rolled back to.
+MCM_DATA_HISTORY_PATH = f"{MCM_DATA_PARTITIONS_PATH}/history"
+MCM_DATA_JOURNAL_ARCHIVE_PATH = f"{MCM_DATA_PARTITIONS_PATH}/journal_archive"
+# States older than this can no longer be read; the partitions and archived deltas that only
+# those states used are deleted after compaction
+MCM_DATA_HISTORY_RETENTION_DAYS = 180
+MCM_JOURNAL_COMPACTION_INTERVAL_SECONDS = 60 * 60
+# Optimistic concurrency: conflicting writes (file changed since it was read) are re-read,
+# re-applied and retried with exponential backoff.
+DROPBOX_WRITE_MAX_RETRIES = 6
+DROPBOX_WRITE_BACKOFF_SECONDS = 0.25
+
+# Large files (scanned DARs, office orders) are uploaded in chunks through an upload session;
+# a failed chunk is retried and the upload resumes from the last offset Dropbox acknowledged.
+DROPBOX_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Multiple of 4 MB, at most 150 MB
+DROPBOX_UPLOAD_CHUNK_RETRIES = 4
+
+# One Dropbox client (and HTTP connection pool) is shared by all sessions of the app process.
+DROPBOX_MAX_CONNECTIONS = 16
+DROPBOX_TOKEN_REFRESH_CHECK_SECONDS = 60  # How often the shared client checks its access token
+
+# --- Storage Backend ---
+# "dropbox" (production), "google" (Google Drive folder) or "local" (a directory on disk,
+# for offline runs and benchmarks). All paths above are used unchanged on every backend.
+STORAGE_BACKEND = st.secrets.get("storage_backend", "dropbox")
+GOOGLE_DRIVE_ROOT_FOLDER_ID = st.secrets.get("google_drive_root_folder_id", "")
+LOCAL_STORAGE_ROOT = st.secrets.get("local_storage_root", os.path.join(tempfile.gettempdir(), "e_mcm_local_storage"))
+LOCAL_STORAGE_LATENCY_SECONDS = float(st.secrets.get("local_storage_latency_seconds", 0.0))  # Injected per call
+LOCAL_STORAGE_BANDWIDTH_MBPS = float(st.secrets.get("local_storage_bandwidth_mbps", 0.0))   # 0 = unlimited
+# Local, process-wide cache of downloaded Dropbox files (validated against the file's rev).
+DROPBOX_CACHE_DIR = os.path.join(tempfile.gettempdir(), "e_mcm_dropbox_cache")
+DROPBOX_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DROPBOX_CACHE_MAX_FRAMES = 32  # Parsed DataFrames kept in memory alongside the raw bytes
+# Revisions and folder listings seen within this many seconds are trusted without asking
+# Dropbox again (shared by all sessions; writes made by this app update them immediately).
+DROPBOX_READ_CACHE_TTL_SECONDS = 10
+# Shared links of the DAR PDFs are listed once (one paginated call) and reused by all sessions
+# for this long; new uploads store their link in the 'dar_pdf_url' column instead.
+DAR_PDF_LINKS_CACHE_TTL_SECONDS = 6 * 3600
+# Engines tried in order when parsing .xlsx files; the first one installed and able to read
+# the file wins (calamine needs the python-calamine package; openpyxl always works).
+# Run benchmark_excel.py to compare them on data shaped like ours.
+EXCEL_READ_ENGINES = ["calamine", "openpyxl"]
+# Workbooks written to Dropbox are streamed into a temp file that stays in memory up to this size
+EXCEL_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+# Layout-mode PDF text extraction runs page ranges in a shared process pool (pdf_extract.py).
+# Workers are capped to the host's cores and recycled after a few ranges to bound their memory.
+PDF_EXTRACT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+PDF_EXTRACT_PAGES_PER_TASK = 8
+PDF_EXTRACT_MAX_TASKS_PER_CHILD = 16
+PDF_EXTRACT_PARALLEL_MIN_PAGES = 6  # Smaller PDFs are extracted in the app process
+# Extracted DAR text and AI extraction results, keyed by the SHA-256 of the PDF (see extraction_cache.py).
+# Entries expire after the TTL; the oldest are evicted once the folder exceeds the size limit.
+DAR_EXTRACTION_CACHE_PATH = f"{DROPBOX_ROOT_PATH}/extraction_cache"
+DAR_EXTRACTION_CACHE_TTL_SECONDS = 90 * 24 * 3600
+DAR_EXTRACTION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Local SQLite index mirroring the DAR and smart audit data for filtered lookups (rebuildable, safe to delete)
+DAR_INDEX_DB_PATH = os.path.join(tempfile.gettempdir(), "e_mcm_dar_index.sqlite3")
 
 
 # --- User Credentials ---
@@ -31,6 +115,14 @@ AUDIT_GROUP_NUMBERS = {
     f"audit_group{i}": i for i in range(1, 31)
 }
 # --- New Constants for DAR Data Enhancement ---
+# Column order of a stored DAR row (submission, workbook exports and benchmarks)
+SHEET_DATA_COLUMNS_ORDER = [
+    "mcm_period", "audit_group_number", "audit_circle_number", "gstin", "trade_name",
+    "category", "taxpayer_classification", "total_amount_detected_overall_rs",
+    "total_amount_recovered_overall_rs", "audit_para_number", "audit_para_heading",
+    "revenue_involved_rs", "revenue_recovered_rs", "status_of_para",
+    "para_classification_code", "risk_flags_data", "dar_pdf_path", "dar_pdf_url", "record_created_date"
+]
 
 TAXPAYER_CLASSIFICATION_OPTIONS = [
     "Trader – Jewellery & precious stones",
@@ -0,0 +1,199 @@
+# dar_index.py
+"""
+Local SQLite index mirroring the DAR data (per MCM period) and the smart audit allocations,
+with indexes on period, audit group, audit circle and GSTIN.
+
+Each source is re-synced only when its signature (partition, journal deltas or file rev)
+has changed, so a lookup normally costs one cached signature check plus an indexed query
+instead of loading and filtering a full DataFrame. The database is only a cache:
+delete the file or call rebuild_dar_index() and it is rebuilt from Dropbox on demand.
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from config import DAR_INDEX_DB_PATH, SMART_AUDIT_DATA_PATH
+from dropbox_utils import (
+    read_period_data, get_period_signature, read_from_spreadsheet, get_file_rev
+)
+from dar_schema import apply_dar_schema
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dar_rows (
+    mcm_period TEXT NOT NULL,
+    row_no INTEGER NOT NULL,
+    audit_group_number INTEGER,
+    audit_circle_number INTEGER,
+    gstin TEXT,
+    row_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_dar_period_group ON dar_rows (mcm_period, audit_group_number);
+CREATE INDEX IF NOT EXISTS idx_dar_period_circle ON dar_rows (mcm_period, audit_circle_number);
+CREATE INDEX IF NOT EXISTS idx_dar_gstin_period ON dar_rows (gstin, mcm_period);
+CREATE INDEX IF NOT EXISTS idx_dar_group ON dar_rows (audit_group_number);
+
+CREATE TABLE IF NOT EXISTS smart_audit_rows (
+    row_no INTEGER NOT NULL,
+    allocated_group INTEGER,
+    allocated_circle INTEGER,
+    gstin TEXT,
+    row_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_smart_audit_group ON smart_audit_rows (allocated_group);
+CREATE INDEX IF NOT EXISTS idx_smart_audit_gstin ON smart_audit_rows (gstin);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    signature TEXT NOT NULL,
+    synced_at TEXT NOT NULL
+);
+"""
+
+_lock = threading.RLock()
+_connection = None
+
+def _get_connection():
+    """Opens (once per process) the index database, rebuilding it if its schema is outdated."""
+    global _connection
+    with _lock:
+        if _connection is None:
+            _connection = sqlite3.connect(DAR_INDEX_DB_PATH, check_same_thread=False)
+            _connection.execute("PRAGMA journal_mode=WAL")
+            if _connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                _drop_all(_connection)
+            _connection.executescript(SCHEMA)
+            _connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return _connection
+
+def _drop_all(conn):
+    for table in ('dar_rows', 'smart_audit_rows', 'sync_state'):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+def rebuild_dar_index():
+    """Empties the index; every source is reloaded from Dropbox on its next lookup."""
+    with _lock:
+        conn = _get_connection()
+        _drop_all(conn)
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+def _int_or_none(series):
+    return [None if pd.isna(v) else int(v) for v in pd.to_numeric(series, errors='coerce')]
+
+def _text_or_none(series):
+    return [None if pd.isna(v) else str(v).strip() for v in series]
+
+def _column(df, col):
+    return df[col] if col in df.columns else pd.Series([None] * len(df), index=df.index)
+
+def _row_jsons(df):
+    """Serializes each row to JSON (NaN becomes null, numpy scalars become plain numbers)."""
+    return [json.dumps(row) for row in json.loads(df.to_json(orient='records', date_format='iso'))]
+
+def _is_synced(conn, source, signature):
+    row = conn.execute("SELECT signature FROM sync_state WHERE source = ?", (source,)).fetchone()
+    return row is not None and row[0] == signature
+
+def _mark_synced(conn, source, signature):
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_state (source, signature, synced_at) VALUES (?, ?, ?)",
+        (source, signature, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+
+def sync_period_index(dbx, mcm_period):
+    """Reloads one MCM period into the index if its data changed since the last sync."""
+    source = f"period:{mcm_period}"
+    signature = get_period_signature(dbx, mcm_period)
+    conn = _get_connection()
+    with _lock:
+        if _is_synced(conn, source, signature):
+            return
+    df_period = read_period_data(dbx, mcm_period).reset_index(drop=True)
+    records = list(zip(
+        [mcm_period] * len(df_period), range(len(df_period)),
+        _int_or_none(_column(df_period, 'audit_group_number')),
+        _int_or_none(_column(df_period, 'audit_circle_number')),
+        _text_or_none(_column(df_period, 'gstin')),
+        _row_jsons(df_period)
+    ))
+    with _lock:
+        conn.execute("DELETE FROM dar_rows WHERE mcm_period = ?", (mcm_period,))
+        conn.executemany("INSERT INTO dar_rows VALUES (?, ?, ?, ?, ?, ?)", records)
+        _mark_synced(conn, source, signature)
+        conn.commit()
+
+def sync_smart_audit_index(dbx):
+    """Reloads the smart audit allocations into the index if the workbook changed."""
+    signature = get_file_rev(dbx, SMART_AUDIT_DATA_PATH) or ''
+    conn = _get_connection()
+    with _lock:
+        if _is_synced(conn, 'smart_audit', signature):
+            return
+    df_smart = read_from_spreadsheet(dbx, SMART_AUDIT_DATA_PATH, known_rev=signature or None).reset_index(drop=True)
+    records = list(zip(
+        range(len(df_smart)),
+        _int_or_none(_column(df_smart, 'Allocated Audit Group Number')),
+        _int_or_none(_column(df_smart, 'Allocated Circle')),
+        _text_or_none(_column(df_smart, 'GSTIN')),
+        _row_jsons(df_smart)
+    ))
+    with _lock:
+        conn.execute("DELETE FROM smart_audit_rows")
+        conn.executemany("INSERT INTO smart_audit_rows VALUES (?, ?, ?, ?, ?)", records)
+        _mark_synced(conn, 'smart_audit', signature)
+        conn.commit()
+
+def _rows_to_frame(rows):
+    return pd.DataFrame([json.loads(row[0]) for row in rows])
+
+def query_dar_rows(dbx, mcm_period, audit_group_number=None, audit_circle_number=None, gstin=None):
+    """
+    Returns the DAR rows of an MCM period, optionally filtered by audit group, audit circle
+    and/or GSTIN, via the local index. Rows keep their order within the period.
+    """
+    try:
+        sync_period_index(dbx, mcm_period)
+        clauses, params = ["mcm_period = ?"], [mcm_period]
+        for col, value in [('audit_group_number', audit_group_number),
+                           ('audit_circle_number', audit_circle_number)]:
+            if value is not None:
+                clauses.append(f"{col} = ?")
+                params.append(int(value))
+        if gstin is not None:
+            clauses.append("gstin = ?")
+            params.append(str(gstin).strip())
+        with _lock:
+            rows = _get_connection().execute(
+                f"SELECT row_json FROM dar_rows WHERE {' AND '.join(clauses)} ORDER BY row_no", params
+            ).fetchall()
+        return apply_dar_schema(_rows_to_frame(rows))
+    except sqlite3.Error as e:
+        st.error(f"Error querying the local DAR index: {e}")
+        return pd.DataFrame()
+
+def query_smart_audit_rows(dbx, allocated_group=None, gstin=None):
+    """Returns smart audit allocation rows, optionally filtered by allocated group and/or GSTIN."""
+    try:
+        sync_smart_audit_index(dbx)
+        clauses, params = [], []
+        if allocated_group is not None:
+            clauses.append("allocated_group = ?")
+            params.append(int(allocated_group))
+        if gstin is not None:
+            clauses.append("gstin = ?")
+            params.append(str(gstin).strip())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with _lock:
+            rows = _get_connection().execute(
+                f"SELECT row_json FROM smart_audit_rows {where} ORDER BY row_no", params
+            ).fetchall()
+        return _rows_to_frame(rows)
+    except sqlite3.Error as e:
+        st.error(f"Error querying the local smart audit index: {e}")
+        return pd.DataFrame()
@@ -1,49 +1,200 @@
 # dar_processor.py
-import pdfplumber
 import google.generativeai as genai
+import hashlib
 import json
+import re
 import requests
+from collections import Counter
 import streamlit as st
 from typing import List, Dict, Any, Tuple
 from models import ParsedDARReport, DARHeaderSchema, AuditParaSchema
-from config import BATCH_SYSTEM_PROMPT, TAXPAYER_CLASSIFICATION_OPTIONS
+from dar_stream_parser import DARReportStreamParser
+from config import BATCH_SYSTEM_PROMPT, TAXPAYER_CLASSIFICATION_OPTIONS, GST_RISK_PARAMETERS
+from pdf_extract import extract_pdf_text
 
 def preprocess_pdf_text(pdf_path_or_bytes) -> str:
     """
     Extracts all text from all pages of the PDF using pdfplumber,
     attempting to preserve layout for better LLM understanding.
+    Page ranges are extracted in parallel worker processes (see pdf_extract.py).
     """
-    processed_text_parts = []
     try:
-        with pdfplumber.open(pdf_path_or_bytes) as pdf:
-            for i, page in enumerate(pdf.pages):
-                page_text = page.extract_text(x_tolerance=2, y_tolerance=2, layout=True)
-                if page_text is None:
-                    page_text = f"[INFO: Page {i + 1} yielded no text directly]"
-                else:
-                    page_text = page_text.replace("None", "")
-                processed_text_parts.append(f"\n--- PAGE {i + 1} ---\n{page_text}")
-        full_text = "".join(processed_text_parts)
-        return full_text
+        if isinstance(pdf_path_or_bytes, (bytes, bytearray)):
+            pdf_bytes = bytes(pdf_path_or_bytes)
+        elif hasattr(pdf_path_or_bytes, 'read'):
+            pdf_path_or_bytes.seek(0)
+            pdf_bytes = pdf_path_or_bytes.read()
+        else:
+            with open(pdf_path_or_bytes, 'rb') as f:
+                pdf_bytes = f.read()
+        return extract_pdf_text(pdf_bytes)
     except Exception as e:
         error_msg = f"Error processing PDF with pdfplumber: {type(e).__name__} - {e}"
         print(error_msg)
         return error_msg
 
-def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
+GSTIN_PATTERN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")
+
+def find_gstins_in_text(text_content: str) -> List[str]:
+    """Returns the distinct GSTINs found in the text, most frequent first."""
+    return [gstin for gstin, _ in Counter(GSTIN_PATTERN.findall(text_content.upper())).most_common()]
+
+# --- Page relevance pre-pass ---
+# Layout-mode text pads every line to the page width and DARs carry long annexures, so only
+# the pages that look like header or para content are sent to the model, whitespace collapsed.
+
+PAGE_MARKER_PATTERN = re.compile(r"\n--- PAGE (\d+) ---\n")
+PARA_PATTERN = re.compile(r"\bpara(?:graph)?\b", re.IGNORECASE)
+RUPEE_AMOUNT_PATTERN = re.compile(r"(?:\bRs\.?|₹)\s*[\d,]+(?:\.\d+)?", re.IGNORECASE)
+RISK_CODE_PATTERN = re.compile(r"\bP\s?0?(\d{1,2})\b")
+RISK_CODE_NUMBERS = {int(code[1:]) for code in GST_RISK_PARAMETERS}
+HEADER_PAGES = 2        # The first pages hold the taxpayer details and the summary
+PAGE_MIN_SCORE = 3      # Pages scoring below this are left out of the prompt
+
+def split_pages(text_content: str) -> List[Tuple[int, str]]:
+    """Splits preprocess_pdf_text output into (page number, page text) pairs."""
+    parts = PAGE_MARKER_PATTERN.split(text_content)
+    return [(int(parts[i]), parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+def score_page(page_text: str) -> int:
+    """Relevance of a page to the header and para summary: GSTINs, para mentions, Rs. amounts and risk codes."""
+    risk_codes = sum(1 for code in RISK_CODE_PATTERN.findall(page_text) if int(code) in RISK_CODE_NUMBERS)
+    return (3 * len(GSTIN_PATTERN.findall(page_text.upper()))
+            + 2 * len(PARA_PATTERN.findall(page_text))
+            + len(RUPEE_AMOUNT_PATTERN.findall(page_text))
+            + risk_codes)
+
+def collapse_whitespace(text_content: str) -> str:
+    """Collapses layout padding: runs of spaces become one, blank lines are dropped."""
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in text_content.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def select_relevant_text(text_content: str) -> str:
     """
-    Calls the OpenRouter API with the PDF text and parses the response.
-    Returns a ParsedDARReport object.
+    The header pages and every page scoring at least PAGE_MIN_SCORE, with their page markers,
+    whitespace collapsed. Falls back to the full (collapsed) text if no page can be scored.
     """
-    if text_content.startswith("Error processing PDF"):
-        return ParsedDARReport(parsing_errors=text_content)
-
-    openrouter_api_key = st.secrets.get("openrouter_api_key", "")
-    if not openrouter_api_key:
-        error_msg = "OpenRouter API key not found in Streamlit secrets."
-        return ParsedDARReport(parsing_errors=error_msg)
-
-    prompt = f"""
+    pages = split_pages(text_content)
+    relevant = [(number, page_text) for number, page_text in pages
+                if number <= HEADER_PAGES or score_page(page_text) >= PAGE_MIN_SCORE]
+    if not relevant:
+        return collapse_whitespace(text_content)
+    return "\n".join(f"--- PAGE {number} ---\n{collapse_whitespace(page_text)}" for number, page_text in relevant)
+
+# --- Regex header pre-extractor ---
+# The GSTIN, audit group, overall amounts and risk codes follow fixed patterns, so they are
+# read from the text directly, each with a confidence. Fields at or above
+# HEADER_MIN_CONFIDENCE are not asked of the model, and the whole pre-extracted header is
+# the fallback when the model cannot be reached. Values are looked for on the header pages
+# first; values only found further in (annexures, cited cases) stay below the threshold.
+
+HEADER_MIN_CONFIDENCE = 0.8
+OFF_HEADER_CONFIDENCE_FACTOR = 0.5  # Applied to values not found on the header pages
+RISK_FLAG_CONFIDENCE = 0.6          # Risk codes are only the fallback when the model cannot be reached
+HEADER_RISK_CODE_PATTERN = re.compile(r"\bP0?(\d{1,2})\b")
+AUDIT_GROUP_PATTERN = re.compile(r"\bGroup\s*[-–:.]?\s*(?:No\.?\s*)?([IVXL]{1,6}|\d{1,2})\b", re.IGNORECASE)
+TRADE_NAME_PATTERNS = [
+    (re.compile(r"(?:Trade|Legal)\s+Name[^:\n]{0,30}[:\-]\s*(?:M/s\.?\s*)?([^\n]{3,100})", re.IGNORECASE), 0.85),
+    (re.compile(r"\bM/s\.?\s*([A-Z][^\n,()]{2,100})"), 0.6),
+]
+CATEGORY_PATTERN = re.compile(r"\bCategory[^:\n]{0,30}[:\-]?\s*(Large|Medium|Small)\b", re.IGNORECASE)
+AMOUNT_VALUE = r"(?:Rs\.?|₹|INR)\s*([\d,]+(?:\.\d+)?)\s*(lakhs?|lacs?|crores?)?"
+TOTAL_DETECTED_PATTERN = re.compile(r"total[^\n]{0,40}?detect\w*[^\n]{0,60}?" + AMOUNT_VALUE, re.IGNORECASE)
+TOTAL_RECOVERED_PATTERN = re.compile(r"total[^\n]{0,40}?recover\w*[^\n]{0,60}?" + AMOUNT_VALUE, re.IGNORECASE)
+ROMAN_NUMERALS = {'I': 1, 'V': 5, 'X': 10, 'L': 50}
+AMOUNT_MULTIPLIERS = {'lakh': 1e5, 'lac': 1e5, 'crore': 1e7}
+
+def _roman_to_int(numeral: str) -> int:
+    values = [ROMAN_NUMERALS[ch] for ch in numeral.upper()]
+    return sum(-v if i + 1 < len(values) and v < values[i + 1] else v for i, v in enumerate(values))
+
+def parse_rupee_amount(number: str, unit: str = None) -> float:
+    """'5,50,000' -> 550000.0; a 'lakh'/'crore' unit multiplies the number."""
+    value = float(number.replace(',', ''))
+    for prefix, multiplier in AMOUNT_MULTIPLIERS.items():
+        if unit and unit.lower().startswith(prefix):
+            return value * multiplier
+    return value
+
+def _most_common(values: List[Any]) -> Tuple[Any, float]:
+    """The most frequent value and its share of all values (as a confidence)."""
+    if not values:
+        return None, 0.0
+    value, count = Counter(values).most_common(1)[0]
+    return value, count / len(values)
+
+def header_pages_text(text_content: str) -> str:
+    """The text of the first HEADER_PAGES pages (the whole text if it has no page markers)."""
+    pages = split_pages(text_content)
+    if not pages:
+        return text_content
+    return "\n".join(page_text for number, page_text in pages if number <= HEADER_PAGES)
+
+def _header_first(find, header_text: str, text_content: str) -> Tuple[List[Any], float]:
+    """find() on the header pages, or on the whole text at OFF_HEADER_CONFIDENCE_FACTOR if they have no match."""
+    values = find(header_text)
+    if values:
+        return values, 1.0
+    return find(text_content), OFF_HEADER_CONFIDENCE_FACTOR
+
+def _audit_groups(text: str) -> List[int]:
+    groups = []
+    for match in AUDIT_GROUP_PATTERN.findall(text):
+        number = int(match) if match.isdigit() else _roman_to_int(match)
+        if 1 <= number <= 30:
+            groups.append(number)
+    return groups
+
+def _trade_names(pattern, text: str) -> List[str]:
+    # Layout text puts other columns on the same line, after a wide gap
+    names = [re.split(r"\s{3,}", name)[0].strip(" .:-") for name in pattern.findall(text)]
+    return [name for name in names if name]
+
+def pre_extract_header(text_content: str) -> Tuple[DARHeaderSchema, Dict[str, float]]:
+    """
+    Reads the header fields that follow fixed patterns from the DAR text, without an LLM.
+    Returns the header and {field: confidence between 0 and 1} for the fields it found.
+    """
+    header, confidences = {}, {}
+    header_text = header_pages_text(text_content)
+
+    def read_field(field, find, confidence=1.0):
+        values, factor = _header_first(find, header_text, text_content)
+        value, share = _most_common(values)
+        header[field], confidences[field] = value, confidence * share * factor
+
+    read_field('gstin', lambda text: GSTIN_PATTERN.findall(text.upper()))
+    read_field('audit_group_number', _audit_groups)
+
+    for pattern, confidence in TRADE_NAME_PATTERNS:
+        read_field('trade_name', lambda text: _trade_names(pattern, text), confidence)
+        if header['trade_name']:
+            break
+
+    read_field('category', lambda text: [category.capitalize() for category in CATEGORY_PATTERN.findall(text)])
+
+    for field, pattern in [('total_amount_detected_overall_rs', TOTAL_DETECTED_PATTERN),
+                           ('total_amount_recovered_overall_rs', TOTAL_RECOVERED_PATTERN)]:
+        # The most frequent total is kept; disagreeing totals lower the confidence
+        read_field(field, lambda text: [parse_rupee_amount(number, unit) for number, unit in pattern.findall(text)], 0.85)
+
+    # P-codes also turn up as table labels and references in the paras, so only the header
+    # pages are read, and below HEADER_MIN_CONFIDENCE: the model's own list is kept when it answers
+    risk_codes = {f"P{int(code):02d}" for code in HEADER_RISK_CODE_PATTERN.findall(header_text)}
+    header['risk_flags'] = sorted((code for code in risk_codes if code in GST_RISK_PARAMETERS), key=lambda c: int(c[1:]))
+    confidences['risk_flags'] = RISK_FLAG_CONFIDENCE
+
+    confidences = {field: round(conf, 2) for field, conf in confidences.items() if header.get(field) not in (None, [])}
+    return DARHeaderSchema(**{field: value for field, value in header.items() if value is not None}), confidences
+
+def resolved_header_fields(header: DARHeaderSchema, confidences: Dict[str, float]) -> Dict[str, Any]:
+    """The pre-extracted header values confident enough to skip asking the model for them."""
+    return {field: getattr(header, field) for field, conf in confidences.items() if conf >= HEADER_MIN_CONFIDENCE}
+
+# Model and prompt of the DAR extraction. DAR_EXTRACTION_VERSION changes whenever either
+# (or the page selection) does, so cached extraction results (extraction_cache.py) from an older prompt are not reused.
+DAR_EXTRACTION_MODEL = "deepseek/deepseek-r1:free"
+DAR_EXTRACTION_PROMPT_TEMPLATE = """
     You are an expert GST audit report analyst. Based on the following text from a Departmental Audit Report (DAR),
     extract the specified information and structure it as a JSON object.
 
@@ -52,7 +203,7 @@ def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
       "header": {{
         "audit_group_number": "integer or null (e.g., 'Group-VI' becomes 6)",
         "gstin": "string or null", "trade_name": "string or null", "category": "string ('Large', 'Medium', 'Small') or null",
-        "taxpayer_classification": "string or null. Choose one from the following list: {TAXPAYER_CLASSIFICATION_OPTIONS}",
+        "taxpayer_classification": "string or null. Choose one from the following list: {taxpayer_classification_options}",
         "total_amount_detected_overall_rs": "float or null (in Rupees)",
         "total_amount_recovered_overall_rs": "float or null (in Rupees)",
         "risk_flags": "list of strings or null (e.g., ['P1', 'P04', 'P21'])"
@@ -77,6 +228,7 @@ def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
     #4.  **CRITICAL FOR REVENUE**: For `revenue_involved_rs` and `revenue_recovered_rs`, find the corresponding monetary amounts mentioned after the audit para headings in the text.Convert into the numeric value as a float. **For example, if the text says 'revenue involved is Rs. 5,50,000', the value must be `550000.0`**
     5.  If a value is not found, use null. All monetary values must be numbers (float).
     6.  The 'audit_paras' list should contain one object per para. If none found, provide an empty list [].
+    7.  These header fields were already read from the text; return null for them and do not spend effort on them: {known_header_fields}
     
     DAR Text Content:
     --- START OF DAR TEXT ---
@@ -86,41 +238,125 @@ def get_structured_data_from_llm(text_content: str) -> ParsedDARReport:
     Provide ONLY the JSON object as your response. Do not include any explanatory text.
     """
 
-    content_str_for_return = ""
+DAR_EXTRACTION_VERSION = hashlib.sha256(
+    f"{DAR_EXTRACTION_MODEL}\n{DAR_EXTRACTION_PROMPT_TEMPLATE}\n{TAXPAYER_CLASSIFICATION_OPTIONS}\n"
+    f"{HEADER_PAGES}/{PAGE_MIN_SCORE}/{HEADER_MIN_CONFIDENCE}/{OFF_HEADER_CONFIDENCE_FACTOR}/{RISK_FLAG_CONFIDENCE}".encode('utf-8')
+).hexdigest()[:16]
+
+def get_structured_data_from_llm(text_content: str, on_progress=None) -> ParsedDARReport:
+    """
+    Calls the OpenRouter API with the PDF text and parses the response.
+    Only the relevant pages (see select_relevant_text) are sent; if the answer does not
+    validate, the request is repeated once with the full text. Header fields that
+    pre_extract_header reads confidently are taken from the text, not from the model.
+    The answer is streamed: on_progress(header, paras) is called as soon as the header and
+    each para arrive, so a caller can show them before the model has finished.
+    Returns a ParsedDARReport object.
+    """
+    if text_content.startswith("Error processing PDF"):
+        return ParsedDARReport(parsing_errors=text_content)
+
+    pre_header, confidences = pre_extract_header(text_content)
+    known_fields = resolved_header_fields(pre_header, confidences)
+
+    openrouter_api_key = st.secrets.get("openrouter_api_key", "")
+    if not openrouter_api_key:
+        error_msg = "OpenRouter API key not found in Streamlit secrets."
+        return merge_pre_extracted_header(ParsedDARReport(parsing_errors=error_msg), pre_header, known_fields)
+
+    relevant_text = select_relevant_text(text_content)
+    full_text = collapse_whitespace(text_content)
+    parsed_report, retry_with_full_text = _extract_with_llm(relevant_text, openrouter_api_key, known_fields, on_progress)
+    if retry_with_full_text and relevant_text != full_text:
+        print(f"DAR extraction from the relevant pages did not validate ({parsed_report.parsing_errors}); retrying with the full text.")
+        parsed_report, _ = _extract_with_llm(full_text, openrouter_api_key, known_fields, on_progress)
+    return merge_pre_extracted_header(parsed_report, pre_header, known_fields)
+
+def merge_pre_extracted_header(parsed_report: ParsedDARReport, pre_header: DARHeaderSchema,
+                               known_fields: Dict[str, Any]) -> ParsedDARReport:
+    """
+    Fills the model's header with the confidently pre-extracted fields. If the model returned
+    no header (e.g. OpenRouter is down), the whole pre-extracted header is used instead.
+    """
+    if parsed_report.header is None:
+        if not pre_header.model_dump(exclude_defaults=True):
+            return parsed_report
+        note = "AI extraction unavailable; header fields were read from the text, please verify."
+        errors = f"{parsed_report.parsing_errors} ({note})" if parsed_report.parsing_errors else None
+        return parsed_report.model_copy(update={'header': pre_header, 'parsing_errors': errors})
+    return parsed_report.model_copy(update={'header': parsed_report.header.model_copy(update=known_fields)})
+
+def _extract_with_llm(text_content: str, openrouter_api_key: str, known_fields: Dict[str, Any],
+                      on_progress=None) -> Tuple[ParsedDARReport, bool]:
+    """
+    One streamed extraction request. on_progress(header, paras) is called whenever the header
+    or another para has been received. Returns (report, retry_with_full_text): the flag is set
+    when the model answered but nothing usable could be read from the answer.
+    """
+    known_header_fields = ", ".join(f"{field} = {value!r}" for field, value in known_fields.items()) or "none"
+    prompt = DAR_EXTRACTION_PROMPT_TEMPLATE.format(
+        taxpayer_classification_options=TAXPAYER_CLASSIFICATION_OPTIONS, text_content=text_content,
+        known_header_fields=known_header_fields
+    )
+
+    parser = DARReportStreamParser()
     try:
         response = requests.post(
             url="https://openrouter.ai/api/v1/chat/completions",
             headers={"Authorization": f"Bearer {openrouter_api_key}"},
             data=json.dumps({
-                "model": "deepseek/deepseek-r1:free",
-                "messages": [{"role": "user", "content": prompt}]
-            })
+                "model": DAR_EXTRACTION_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": True
+            }),
+            stream=True
         )
         if response.status_code != 200:
             error_text = f"API Error from OpenRouter: {response.status_code} - {response.text}"
-            return ParsedDARReport(parsing_errors=error_text)
+            return ParsedDARReport(parsing_errors=error_text), False
 
-        response_data = response.json()
-        content_str = response_data.get('choices', [{}])[0].get('message', {}).get('content', '')
-        content_str_for_return = content_str
-        
-        if content_str.strip().startswith("```json"):
-            content_str = content_str.strip()[7:-3].strip()
-        elif content_str.strip().startswith("```"):
-             content_str = content_str.strip()[3:-3].strip()
-        
-        if not content_str:
-            return ParsedDARReport(parsing_errors="LLM returned an empty response.")
-        
-        json_data = json.loads(content_str)
-        return ParsedDARReport(**json_data)
+        with response:
+            for content_chunk in _iter_stream_content(response):
+                header_completed, new_paras = parser.feed(content_chunk)
+                if on_progress and (header_completed or new_paras):
+                    on_progress(parser.header, parser.audit_paras)
     except requests.exceptions.RequestException as e:
-        return ParsedDARReport(parsing_errors=f"Network error calling OpenRouter API: {e}")
-    except json.JSONDecodeError as e:
-        err_msg = f"LLM output was not valid JSON: {e}. Raw response: {content_str_for_return[:500]}..."
-        return ParsedDARReport(parsing_errors=err_msg)
+        if parser.header is None and not parser.audit_paras:
+            return ParsedDARReport(parsing_errors=f"Network error calling OpenRouter API: {e}"), False
+        print(f"OpenRouter stream broke off ({e}); keeping the header and paras received.")
+    except OpenRouterStreamError as e:
+        return ParsedDARReport(parsing_errors=f"API Error from OpenRouter: {e}"), False
     except Exception as e:
-        return ParsedDARReport(parsing_errors=f"An unexpected error occurred: {e}")
+        return ParsedDARReport(parsing_errors=f"An unexpected error occurred: {e}"), False
+
+    parsed_report = parser.result()
+    if parsed_report.header is None and not parsed_report.audit_paras:
+        return ParsedDARReport(parsing_errors=parsed_report.parsing_errors or
+                               "LLM response contained neither header nor paras."), True
+    return parsed_report, False
+
+class OpenRouterStreamError(Exception):
+    """An error object sent inside the event stream (after the 200 response)."""
+
+def _iter_stream_content(response):
+    """Yields the content deltas of an OpenRouter server-sent event stream."""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or line.startswith(':'):
+            continue  # Keep-alive comments such as ": OPENROUTER PROCESSING"
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            continue
+        if event.get('error'):
+            raise OpenRouterStreamError(event['error'].get('message', event['error']))
+        delta = (event.get('choices') or [{}])[0].get('delta') or {}
+        if delta.get('content'):
+            yield delta['content']
 
 def get_para_classifications_from_llm(audit_para_headings: List[str]) -> (List[str], str):
     openrouter_api_key = st.secrets.get("openrouter_api_key", "")
@@ -0,0 +1,86 @@
+# dar_schema.py
+"""
+Column dtypes of the DAR data, derived from models.FlattenedAuditData and applied once
+when a period is loaded (read_period_data / the local DAR index). Views can then use the
+columns directly instead of re-running pd.to_numeric, .fillna and .astype on every render.
+
+- amounts are float64
+- group, circle and para numbers are nullable small ints (Int16)
+- low-cardinality text columns are pandas categoricals
+"""
+import typing
+
+import pandas as pd
+
+from models import FlattenedAuditData
+
+def _field_dtype(annotation):
+    """Maps a model field annotation (e.g. Optional[int]) to its pandas dtype."""
+    types = [t for t in typing.get_args(annotation) if t is not type(None)] or [annotation]
+    if types[0] is int:
+        return 'Int16'
+    if types[0] is float:
+        return 'float64'
+    return None
+
+DAR_COLUMN_DTYPES = {
+    name: dtype for name, field in FlattenedAuditData.model_fields.items()
+    if (dtype := _field_dtype(field.annotation))
+}
+# Columns added when a DAR is stored (not extracted from the PDF)
+DAR_COLUMN_DTYPES.update({
+    'audit_circle_number': 'Int16',
+    'revenue_involved_lakhs_rs': 'float64',
+    'revenue_recovered_lakhs_rs': 'float64',
+})
+
+DAR_CATEGORICAL_COLUMNS = [
+    'category', 'status_of_para', 'para_classification_code', 'taxpayer_classification', 'mcm_period'
+]
+
+def _to_small_int(series):
+    numbers = pd.to_numeric(series, errors='coerce')
+    # Keep floats if a value is not a whole number, rather than silently rounding it
+    if not (numbers.dropna() % 1 == 0).all():
+        return numbers.astype('float64')
+    return numbers.astype('Int16')
+
+def apply_dar_schema(df):
+    """Converts the DAR columns of df to their schema dtypes (in place) and returns df."""
+    for col, dtype in DAR_COLUMN_DTYPES.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if dtype == 'Int16':
+            df[col] = _to_small_int(df[col])
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    for col in DAR_CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            values = df[col].astype(object)
+            df[col] = values.where(values.isna(), values.astype(str)).astype('category')
+    return df
+
+def fill_missing(df, col, value):
+    """
+    df[col] with missing values replaced by `value` (all `value` if the column is absent).
+    Works for categorical columns, where a plain fillna rejects values that are not a category.
+    """
+    if col not in df.columns:
+        return pd.Series(value, index=df.index)
+    series = df[col]
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+def to_plain_dtypes(df):
+    """
+    Copy of df with categoricals as text and small ints as floats, e.g. for editors that
+    should accept any value and for cell-by-cell comparisons (pd.NA does not compare).
+    """
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+        elif df[col].dtype == 'Int16':
+            df[col] = df[col].astype('float64')
+    return df
@@ -0,0 +1,102 @@
+# dar_stream_parser.py
+"""
+Incremental parser for the DAR extraction JSON as the model streams it.
+
+The text is scanned once as it arrives, tracking strings and nesting, so the "header"
+object is available as soon as its closing brace arrives and each object of the
+"audit_paras" list as soon as it is complete, long before the whole answer is in.
+Anything before the first "{" (a ```json fence, stray words) is ignored. If the answer
+ends malformed or cut off, the header and paras already completed are still returned.
+"""
+import json
+from typing import List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from models import ParsedDARReport, DARHeaderSchema, AuditParaSchema
+
+class DARReportStreamParser:
+    def __init__(self):
+        self.text = ""
+        self.header: Optional[DARHeaderSchema] = None
+        self.audit_paras: List[AuditParaSchema] = []
+        self.skipped_items = 0      # Completed objects that did not validate
+        self._pos = 0
+        self._root_started = False
+        self._root_closed = False
+        self._stack = []            # [kind ('{' or '['), start index, key in the parent, current key]
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._last_string = None
+
+    def feed(self, chunk: str) -> Tuple[bool, int]:
+        """
+        Adds streamed text. Returns (header_completed, new_para_count) for this chunk,
+        so callers only redraw when something new is available.
+        """
+        self.text += chunk
+        header_completed, paras_before = False, len(self.audit_paras)
+        while self._pos < len(self.text) and not self._root_closed:
+            ch = self.text[self._pos]
+            if not self._root_started:
+                if ch == '{':
+                    self._root_started = True
+                    self._stack.append(['{', self._pos, None, None])
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = self.text[self._string_start + 1:self._pos]
+            elif ch == '"':
+                self._in_string, self._string_start = True, self._pos
+            elif ch == ':' and self._stack[-1][0] == '{':
+                self._stack[-1][3] = self._last_string
+            elif ch in '{[':
+                parent = self._stack[-1]
+                self._stack.append([ch, self._pos, parent[3] if parent[0] == '{' else None, None])
+            elif ch in '}]':
+                kind, start, key, _ = self._stack.pop()
+                if not self._stack:
+                    self._root_closed = True
+                elif kind == '{':
+                    header_completed |= self._on_object(self.text[start:self._pos + 1], key)
+            self._pos += 1
+        return header_completed, len(self.audit_paras) - paras_before
+
+    def _on_object(self, raw: str, key: Optional[str]) -> bool:
+        """Handles a completed object; returns True if it was the header."""
+        depth = len(self._stack)
+        try:
+            if depth == 1 and key == 'header':
+                self.header = DARHeaderSchema(**json.loads(raw))
+                return True
+            if depth == 2 and self._stack[-1][0] == '[' and self._stack[-1][2] == 'audit_paras':
+                self.audit_paras.append(AuditParaSchema(**json.loads(raw)))
+        except (ValueError, ValidationError):
+            self.skipped_items += 1
+        return False
+
+    def result(self) -> ParsedDARReport:
+        """
+        The full report if the streamed text is valid JSON; otherwise the header and paras
+        completed so far, with a parsing error describing the malformed tail.
+        """
+        start, end = self.text.find('{'), self.text.rfind('}')
+        if start != -1 and end > start:
+            try:
+                return ParsedDARReport(**json.loads(self.text[start:end + 1]))
+            except (ValueError, ValidationError):
+                pass
+        if self.header is None and not self.audit_paras:
+            if not self.text.strip():
+                return ParsedDARReport(parsing_errors="LLM returned an empty response.")
+            return ParsedDARReport(parsing_errors=f"LLM output was not valid JSON. Raw response: {self.text[:500]}...")
+        note = (f"LLM output was incomplete or malformed after {len(self.audit_paras)} para(s); "
+                "the header and paras received before that are kept, please check for missing paras.")
+        if self.skipped_items:
+            note += f" {self.skipped_items} item(s) could not be read."
+        return ParsedDARReport(header=self.header, audit_paras=self.audit_paras, parsing_errors=note)
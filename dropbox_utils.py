@@ -1,63 +1,293 @@
 # dropbox_utils.py
 import streamlit as st
 import dropbox
-from datetime import datetime
-from dropbox.exceptions import AuthError, ApiError
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import atexit
+import uuid
+from collections import Counter, OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from dropbox.exceptions import AuthError, ApiError, InternalServerError, RateLimitError
 from io import BytesIO
 import pandas as pd
+import pyarrow.parquet as pq
+import requests
+import xlsxwriter
 # Import the new config variable
 # Import config variables, including LOG_FILE_PATH
 from config import (
-    DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN, LOG_FILE_PATH
+    DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN, LOG_FILE_PATH,
+    LOGIN_LOG_EVENTS_PATH, LOGIN_LOG_ROLLUP_PATH, LOGIN_LOG_FLUSH_MAX_RECORDS,
+    LOGIN_LOG_FLUSH_INTERVAL_SECONDS, LOGIN_LOG_ROLLUP_INTERVAL_SECONDS,
+    MCM_DATA_PATH, MCM_DATA_PARTITIONS_PATH, MCM_DATA_MANIFEST_PATH, MCM_DATA_STORAGE_FORMAT,
+    MCM_DATA_KEY_INDEX_PATH,
+    EXCEL_READ_ENGINES, EXCEL_SPOOL_MAX_BYTES,
+    DROPBOX_CACHE_DIR, DROPBOX_CACHE_MAX_BYTES, DROPBOX_CACHE_MAX_FRAMES, DROPBOX_READ_CACHE_TTL_SECONDS,
+    DAR_PDFS_PATH, DAR_PDF_LINKS_CACHE_TTL_SECONDS,
+    MCM_DATA_JOURNAL_PATH, MCM_JOURNAL_COMPACTION_THRESHOLD, MCM_JOURNAL_COMPACTION_INTERVAL_SECONDS,
+    MCM_DATA_HISTORY_PATH, MCM_DATA_JOURNAL_ARCHIVE_PATH, MCM_DATA_HISTORY_RETENTION_DAYS,
+    DROPBOX_WRITE_MAX_RETRIES, DROPBOX_WRITE_BACKOFF_SECONDS,
+    DROPBOX_UPLOAD_CHUNK_SIZE, DROPBOX_UPLOAD_CHUNK_RETRIES,
+    DROPBOX_MAX_CONNECTIONS, DROPBOX_TOKEN_REFRESH_CHECK_SECONDS,
+    STORAGE_BACKEND, GOOGLE_DRIVE_ROOT_FOLDER_ID, LOCAL_STORAGE_ROOT,
+    LOCAL_STORAGE_LATENCY_SECONDS, LOCAL_STORAGE_BANDWIDTH_MBPS
 )
+from storage_backends import LocalStorageClient, TimedStorageClient, create_google_drive_client
+from dar_schema import apply_dar_schema
+
+# Columns stored as float64 in columnar partitions, so readers get numbers back
+# instead of re-running pd.to_numeric on every load.
+MCM_NUMERIC_COLUMNS = [
+    'audit_group_number', 'audit_circle_number', 'audit_para_number',
+    'total_amount_detected_overall_rs', 'total_amount_recovered_overall_rs',
+    'revenue_involved_rs', 'revenue_recovered_rs',
+    'revenue_involved_lakhs_rs', 'revenue_recovered_lakhs_rs'
+]
+
+# Columns that identify one DAR row within a period (used for row-level deletes and edits).
+# append_period_rows gives every row a random row_id: rows of one submission without a para
+# number share the other three values. Rows stored before row_id existed have none.
+MCM_ROW_ID_COLUMN = 'row_id'
+MCM_ROW_KEY_COLUMNS = ['gstin', 'audit_para_number', 'record_created_date', MCM_ROW_ID_COLUMN]
+
+# --- Login Activity Log ---
+# Logins are buffered in memory and flushed as one small, uniquely named NDJSON file per
+# flush, so a login never reads or rewrites the history. rollup_login_log() folds the
+# event files into rollup.json as daily per-user login counts; get_login_daily_counts()
+# returns those buckets plus the pending events.
+LOG_COLUMNS = ['Timestamp', 'Username', 'Role']
+LOGIN_DAILY_COLUMNS = ['Date', 'Username', 'Role', 'Logins']
+
+class LoginLogBuffer:
+    """Process-wide buffer of login records, flushed by size, by timer and at exit."""
+
+    def __init__(self, max_records, interval_seconds):
+        self.max_records = max_records
+        self.interval_seconds = interval_seconds
+        self._records = []
+        self._dbx = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer_started = False
+
+    def add(self, dbx, record):
+        with self._lock:
+            self._records.append(record)
+            self._dbx = dbx
+            flush_now = len(self._records) >= self.max_records
+            start_timer = not self._timer_started
+            self._timer_started = True
+        if start_timer:
+            self._schedule()
+        if flush_now:
+            threading.Thread(target=self.flush, name="login-log-flush", daemon=True).start()
+
+    def _schedule(self):
+        def _tick():
+            self.flush()
+            self._schedule()
+        timer = threading.Timer(self.interval_seconds, _tick)
+        timer.daemon = True
+        timer.start()
+
+    def flush(self):
+        """Writes all buffered records as one NDJSON event file; keeps them if the upload fails."""
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+                dbx = self._dbx
+            if not records or dbx is None:
+                return True
+            content = "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+            event_path = f"{LOGIN_LOG_EVENTS_PATH}/{_new_object_name('ndjson')}"
+            try:
+                metadata = dbx.files_upload(content, event_path, mode=dropbox.files.WriteMode.add)
+            except Exception as e:
+                print(f"Login log flush failed, will retry: {e}")
+                with self._lock:
+                    self._records = records + self._records
+                return False
+            _recent_reads.written(event_path, metadata.rev)
+            return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._records)
+
+_login_log_buffer = LoginLogBuffer(LOGIN_LOG_FLUSH_MAX_RECORDS, LOGIN_LOG_FLUSH_INTERVAL_SECONDS)
+atexit.register(_login_log_buffer.flush)
 
 def log_activity(dbx, username, role):
-    """
-    Appends a new login activity record to the log file in Dropbox.
-    This function reads the existing file, adds a row, and re-uploads it.
-    """
+    """Records a login. Returns immediately; the record reaches Dropbox with the next buffer flush."""
     if not dbx:
         st.warning("Dropbox client is not available. Skipping activity logging.")
         return False
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    _login_log_buffer.add(dbx, {'Timestamp': timestamp, 'Username': username, 'Role': role})
+    return True
+
+def flush_login_log():
+    """Flushes this process's buffered login records now."""
+    return _login_log_buffer.flush()
+
+def _parse_login_rollup(content):
+    if not content:
+        return {}
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        st.error(f"Error reading the login log rollup from Dropbox: {e}")
+        return {}
+
+def _read_login_events(dbx, event_files):
+    records = []
+    for entry in event_files:
+        content = download_file(dbx, entry.path_display)
+        if content:
+            records.extend(json.loads(line) for line in content.decode('utf-8').splitlines() if line.strip())
+    return records
 
-    log_columns = ['Timestamp', 'Username', 'Role']
-    
-    # Read existing log data from the path specified in config
+def _legacy_login_records(dbx):
     df_logs = read_from_spreadsheet(dbx, LOG_FILE_PATH)
+    if df_logs.empty or list(df_logs.columns) != LOG_COLUMNS:
+        return []
+    timestamps = pd.to_datetime(df_logs['Timestamp'], errors='coerce')
+    df_logs = df_logs[timestamps.notna()].assign(Timestamp=timestamps.dt.strftime("%Y-%m-%d %H:%M:%S"))
+    return json.loads(df_logs.astype(str).to_json(orient='records'))
 
-    # If the file is empty or has wrong columns, create a new DataFrame in memory
-    if df_logs.empty or list(df_logs.columns) != log_columns:
-        df_logs = pd.DataFrame(columns=log_columns)
+def _add_to_daily_counts(daily_counts, records):
+    """Adds login records to {date: {username: {'role': role, 'logins': n}}} in place."""
+    for record in records:
+        day = daily_counts.setdefault(str(record['Timestamp'])[:10], {})
+        bucket = day.setdefault(record['Username'], {'role': record['Role'], 'logins': 0})
+        bucket['logins'] += 1
+    return daily_counts
 
-    # Append the new log entry
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    new_log_entry = pd.DataFrame([{'Timestamp': timestamp, 'Username': username, 'Role': role}])
-    df_logs = pd.concat([df_logs, new_log_entry], ignore_index=True)
+def rollup_login_log(dbx):
+    """
+    Folds pending login event files into the rollup and deletes them. The rollup remembers
+    which files it has folded, so concurrent rollups never count an event twice.
+    """
+    _login_log_buffer.flush()
+    event_files = _list_folder_files(dbx, LOGIN_LOG_EVENTS_PATH, "the login log")
 
-    # Upload the updated DataFrame back to Dropbox
-    if update_spreadsheet_from_df(dbx, df_logs, LOG_FILE_PATH):
+    def _apply(rollup):
+        if 'daily_counts' not in rollup:
+            # First rollup: seed from the legacy sheet (or a rollup that still holds raw records)
+            rollup['daily_counts'] = _add_to_daily_counts({}, rollup.pop('records', None) or _legacy_login_records(dbx))
+        present = {entry.name for entry in event_files}
+        already_folded = set(rollup.get('folded_events', [])) & present
+        new_files = [entry for entry in event_files if entry.name not in already_folded]
+        _add_to_daily_counts(rollup['daily_counts'], _read_login_events(dbx, new_files))
+        rollup['folded_events'] = sorted(already_folded | {entry.name for entry in new_files})
+        rollup['updated_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         return True
-    else:
-        st.error("Failed to update the log file in Dropbox.")
+
+    if not _update_json_file(dbx, LOGIN_LOG_ROLLUP_PATH, _parse_login_rollup, _apply, "the login log rollup"):
         return False
+    for entry in event_files:
+        _delete_quietly(dbx, entry.path_display)
+    return True
+
+def get_login_daily_counts(dbx):
+    """Returns logins per day and user (rollup plus not yet rolled-up events), one row per bucket."""
+    rollup = _parse_login_rollup(download_file(dbx, LOGIN_LOG_ROLLUP_PATH))
+    if 'daily_counts' in rollup:
+        daily_counts = rollup['daily_counts']
+    else:
+        daily_counts = _add_to_daily_counts({}, rollup.get('records') or _legacy_login_records(dbx))
+    folded = set(rollup.get('folded_events', []))
+    pending = [entry for entry in _list_folder_files(dbx, LOGIN_LOG_EVENTS_PATH, "the login log")
+               if entry.name not in folded]
+    _add_to_daily_counts(daily_counts, _read_login_events(dbx, pending))
+    rows = [(day, username, bucket['role'], bucket['logins'])
+            for day, users in daily_counts.items() for username, bucket in users.items()]
+    return pd.DataFrame(rows, columns=LOGIN_DAILY_COLUMNS)
+
+_login_rollup_scheduler_started = False
+
+def start_login_log_rollup_scheduler(dbx):
+    """Starts (once per process) a timer that rolls up the login log periodically."""
+    global _login_rollup_scheduler_started
+    with _compaction_lock:
+        if _login_rollup_scheduler_started:
+            return
+        _login_rollup_scheduler_started = True
+
+    def _tick():
+        try:
+            # This process's buffered logins are written first, so the rollup includes them
+            flush_login_log()
+            rollup_login_log(dbx)
+        except Exception as e:
+            print(f"Scheduled login log rollup failed: {e}")
+        timer = threading.Timer(LOGIN_LOG_ROLLUP_INTERVAL_SECONDS, _tick)
+        timer.daemon = True
+        timer.start()
+
+    threading.Thread(target=_tick, name="login-log-rollup-scheduler", daemon=True).start()
+_token_refresh_lock = threading.Lock()
+
+def refresh_dropbox_token(dbx):
+    """Refreshes the client's access token if it is about to expire (one thread at a time)."""
+    with _token_refresh_lock:
+        dbx.check_and_refresh_access_token()
+
+def _start_token_refresher(dbx):
+    """Keeps the shared client's token fresh in the background, so requests never wait on a refresh."""
+    def _tick():
+        try:
+            refresh_dropbox_token(dbx)
+        except Exception as e:
+            print(f"Dropbox token refresh failed: {e}")
+        timer = threading.Timer(DROPBOX_TOKEN_REFRESH_CHECK_SECONDS, _tick)
+        timer.daemon = True
+        timer.start()
+    _tick()
+
+@st.cache_resource(show_spinner=False)
+def _create_dropbox_client():
+    """
+    Builds the process-wide storage client for STORAGE_BACKEND (a pooled Dropbox client by
+    default), wrapped to record per-call timings. Raises on failure, so a failed connection
+    is not cached and the next session tries again.
+    """
+    if STORAGE_BACKEND == 'local':
+        client = LocalStorageClient(LOCAL_STORAGE_ROOT, LOCAL_STORAGE_LATENCY_SECONDS, LOCAL_STORAGE_BANDWIDTH_MBPS)
+        return TimedStorageClient(client, 'local')
+    if STORAGE_BACKEND == 'google':
+        client = create_google_drive_client(st.secrets["google_credentials"], GOOGLE_DRIVE_ROOT_FOLDER_ID)
+        return TimedStorageClient(client, 'google')
+
+    session = dropbox.create_session(max_connections=DROPBOX_MAX_CONNECTIONS)
+    dbx = dropbox.Dropbox(
+        app_key=DROPBOX_APP_KEY,
+        app_secret=DROPBOX_APP_SECRET,
+        oauth2_refresh_token=DROPBOX_REFRESH_TOKEN,
+        session=session
+    )
+    # Test the connection by getting the current user's account info (once per process)
+    dbx.users_get_current_account()
+    _start_token_refresher(dbx)
+    return TimedStorageClient(dbx, 'dropbox')
+
 def get_dropbox_client():
-    """Initializes and returns the Dropbox client using a refresh token."""
+    """
+    Returns the Dropbox client shared by all sessions, creating it on first use.
+    The client is thread-safe and reuses one connection pool of DROPBOX_MAX_CONNECTIONS.
+    """
     try:
         # Check if the secrets have been loaded into the config variables
-        if not all([DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN]):
+        if STORAGE_BACKEND == 'dropbox' and not all([DROPBOX_APP_KEY, DROPBOX_APP_SECRET, DROPBOX_REFRESH_TOKEN]):
             st.error("Dropbox credentials are not found in Streamlit secrets.")
             return None
-
-        # Initialize the client with the app key, secret, and refresh token
-        # The SDK will handle refreshing the access token automatically
-        dbx = dropbox.Dropbox(
-            app_key=DROPBOX_APP_KEY,
-            app_secret=DROPBOX_APP_SECRET,
-            oauth2_refresh_token=DROPBOX_REFRESH_TOKEN
-        )
-        # Test the connection by getting the current user's account info
-        dbx.users_get_current_account()
-        return dbx
+        return _create_dropbox_client()
         
     except AuthError as e:
         st.error(f"Authentication Error: Please check your Dropbox credentials. Details: {e}")
@@ -66,6 +296,10 @@ def get_dropbox_client():
         st.error(f"Failed to connect to Dropbox: {e}")
         return None
         
+def get_storage_timing_stats(dbx):
+    """Returns per-operation call counts and seconds spent in the storage backend."""
+    return dbx.get_stats() if isinstance(dbx, TimedStorageClient) else {}
+
 def get_shareable_link(dbx, dropbox_path):
     """Gets a shareable link for a file, creating one if it doesn't exist."""
     try:
@@ -87,49 +321,601 @@ def get_shareable_link(dbx, dropbox_path):
         print(f"Dropbox API error getting shareable link for {dropbox_path}: {e}")
         return None # Return None if a link can't be fetched or created
         
+# --- Revision-aware download cache ---
+
+class DownloadCache:
+    """
+    Process-wide, disk-backed LRU cache of downloaded Dropbox files.
+    Entries are keyed by path and only served while the file's Dropbox `rev` is unchanged,
+    so a rerun costs one files_get_metadata call instead of a full download.
+    Parsed DataFrames of cached files are also kept in memory (bounded by max_frames).
+    """
+    def __init__(self, cache_dir, max_bytes, max_frames):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # path_lower -> {'path', 'rev', 'content_hash', 'size'}
+        self._frames = OrderedDict()   # (path_lower, rev, variant) -> DataFrame
+        self._total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'frame_hits': 0, 'evictions': 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _file_stem(self, path_lower):
+        return os.path.join(self.cache_dir, hashlib.sha1(path_lower.encode('utf-8')).hexdigest())
+
+    def _load_index(self):
+        """Rebuilds the in-memory index from the sidecar files left by earlier processes."""
+        index_files = [f for f in os.listdir(self.cache_dir) if f.endswith('.json')]
+        index_files.sort(key=lambda f: os.path.getmtime(os.path.join(self.cache_dir, f)))
+        for index_file in index_files:
+            try:
+                with open(os.path.join(self.cache_dir, index_file), 'r', encoding='utf-8') as fh:
+                    entry = json.load(fh)
+                path_lower = entry['path'].lower()
+                if not os.path.exists(self._file_stem(path_lower) + '.bin'):
+                    continue
+                self._entries[path_lower] = entry
+                self._total_bytes += entry['size']
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def _remove_files(self, path_lower):
+        for ext in ('.bin', '.json'):
+            try:
+                os.remove(self._file_stem(path_lower) + ext)
+            except OSError:
+                pass
+
+    def get(self, dropbox_path, rev):
+        """Returns the cached bytes of a file if they match `rev`, else None."""
+        path_lower = dropbox_path.lower()
+        with self._lock:
+            entry = self._entries.get(path_lower)
+            if entry is None or entry['rev'] != rev:
+                self.stats['misses'] += 1
+                return None
+            try:
+                with open(self._file_stem(path_lower) + '.bin', 'rb') as fh:
+                    content = fh.read()
+            except OSError:
+                self._drop(path_lower)
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(path_lower)
+            self.stats['hits'] += 1
+            return content
+
+    def put(self, dropbox_path, rev, content_hash, content):
+        """Stores the bytes of a file at revision `rev` and evicts old entries if over budget."""
+        path_lower = dropbox_path.lower()
+        stem = self._file_stem(path_lower)
+        entry = {'path': dropbox_path, 'rev': rev, 'content_hash': content_hash, 'size': len(content)}
+        with self._lock:
+            self._drop(path_lower)
+            if entry['size'] > self.max_bytes:
+                return
+            try:
+                with open(stem + '.bin.tmp', 'wb') as fh:
+                    fh.write(content)
+                os.replace(stem + '.bin.tmp', stem + '.bin')
+                with open(stem + '.json', 'w', encoding='utf-8') as fh:
+                    json.dump(entry, fh)
+            except OSError as e:
+                print(f"Could not write download cache entry for {dropbox_path}: {e}")
+                return
+            self._entries[path_lower] = entry
+            self._total_bytes += entry['size']
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats['evictions'] += 1
+
+    def _drop(self, path_lower):
+        """Removes an entry and its parsed frames. Caller must hold the lock."""
+        entry = self._entries.pop(path_lower, None)
+        if entry is not None:
+            self._total_bytes -= entry['size']
+            self._remove_files(path_lower)
+        for key in [k for k in self._frames if k[0] == path_lower]:
+            del self._frames[key]
+
+    def invalidate(self, dropbox_path):
+        with self._lock:
+            self._drop(dropbox_path.lower())
+
+    def get_frame(self, dropbox_path, rev, variant=None):
+        """Returns a copy of the parsed DataFrame for `rev`, or None."""
+        key = (dropbox_path.lower(), rev, variant)
+        with self._lock:
+            df = self._frames.get(key)
+            if df is None:
+                return None
+            self._frames.move_to_end(key)
+            self.stats['frame_hits'] += 1
+            return df.copy()
+
+    def put_frame(self, dropbox_path, rev, df, variant=None):
+        key = (dropbox_path.lower(), rev, variant)
+        with self._lock:
+            self._frames[key] = df.copy()
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': (self.stats['hits'] / lookups) if lookups else 0.0,
+                'entries': len(self._entries),
+                'cached_bytes': self._total_bytes,
+                'cached_frames': len(self._frames)
+            }
+
+_download_cache = DownloadCache(DROPBOX_CACHE_DIR, DROPBOX_CACHE_MAX_BYTES, DROPBOX_CACHE_MAX_FRAMES)
+
+def get_download_cache_stats():
+    """Returns hit/miss/eviction counters and the current size of the download cache."""
+    return _download_cache.get_stats()
+
+class RecentReadCache:
+    """
+    Process-wide memory of the file revisions and folder listings seen in the last `ttl_seconds`.
+    Within the TTL a read skips the files_get_metadata / files_list_folder round trip and is
+    served straight from the download cache, so repeated reads of the same file by any session
+    cost nothing. Every write made through this module updates or invalidates the entries it touches.
+    """
+    _MISSING = object()
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._revs = {}      # path_lower -> (rev or _MISSING, checked_at)
+        self._listings = {}  # folder_lower -> (entries, checked_at)
+        self._path_stats = {}
+
+    def _count(self, dropbox_path, stat):
+        path_stats = self._path_stats.setdefault(dropbox_path.lower(), {'reads': 0, 'round_trips_saved': 0, 'invalidations': 0})
+        path_stats[stat] += 1
+
+    def _fresh(self, cached):
+        return cached is not None and time.monotonic() - cached[1] < self.ttl_seconds
+
+    def get_rev(self, dropbox_path):
+        """Returns (found, rev): found is False if the path must be checked with Dropbox."""
+        with self._lock:
+            self._count(dropbox_path, 'reads')
+            cached = self._revs.get(dropbox_path.lower())
+            if not self._fresh(cached):
+                return False, None
+            self._count(dropbox_path, 'round_trips_saved')
+            return True, (None if cached[0] is self._MISSING else cached[0])
+
+    def remember_rev(self, dropbox_path, rev):
+        """Records the current rev of a path (None if it does not exist)."""
+        with self._lock:
+            self._revs[dropbox_path.lower()] = (self._MISSING if rev is None else rev, time.monotonic())
+
+    def get_listing(self, folder_path):
+        with self._lock:
+            self._count(folder_path, 'reads')
+            cached = self._listings.get(folder_path.lower())
+            if not self._fresh(cached):
+                return None
+            self._count(folder_path, 'round_trips_saved')
+            return list(cached[0])
+
+    def remember_listing(self, folder_path, entries):
+        with self._lock:
+            self._listings[folder_path.lower()] = (list(entries), time.monotonic())
+
+    def invalidate(self, dropbox_path):
+        """Forgets a path and the listing of its parent folder."""
+        path_lower = dropbox_path.lower()
+        with self._lock:
+            self._revs.pop(path_lower, None)
+            self._listings.pop(path_lower.rsplit('/', 1)[0], None)
+            self._count(dropbox_path, 'invalidations')
+
+    def written(self, dropbox_path, rev):
+        """Called after a successful upload: the new rev is current, the parent listing is not."""
+        self.invalidate(dropbox_path)
+        self.remember_rev(dropbox_path, rev)
+
+    def get_stats(self):
+        with self._lock:
+            return {path: dict(path_stats) for path, path_stats in self._path_stats.items()}
+
+_recent_reads = RecentReadCache(DROPBOX_READ_CACHE_TTL_SECONDS)
+
+def get_read_cache_stats():
+    """Returns per-path counters of reads and the Dropbox round trips saved by the read cache."""
+    return _recent_reads.get_stats()
+
+def _is_not_found(error):
+    """True if a Dropbox ApiError payload means the path does not exist."""
+    return (hasattr(error, 'is_path') and error.is_path()
+            and hasattr(error.get_path(), 'is_not_found') and error.get_path().is_not_found())
+
 def upload_file(dbx, file_content, dropbox_path):
     """Uploads a file to a specific path in Dropbox."""
     try:
-        dbx.files_upload(file_content, dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
+        metadata = dbx.files_upload(file_content, dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
+        # Write-through: the next read of this path is a cache hit
+        _download_cache.put(dropbox_path, metadata.rev, metadata.content_hash, file_content)
+        _recent_reads.written(dropbox_path, metadata.rev)
+        return True
+    except ApiError as e:
+        st.error(f"Dropbox API error during upload: {e}")
+        return False
+
+# --- Chunked upload sessions ---
+
+def _correct_offset(error):
+    """Returns the offset Dropbox has acknowledged if `error` is an incorrect-offset error, else None."""
+    if hasattr(error, 'is_lookup_failed') and error.is_lookup_failed():
+        error = error.get_lookup_failed()
+    if hasattr(error, 'is_incorrect_offset') and error.is_incorrect_offset():
+        return error.get_incorrect_offset().correct_offset
+    return None
+
+def upload_large_file(dbx, file_content, dropbox_path, chunk_size=None):
+    """
+    Uploads a file in chunks through a Dropbox upload session (overwriting `dropbox_path`).
+    Each chunk is retried up to DROPBOX_UPLOAD_CHUNK_RETRIES times with backoff; if Dropbox
+    reports a different offset than expected, the upload resumes from the acknowledged one
+    instead of starting over. Files no larger than one chunk use a single files_upload call.
+    """
+    chunk_size = chunk_size or DROPBOX_UPLOAD_CHUNK_SIZE
+    total_size = len(file_content)
+    if total_size <= chunk_size:
+        return upload_file(dbx, file_content, dropbox_path)
+
+    metadata = _upload_in_chunks(dbx, lambda offset, size: file_content[offset:offset + size],
+                                 total_size, dropbox_path, chunk_size)
+    if metadata is None:
+        return False
+    _download_cache.put(dropbox_path, metadata.rev, metadata.content_hash, file_content)
+    _recent_reads.written(dropbox_path, metadata.rev)
+    return True
+
+def upload_file_stream(dbx, file_obj, dropbox_path, chunk_size=None):
+    """
+    Like upload_large_file, but reads the content chunk by chunk from a seekable file object,
+    so at most one chunk is held in memory. The file is not added to the download cache.
+    """
+    chunk_size = chunk_size or DROPBOX_UPLOAD_CHUNK_SIZE
+    total_size = file_obj.seek(0, os.SEEK_END)
+    file_obj.seek(0)
+    if total_size <= chunk_size:
+        return upload_file(dbx, file_obj.read(), dropbox_path)
+
+    def _read_chunk(offset, size):
+        file_obj.seek(offset)
+        return file_obj.read(size)
+
+    metadata = _upload_in_chunks(dbx, _read_chunk, total_size, dropbox_path, chunk_size)
+    if metadata is None:
+        return False
+    _download_cache.invalidate(dropbox_path)
+    _recent_reads.written(dropbox_path, metadata.rev)
+    return True
+
+def _upload_in_chunks(dbx, read_chunk, total_size, dropbox_path, chunk_size):
+    """Runs the upload session loop; read_chunk(offset, size) returns the bytes at offset. Returns the metadata or None."""
+    session_id = None
+    offset = 0
+    failures = 0
+    commit = dropbox.files.CommitInfo(path=dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
+    while True:
+        chunk = read_chunk(offset, chunk_size)
+        is_last = offset + len(chunk) >= total_size
+        try:
+            if session_id is None:
+                session_id = dbx.files_upload_session_start(chunk).session_id
+            elif is_last:
+                cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+                metadata = dbx.files_upload_session_finish(chunk, cursor, commit)
+                break
+            else:
+                cursor = dropbox.files.UploadSessionCursor(session_id=session_id, offset=offset)
+                dbx.files_upload_session_append_v2(chunk, cursor)
+            offset += len(chunk)
+            failures = 0
+            continue
+        except ApiError as e:
+            acknowledged = _correct_offset(e.error)
+            if acknowledged is None:
+                st.error(f"Dropbox API error during upload: {e}")
+                return None
+            # The chunk (or part of it) may have arrived before the connection dropped
+            offset = acknowledged
+        except (requests.exceptions.RequestException, InternalServerError, RateLimitError) as e:
+            print(f"Upload of {dropbox_path} interrupted at byte {offset} of {total_size}: {e}")
+        failures += 1
+        if failures > DROPBOX_UPLOAD_CHUNK_RETRIES:
+            st.error(f"Upload of {dropbox_path} failed after {DROPBOX_UPLOAD_CHUNK_RETRIES} retries.")
+            return None
+        time.sleep(DROPBOX_WRITE_BACKOFF_SECONDS * (2 ** failures))
+    return metadata
+
+# --- Optimistic concurrency ---
+
+class WriteConflict(Exception):
+    """Raised when a file changed in Dropbox between reading it and writing it back."""
+
+class PeriodDataChanged(Exception):
+    """Raised when an MCM period was rewritten by someone else after it was read."""
+
+class AmbiguousRowKey(Exception):
+    """Raised when a row key given for a delete matches more rows than were selected."""
+
+_write_conflict_stats = {'conflicts': 0, 'retries': 0, 'failures': 0, 'by_path': {}}
+_write_conflict_lock = threading.Lock()
+
+def get_write_conflict_stats():
+    """Returns counters of write conflicts (overall and per path) for monitoring."""
+    with _write_conflict_lock:
+        return {**_write_conflict_stats, 'by_path': dict(_write_conflict_stats['by_path'])}
+
+def _record_write_conflict(dropbox_path, gave_up=False):
+    with _write_conflict_lock:
+        _write_conflict_stats['conflicts'] += 1
+        _write_conflict_stats['failures' if gave_up else 'retries'] += 1
+        _write_conflict_stats['by_path'][dropbox_path] = _write_conflict_stats['by_path'].get(dropbox_path, 0) + 1
+
+def upload_file_if_unchanged(dbx, file_content, dropbox_path, base_rev):
+    """
+    Uploads a file only if it is still at `base_rev` (WriteMode.update), or, with base_rev=None,
+    only if it does not exist yet (WriteMode.add). Raises WriteConflict otherwise.
+    Returns False on any other Dropbox error.
+    """
+    mode = dropbox.files.WriteMode.update(base_rev) if base_rev else dropbox.files.WriteMode.add
+    try:
+        metadata = dbx.files_upload(file_content, dropbox_path, mode=mode, autorename=False)
+        _download_cache.put(dropbox_path, metadata.rev, metadata.content_hash, file_content)
+        _recent_reads.written(dropbox_path, metadata.rev)
         return True
     except ApiError as e:
+        if (isinstance(e.error, dropbox.files.UploadError) and e.error.is_path()
+                and e.error.get_path().reason.is_conflict()):
+            # Someone else wrote the file: the retry must see their revision
+            _recent_reads.invalidate(dropbox_path)
+            raise WriteConflict(dropbox_path)
         st.error(f"Dropbox API error during upload: {e}")
         return False
 
+def retry_on_conflict(attempt_fn, dropbox_path, description, conflict_error=WriteConflict):
+    """
+    Runs a read-modify-write `attempt_fn` until it succeeds without raising `conflict_error`.
+    attempt_fn must re-read the current state and re-apply its change on every call.
+    Conflicts are counted and retried with exponential backoff and jitter.
+    """
+    for attempt in range(DROPBOX_WRITE_MAX_RETRIES):
+        try:
+            return attempt_fn()
+        except conflict_error:
+            gave_up = attempt == DROPBOX_WRITE_MAX_RETRIES - 1
+            _record_write_conflict(dropbox_path, gave_up=gave_up)
+            if not gave_up:
+                time.sleep(DROPBOX_WRITE_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random()))
+    st.error(f"Could not save {description}: the data kept changing while saving. Please try again.")
+    return False
+
+def _download_with_rev(dbx, dropbox_path, known_rev=None):
+    """
+    Returns (content, rev) for a file, serving it from the local cache when its rev is unchanged.
+    Pass `known_rev` (e.g. from a folder listing) to skip the metadata call.
+    Returns (None, None) if the file does not exist.
+    """
+    current_rev = known_rev
+    if current_rev is None:
+        found, current_rev = _recent_reads.get_rev(dropbox_path)
+        if found and current_rev is None:
+            return None, None
+    if current_rev is None:
+        try:
+            current_rev = dbx.files_get_metadata(dropbox_path).rev
+        except ApiError as e:
+            if _is_not_found(e.error):
+                _download_cache.invalidate(dropbox_path)
+                _recent_reads.remember_rev(dropbox_path, None)
+                return None, None
+            st.error(f"Dropbox API error during download: {e}")
+            return None, None
+        _recent_reads.remember_rev(dropbox_path, current_rev)
+
+    cached_content = _download_cache.get(dropbox_path, current_rev)
+    if cached_content is not None:
+        return cached_content, current_rev
+
+    try:
+        metadata, res = dbx.files_download(path=dropbox_path)
+    except ApiError as e:
+        if isinstance(e.error, dropbox.files.DownloadError) and _is_not_found(e.error):
+            return None, None
+        st.error(f"Dropbox API error during download: {e}")
+        return None, None
+    _download_cache.put(dropbox_path, metadata.rev, metadata.content_hash, res.content)
+    return res.content, metadata.rev
+
 def download_file(dbx, dropbox_path):
-    """Downloads a file from a specific path in Dropbox."""
+    """Downloads a file from a specific path in Dropbox (cached locally by revision)."""
+    content, _ = _download_with_rev(dbx, dropbox_path)
+    return content
+
+def get_file_rev(dbx, dropbox_path):
+    """Returns the current Dropbox rev of a file (None if it does not exist), without downloading it."""
+    found, rev = _recent_reads.get_rev(dropbox_path)
+    if found:
+        return rev
     try:
-        _, res = dbx.files_download(path=dropbox_path)
-        return res.content
+        rev = dbx.files_get_metadata(dropbox_path).rev
     except ApiError as e:
-        if isinstance(e.error, dropbox.files.DownloadError) and e.error.is_path() and e.error.get_path().is_not_found():
+        if not _is_not_found(e.error):
+            st.error(f"Dropbox API error while checking {dropbox_path}: {e}")
             return None
-        st.error(f"Dropbox API error during download: {e}")
-        return None
+        rev = None
+    _recent_reads.remember_rev(dropbox_path, rev)
+    return rev
 
-def read_from_spreadsheet(dbx, dropbox_path):
+def read_from_spreadsheet(dbx, dropbox_path, known_rev=None):
     """Reads an Excel file in Dropbox into a pandas DataFrame."""
-    file_content = download_file(dbx, dropbox_path)
+    file_content, rev = _download_with_rev(dbx, dropbox_path, known_rev)
     if file_content:
+        cached_df = _download_cache.get_frame(dropbox_path, rev)
+        if cached_df is not None:
+            return cached_df
         try:
-            return pd.read_excel(BytesIO(file_content))
+            df = read_excel_bytes(file_content)
         except Exception as e:
             st.error(f"Error reading Excel file from Dropbox: {e}")
             return pd.DataFrame()
+        _download_cache.put_frame(dropbox_path, rev, df)
+        return df
     return pd.DataFrame()
 
+# --- Excel ingestion ---
+_unavailable_excel_engines = set()
+
+def read_excel_bytes(file_content, engines=None):
+    """
+    Parses .xlsx bytes with the first engine of `engines` (default EXCEL_READ_ENGINES) that
+    is installed and can read the file. Engines that are not installed are skipped for the
+    rest of the process; the last engine's error is raised if none succeeds.
+    """
+    engines = [engine for engine in (engines or EXCEL_READ_ENGINES) if engine not in _unavailable_excel_engines]
+    for i, engine in enumerate(engines):
+        try:
+            return pd.read_excel(BytesIO(file_content), engine=engine)
+        except ImportError:
+            _unavailable_excel_engines.add(engine)
+            if i == len(engines) - 1:
+                raise
+        except Exception as e:
+            if i == len(engines) - 1:
+                raise
+            print(f"Excel engine '{engine}' could not read the file, falling back: {e}")
+    raise ValueError("No Excel engine is available.")
+
 def update_spreadsheet_from_df(dbx, df_to_write, dropbox_path):
-    """Updates an Excel file in Dropbox with data from a pandas DataFrame."""
+    """
+    Updates an Excel file in Dropbox with data from a pandas DataFrame. The workbook is
+    streamed into a spooled temp file and uploaded from it in chunks, so memory stays bounded.
+    """
     try:
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df_to_write.to_excel(writer, index=False, sheet_name='Sheet1')
-        processed_data = output.getvalue()
-        return upload_file(dbx, processed_data, dropbox_path)
+        with tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_MAX_BYTES) as spool:
+            write_excel_stream(df_to_write, spool)
+            return upload_file_stream(dbx, spool, dropbox_path)
     except Exception as e:
         st.error(f"Error writing to Excel file for Dropbox upload: {e}")
         return False
 
+def export_dataframe_to_excel(df):
+    """Converts a DataFrame to in-memory .xlsx bytes (used for 'Download as Excel')."""
+    output = BytesIO()
+    write_excel_stream(df, output)
+    return output.getvalue()
+
+def _excel_cell(value):
+    """
+    Converts a cell to a type xlsxwriter writes natively, the way DataFrame.to_excel does:
+    missing values become blanks and infinities the text 'inf' / '-inf'.
+    """
+    if value is None or (not isinstance(value, (str, list, dict)) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value in (float('inf'), float('-inf')):
+        return 'inf' if value > 0 else '-inf'
+    if isinstance(value, (list, dict)):
+        return str(value)
+    return value
+
+def write_excel_stream(df, file_obj, sheet_name='Sheet1'):
+    """
+    Writes df as an .xlsx workbook to `file_obj` row by row with xlsxwriter's constant_memory
+    mode, which flushes each finished row to disk instead of keeping every cell in memory.
+    """
+    workbook = xlsxwriter.Workbook(file_obj, {'constant_memory': True, 'strings_to_urls': False,
+                                              'strings_to_formulas': False})
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({'bold': True, 'border': 1})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+    for row_num, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        for col_num, value in enumerate(row):
+            value = _excel_cell(value)
+            if value is None:
+                continue
+            if isinstance(value, datetime):
+                worksheet.write_datetime(row_num, col_num, value, datetime_format)
+            elif isinstance(value, date):
+                worksheet.write_datetime(row_num, col_num, value, date_format)
+            else:
+                worksheet.write(row_num, col_num, value)
+    workbook.close()
+
+# --- Columnar (Parquet) DataFrame storage ---
+
+def _prepare_for_parquet(df):
+    """Gives every column a single Arrow-compatible type: numbers as float64, text as str."""
+    df = df.copy()
+    for col in df.columns:
+        if col in MCM_NUMERIC_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+            # Excel round-trips leave mixed int/str/Timestamp values in object columns
+            df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) else (None if pd.isna(v) else str(v)))
+    return df
+
+def read_dataframe(dbx, dropbox_path, columns=None, known_rev=None):
+    """
+    Reads a DataFrame stored in Dropbox as .parquet or .xlsx (chosen by extension).
+    If `columns` is given, only those columns are loaded (missing ones are skipped).
+    """
+    if not dropbox_path.lower().endswith('.parquet'):
+        df = read_from_spreadsheet(dbx, dropbox_path, known_rev=known_rev)
+        if columns is not None and not df.empty:
+            df = df[[col for col in columns if col in df.columns]]
+        return df
+
+    file_content, rev = _download_with_rev(dbx, dropbox_path, known_rev)
+    if not file_content:
+        return pd.DataFrame()
+    variant = tuple(columns) if columns is not None else None
+    cached_df = _download_cache.get_frame(dropbox_path, rev, variant)
+    if cached_df is not None:
+        return cached_df
+    try:
+        if columns is not None:
+            available = pq.read_schema(BytesIO(file_content)).names
+            columns = [col for col in columns if col in available]
+        df = pd.read_parquet(BytesIO(file_content), columns=columns)
+    except Exception as e:
+        st.error(f"Error reading Parquet file from Dropbox: {e}")
+        return pd.DataFrame()
+    _download_cache.put_frame(dropbox_path, rev, df, variant)
+    return df
+
+def write_dataframe(dbx, df_to_write, dropbox_path):
+    """Writes a DataFrame to Dropbox as .parquet or .xlsx (chosen by extension)."""
+    if not dropbox_path.lower().endswith('.parquet'):
+        return update_spreadsheet_from_df(dbx, df_to_write, dropbox_path)
+    try:
+        output = BytesIO()
+        _prepare_for_parquet(df_to_write).to_parquet(output, index=False, engine='pyarrow')
+        return upload_file(dbx, output.getvalue(), dropbox_path)
+    except Exception as e:
+        st.error(f"Error writing Parquet file for Dropbox upload: {e}")
+        return False
+
 def create_folder(dbx, folder_path):
     """Creates a folder in Dropbox if it doesn't already exist."""
     try:
@@ -140,6 +926,151 @@ def create_folder(dbx, folder_path):
         else:
             st.error(f"Dropbox API error during folder creation: {e}")
 
+# --- Batched metadata operations ---
+
+def create_folders(dbx, folder_paths):
+    """
+    Creates several folders with one files_create_folder_batch call (existing folders are fine).
+    Polls the batch job if Dropbox runs it asynchronously. Returns True if all folders exist afterwards.
+    """
+    try:
+        launch = dbx.files_create_folder_batch(list(folder_paths), autorename=False)
+        if launch.is_async_job_id():
+            job_id = launch.get_async_job_id()
+            status = dbx.files_create_folder_batch_check(job_id)
+            while status.is_in_progress():
+                time.sleep(0.5)
+                status = dbx.files_create_folder_batch_check(job_id)
+            if status.is_failed():
+                st.error(f"Dropbox folder creation failed: {status.get_failed()}")
+                return False
+            entries = status.get_complete().entries
+        else:
+            entries = launch.get_complete().entries
+    except ApiError as e:
+        st.error(f"Dropbox API error during folder creation: {e}")
+        return False
+
+    all_created = True
+    for folder_path, entry in zip(folder_paths, entries):
+        if entry.is_failure():
+            failure = entry.get_failure()
+            if failure.is_path() and failure.get_path().is_conflict():
+                continue  # Folder already exists
+            st.error(f"Dropbox API error creating folder {folder_path}: {failure}")
+            all_created = False
+    return all_created
+
+def list_folder_metadata(dbx, folder_path):
+    """
+    Returns {path_lower: metadata} for the direct children of a folder using one (paginated)
+    listing, or None if the listing failed. The revisions seen are remembered, so reading
+    one of these files right after costs no extra metadata call.
+    """
+    try:
+        res = dbx.files_list_folder(folder_path)
+        entries = list(res.entries)
+        while res.has_more:
+            res = dbx.files_list_folder_continue(res.cursor)
+            entries.extend(res.entries)
+    except ApiError as e:
+        if _is_not_found(e.error):
+            return {}
+        st.error(f"Dropbox API error while listing {folder_path}: {e}")
+        return None
+    for entry in entries:
+        if isinstance(entry, dropbox.files.FileMetadata):
+            _recent_reads.remember_rev(entry.path_display, entry.rev)
+    return {entry.path_lower: entry for entry in entries}
+
+def get_metadata_batch(dbx, dropbox_paths):
+    """
+    Looks up the metadata of several files with one folder listing per parent folder instead of
+    one files_get_metadata call per file. Returns {path: metadata}, with None for missing files.
+    """
+    parents = {}
+    for dropbox_path in dropbox_paths:
+        parents.setdefault(dropbox_path.rsplit('/', 1)[0], []).append(dropbox_path)
+    results = {}
+    for folder_path, paths in parents.items():
+        children = list_folder_metadata(dbx, folder_path)
+        for dropbox_path in paths:
+            if children is None:
+                # Listing failed: fall back to a single lookup
+                try:
+                    results[dropbox_path] = dbx.files_get_metadata(dropbox_path)
+                except ApiError:
+                    results[dropbox_path] = None
+                continue
+            results[dropbox_path] = children.get(dropbox_path.lower())
+            if results[dropbox_path] is None:
+                _recent_reads.remember_rev(dropbox_path, None)
+    return results
+
+# Shared links of files in DAR_PDFS_PATH ({path_lower: url}), shared by all sessions.
+# Filled by one paginated listing of the account's links and topped up as links are created.
+_dar_pdf_links = {}
+_dar_pdf_links_listed_at = None
+_dar_pdf_links_lock = threading.Lock()
+
+def _list_dar_pdf_links(dbx):
+    """Returns {path_lower: url} of the existing shared links in DAR_PDFS_PATH, listing them at most once per TTL."""
+    global _dar_pdf_links_listed_at
+    with _dar_pdf_links_lock:
+        if _dar_pdf_links_listed_at is not None and time.monotonic() - _dar_pdf_links_listed_at < DAR_PDF_LINKS_CACHE_TTL_SECONDS:
+            return dict(_dar_pdf_links)
+    folder_prefix = DAR_PDFS_PATH.lower().rstrip('/') + '/'
+    listed = {}
+    try:
+        res = dbx.sharing_list_shared_links()
+        while True:
+            for link in res.links:
+                path_lower = getattr(link, 'path_lower', None)
+                if path_lower and path_lower.startswith(folder_prefix):
+                    listed.setdefault(path_lower, link.url)
+            if not res.has_more:
+                break
+            res = dbx.sharing_list_shared_links(cursor=res.cursor)
+    except ApiError as e:
+        print(f"Dropbox API error listing shared links: {e}")
+        return dict(_dar_pdf_links)
+    with _dar_pdf_links_lock:
+        _dar_pdf_links.update(listed)
+        _dar_pdf_links_listed_at = time.monotonic()
+        return dict(_dar_pdf_links)
+
+def get_shareable_links(dbx, dropbox_paths):
+    """
+    Returns {path: url} for several files. Existing links come from the shared link cache
+    (one paginated sharing_list_shared_links listing for all sessions); links are only
+    created for files that have none (Dropbox has no batch endpoint for creating shared links).
+    """
+    wanted = {dropbox_path.lower(): dropbox_path for dropbox_path in dropbox_paths}
+    known = _list_dar_pdf_links(dbx)
+    links = {}
+    for path_lower, dropbox_path in wanted.items():
+        links[dropbox_path] = known.get(path_lower)
+        if links[dropbox_path] is None:
+            links[dropbox_path] = get_shareable_link(dbx, dropbox_path)
+            if links[dropbox_path]:
+                with _dar_pdf_links_lock:
+                    _dar_pdf_links[path_lower] = links[dropbox_path]
+    return links
+
+def resolve_dar_pdf_urls(dbx, df):
+    """
+    Returns the PDF link of each row of df: the stored 'dar_pdf_url', or for rows saved
+    before links were stored, the cached shared link of 'dar_pdf_path'.
+    """
+    urls = df['dar_pdf_url'].astype(object) if 'dar_pdf_url' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    if 'dar_pdf_path' not in df.columns:
+        return urls
+    missing = urls.isna() & df['dar_pdf_path'].notna()
+    if missing.any():
+        links = get_shareable_links(dbx, df.loc[missing, 'dar_pdf_path'].astype(str).unique())
+        urls = urls.where(~missing, df['dar_pdf_path'].astype(str).map(links))
+    return urls
+
 def list_files(dbx, folder_path):
     """Lists all files in a specific folder in Dropbox."""
     try:
@@ -147,7 +1078,813 @@ def list_files(dbx, folder_path):
         return [entry.name for entry in res.entries]
     except ApiError as e:
         st.error(f"Dropbox API error while listing files: {e}")
-        return []# # dropbox_utils.py
+        return []
+
+# --- Period-partitioned MCM data store ---
+# DAR data is stored as one file per MCM period under MCM_DATA_PARTITIONS_PATH.
+# A small JSON manifest maps each period (e.g. "March 2025") to its partition file,
+# so a page view or a submission only downloads/uploads the period it works on.
+#
+# Partition files are never overwritten: a rewrite uploads a new file and then points the
+# manifest at it. The manifest is written with WriteMode.update(rev), so it is the single
+# commit point, and concurrent writers detect each other through its revision.
+
+def _period_file_stem(mcm_period):
+    """Turns an MCM period like 'March 2025' into a file-name-safe stem 'period_March_2025'."""
+    return "period_" + re.sub(r'[^A-Za-z0-9]+', '_', str(mcm_period)).strip('_')
+
+def _data_file_extension():
+    return 'parquet' if MCM_DATA_STORAGE_FORMAT == 'parquet' else 'xlsx'
+
+def _utc_stamp(moment=None):
+    """UTC timestamp in the sortable form used by object names (local naive datetimes are converted)."""
+    moment = moment.astimezone(timezone.utc) if moment is not None else datetime.now(timezone.utc)
+    return moment.strftime('%Y%m%dT%H%M%S%f')
+
+def _new_object_name(extension=None):
+    """Unique, time-ordered file name for immutable partition and journal objects."""
+    return f"{_utc_stamp()}_{uuid.uuid4().hex[:8]}.{extension or _data_file_extension()}"
+
+def new_period_partition_path(mcm_period):
+    """Returns a fresh Dropbox path for a new version of an MCM period's partition file."""
+    return f"{MCM_DATA_PARTITIONS_PATH}/{_period_file_stem(mcm_period)}/{_new_object_name()}"
+
+def _parse_manifest(content):
+    if not content:
+        return {'partitions': {}}
+    try:
+        manifest = json.loads(content)
+    except ValueError as e:
+        st.error(f"Error reading the MCM data manifest from Dropbox: {e}")
+        return {'partitions': {}}
+    manifest.setdefault('partitions', {})
+    return manifest
+
+def read_mcm_manifest(dbx):
+    """Reads the partition manifest. Returns {'partitions': {}} if it does not exist yet."""
+    return _parse_manifest(download_file(dbx, MCM_DATA_MANIFEST_PATH))
+
+def update_mcm_manifest(dbx, apply_fn):
+    """
+    Read-modify-write of the manifest with optimistic concurrency.
+    apply_fn(manifest) changes the manifest in place and returns True, or returns False
+    if nothing needs to be written. It is re-run on the fresh manifest after a conflict.
+    """
+    return _update_json_file(dbx, MCM_DATA_MANIFEST_PATH, _parse_manifest, apply_fn, "the MCM data manifest")
+
+def _update_json_file(dbx, dropbox_path, parse_fn, apply_fn, description):
+    """Rev-checked read-modify-write of a small JSON file, retried on conflict."""
+    def _attempt():
+        content, rev = _download_with_rev(dbx, dropbox_path)
+        data = parse_fn(content)
+        if not apply_fn(data):
+            return True
+        data_bytes = json.dumps(data, indent=2, default=str).encode('utf-8')
+        return upload_file_if_unchanged(dbx, data_bytes, dropbox_path, rev)
+    return retry_on_conflict(_attempt, dropbox_path, description)
+
+def get_period_signature(dbx, mcm_period):
+    """
+    Returns a string that changes whenever the data of an MCM period changes (new partition
+    or new journal deltas), without downloading any data. Used to keep local indexes in sync.
+    """
+    entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}
+    pending = [d.name for d in _pending_deltas(entry, list_period_journal(dbx, mcm_period))]
+    return json.dumps([entry.get('path'), pending])
+
+def read_period_data(dbx, mcm_period, columns=None):
+    """
+    Reads the DAR data of a single MCM period: the partition snapshot plus any journal
+    deltas (appended rows and row patches) not yet compacted into it, applied in order.
+    Returns an empty DataFrame if none exists. Pass `columns` to load only the columns a view needs.
+
+    The returned frame carries df.attrs['partition_path'] and df.attrs['folded_deltas'] (the
+    snapshot and the names of the journal deltas it includes); update_period_data uses them to
+    detect concurrent changes and to record which deltas the rewritten partition contains.
+    """
+    entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}
+    deltas = list_period_journal(dbx, mcm_period)
+    df_period = _materialize_period(dbx, entry.get('path'), _pending_deltas(entry, deltas), columns)
+    df_period.attrs['partition_path'] = entry.get('path')
+    df_period.attrs['folded_deltas'] = [d.name for d in deltas]
+    return df_period
+
+def _materialize_period(dbx, partition_path, deltas, columns=None):
+    """Returns the partition snapshot (if any) with `deltas` (appends and patches) applied in order."""
+    patches = {d.name: _read_patch(dbx, d) for d in deltas if d.name.endswith(PATCH_FILE_SUFFIX)}
+    read_columns = columns
+    if columns is not None and patches:
+        # Patches locate rows by their key columns, so those are loaded too and dropped afterwards
+        key_cols = [col for patch in patches.values() for col in patch['key_cols']]
+        read_columns = list(dict.fromkeys(list(columns) + key_cols))
+
+    frames = []
+    if partition_path:
+        frames.append(read_dataframe(dbx, partition_path, columns=read_columns))
+    for delta in deltas:
+        if delta.name in patches:
+            df_so_far = _concat_frames(frames)
+            frames = [apply_row_patch(df_so_far, patches[delta.name]['key_cols'],
+                                      patches[delta.name]['updates'], columns=read_columns)]
+        else:
+            frames.append(read_dataframe(dbx, delta.path_display, columns=read_columns, known_rev=delta.rev))
+
+    df_period = _concat_frames(frames)
+    if read_columns is not columns:
+        df_period = df_period[[col for col in columns if col in df_period.columns]]
+    return apply_dar_schema(df_period)
+
+def _concat_frames(frames):
+    frames = [df for df in frames if not df.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def read_all_period_data(dbx, columns=None):
+    """Reads and concatenates the DAR data of every MCM period (full history)."""
+    frames = [read_period_data(dbx, mcm_period, columns=columns)
+              for mcm_period in read_mcm_manifest(dbx)['partitions']]
+    frames = [df for df in frames if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    # Categoricals with different categories concatenate to object; re-apply the schema once
+    return apply_dar_schema(pd.concat(frames, ignore_index=True))
+
+def _delete_quietly(dbx, dropbox_path):
+    try:
+        dbx.files_delete_v2(dropbox_path)
+    except ApiError as e:
+        print(f"Could not delete {dropbox_path}: {e}")
+    _download_cache.invalidate(dropbox_path)
+    _recent_reads.invalidate(dropbox_path)
+
+def delete_file(dbx, dropbox_path):
+    """Deletes a file and drops it from the local caches (failures are logged, not raised)."""
+    _delete_quietly(dbx, dropbox_path)
+
+def _commit_period_partition(dbx, mcm_period, df_period, based_on_path, folded_deltas, reason='update'):
+    """
+    Uploads df_period as a new partition version and points the manifest at it.
+    `folded_deltas` are the names of the journal deltas df_period contains.
+    Raises PeriodDataChanged if the period's partition is no longer `based_on_path`.
+    The previous partition is kept: it remains readable as a past version.
+    """
+    partition_path = new_period_partition_path(mcm_period)
+    if not write_dataframe(dbx, df_period, partition_path):
+        return False
+
+    def _apply(manifest):
+        entry = manifest['partitions'].get(mcm_period) or {}
+        if entry.get('path') != based_on_path:
+            raise PeriodDataChanged(mcm_period)
+        replaced.clear()
+        replaced.update(entry)
+        manifest['partitions'][mcm_period] = new_entry
+        return True
+
+    replaced = {}
+    new_entry = {
+        'path': partition_path,
+        'rows': int(len(df_period)),
+        'folded_deltas': sorted(folded_deltas),
+        'updated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    try:
+        committed = update_mcm_manifest(dbx, _apply)
+    except PeriodDataChanged:
+        _delete_quietly(dbx, partition_path)  # Never committed, so not a version
+        raise
+    if not committed:
+        _delete_quietly(dbx, partition_path)
+        return False
+    _record_period_version(dbx, mcm_period, new_entry, reason, replaced)
+    return True
+
+def update_period_data(dbx, mcm_period, apply_fn, description=None, reason='update'):
+    """
+    Applies a row-level change to one MCM period with optimistic concurrency.
+    apply_fn(df_period) returns the changed DataFrame; on a conflict the period is
+    re-read and apply_fn is re-applied to the fresh data before retrying.
+    """
+    def _attempt():
+        df_current = read_period_data(dbx, mcm_period)
+        df_changed = apply_fn(df_current.copy())
+        return _commit_period_partition(dbx, mcm_period, df_changed, df_current.attrs['partition_path'],
+                                        df_current.attrs['folded_deltas'], reason)
+    return retry_on_conflict(_attempt, get_period_journal_path(mcm_period),
+                             description or f"the data for {mcm_period}", conflict_error=PeriodDataChanged)
+
+def _normalized_key_values(value):
+    """Normalizes a key cell so 5, 5.0 and '5' compare equal and all missing values match ''."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def _row_keys(df, key_cols):
+    """Returns a Series of normalized key tuples for each row of df."""
+    key_frame = pd.DataFrame({col: (df[col] if col in df.columns else pd.Series(None, index=df.index, dtype=object))
+                              for col in key_cols})
+    return key_frame.apply(lambda row: tuple(_normalized_key_values(v) for v in row), axis=1)
+
+def delete_period_rows(dbx, mcm_period, key_cols, keys_to_delete):
+    """
+    Deletes the rows of a period whose `key_cols` values match one of `keys_to_delete`
+    (a list of dicts). The deletion is re-applied by key if the period changes concurrently.
+    Nothing is deleted if a key matches more rows than it was given for (e.g. two rows
+    stored without a row_id that share the other key values).
+    """
+    targets = Counter(tuple(_normalized_key_values(k.get(col)) for col in key_cols) for k in keys_to_delete)
+
+    def _apply(df_period):
+        if df_period.empty:
+            return df_period
+        row_keys = _row_keys(df_period, key_cols)
+        to_delete = row_keys.isin(set(targets))
+        if any(count > targets[key] for key, count in Counter(row_keys[to_delete]).items()):
+            raise AmbiguousRowKey(mcm_period)
+        return df_period[~to_delete].reset_index(drop=True)
+
+    try:
+        if not update_period_data(dbx, mcm_period, _apply):
+            return False
+    except AmbiguousRowKey:
+        st.error("The selected entry cannot be told apart from another entry with the same GSTIN, "
+                 "para number and date, so nothing was deleted. Please ask the PCO to remove it.")
+        return False
+    refresh_submitted_gstins(dbx, mcm_period)
+    return True
+
+# --- Row-level patches ---
+# Cell edits (MCM decisions, chair remarks, PCO corrections) are written to the period's
+# journal as small JSON patch deltas instead of rewriting the partition. Readers apply them
+# in order on top of the data; compaction folds them into the next partition snapshot.
+
+PATCH_FILE_SUFFIX = '.patch.json'
+
+def _json_value(value):
+    """Converts a cell value to something JSON can store (numpy scalars, NaN, timestamps)."""
+    if value is None or (not isinstance(value, (str, list, dict)) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def patch_rows(dbx, mcm_period, key_cols, updates):
+    """
+    Applies cell-level changes to rows of one MCM period without rewriting its partition.
+    `updates` is a list of dicts holding the row's `key_cols` values plus the columns to change,
+    e.g. {'gstin': ..., 'audit_para_number': 3, 'record_created_date': ..., 'mcm_decision': 'Para closed'}.
+    Only the given columns of the matching rows change; every other row and period is untouched.
+    """
+    if not updates:
+        return True
+    patch = {
+        'key_cols': list(key_cols),
+        'updates': [
+            {'key': {col: _json_value(update.get(col)) for col in key_cols},
+             'values': {col: _json_value(val) for col, val in update.items() if col not in key_cols}}
+            for update in updates
+        ]
+    }
+    patch_path = f"{get_period_journal_path(mcm_period)}/{_new_object_name(PATCH_FILE_SUFFIX.lstrip('.'))}"
+    if not upload_file(dbx, json.dumps(patch).encode('utf-8'), patch_path):
+        return False
+    if any('gstin' in update['values'] for update in patch['updates']):
+        refresh_submitted_gstins(dbx, mcm_period)
+    schedule_compaction_if_needed(dbx, mcm_period)
+    return True
+
+def _read_patch(dbx, delta):
+    content, _ = _download_with_rev(dbx, delta.path_display, known_rev=delta.rev)
+    try:
+        return json.loads(content) if content else {'key_cols': [], 'updates': []}
+    except ValueError as e:
+        st.error(f"Error reading a data patch from Dropbox: {e}")
+        return {'key_cols': [], 'updates': []}
+
+def apply_row_patch(df, key_cols, updates, columns=None):
+    """
+    Returns df with the patch `updates` (list of {'key': {...}, 'values': {...}}) applied.
+    With `columns`, values for other columns are skipped (projected reads).
+    """
+    if df.empty or not updates:
+        return df
+    df = df.copy()
+    row_keys = _row_keys(df, key_cols)
+    for update in updates:
+        mask = row_keys == tuple(_normalized_key_values(update['key'].get(col)) for col in key_cols)
+        if not mask.any():
+            continue
+        for col, value in update['values'].items():
+            if columns is not None and col not in columns:
+                continue
+            if col not in df.columns:
+                df[col] = None
+            elif value is not None and not isinstance(value, (int, float)) and pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = df[col].astype(object)
+            elif isinstance(df[col].dtype, pd.CategoricalDtype) and value not in df[col].cat.categories:
+                df[col] = df[col].astype(object)
+            df.loc[mask, col] = value
+    return df
+
+def diff_edited_rows(df_original, df_edited, key_cols):
+    """
+    Compares an edited copy of a DataFrame (e.g. from st.data_editor) with the original,
+    matching rows by index, and returns the changed cells as patch_rows updates.
+    Rows added or removed in the editor are ignored.
+    """
+    common_index = df_original.index.intersection(df_edited.index)
+    common_cols = [col for col in df_edited.columns if col in df_original.columns]
+    original = df_original.loc[common_index, common_cols]
+    edited = df_edited.loc[common_index, common_cols]
+
+    changed = (original.astype(object) != edited.astype(object)) & ~(original.isna() & edited.isna())
+    updates = []
+    for idx in changed.index[changed.any(axis=1)]:
+        update = {col: df_original.at[idx, col] if col in df_original.columns else None for col in key_cols}
+        update.update({col: edited.at[idx, col] for col in common_cols if changed.at[idx, col]})
+        updates.append(update)
+    return updates
+
+# --- Submitted-GSTIN key index ---
+# A small JSON file next to the data listing which GSTINs have a DAR in each MCM period.
+# It is updated on every submit, delete and GSTIN edit, so "already submitted?" is answered
+# from a few KB instead of the period's data. rebuild_submission_key_index recreates it.
+# The index is written after the data and can list a GSTIN whose rows never landed, so a
+# listed GSTIN is confirmed in the period's data before a submission is refused.
+
+def _normalize_gstin(gstin):
+    return str(gstin).strip().upper()
+
+def _parse_key_index(content):
+    if not content:
+        return {'periods': {}}
+    try:
+        key_index = json.loads(content)
+    except ValueError as e:
+        st.error(f"Error reading the submitted GSTIN index from Dropbox: {e}")
+        return {'periods': {}}
+    key_index.setdefault('periods', {})
+    return key_index
+
+def _set_period_gstins(key_index, mcm_period, gstins):
+    gstins = sorted(gstins)
+    if key_index['periods'].get(mcm_period) == gstins:
+        return False
+    key_index['periods'][mcm_period] = gstins
+    return True
+
+def read_submission_key_index(dbx):
+    """Returns {'periods': {mcm_period: [gstin, ...]}}, building the index first if it does not exist."""
+    content = download_file(dbx, MCM_DATA_KEY_INDEX_PATH)
+    if content is None:
+        rebuild_submission_key_index(dbx)
+        content = download_file(dbx, MCM_DATA_KEY_INDEX_PATH)
+    return _parse_key_index(content)
+
+def is_gstin_submitted(dbx, mcm_period, gstin):
+    """
+    True if a DAR for `gstin` has already been submitted for the MCM period. A GSTIN the index
+    lists but the data does not hold is dropped from the index, and the answer is False.
+    """
+    if not gstin or pd.isna(gstin):
+        return False
+    gstin = _normalize_gstin(gstin)
+    if gstin not in read_submission_key_index(dbx)['periods'].get(mcm_period, []):
+        return False
+    gstins = _period_gstins(dbx, mcm_period)
+    if gstin in gstins:
+        return True
+    _write_period_gstins(dbx, mcm_period, gstins)
+    return False
+
+def add_submitted_gstins(dbx, mcm_period, gstins):
+    """Records newly submitted GSTINs of an MCM period in the key index."""
+    new_gstins = {_normalize_gstin(g) for g in gstins}
+    def _apply(key_index):
+        return _set_period_gstins(key_index, mcm_period, set(key_index['periods'].get(mcm_period, [])) | new_gstins)
+    return _update_json_file(dbx, MCM_DATA_KEY_INDEX_PATH, _parse_key_index, _apply, "the submitted GSTIN index")
+
+def _period_gstins(dbx, mcm_period):
+    """The GSTINs in the data of an MCM period (partition and pending journal deltas)."""
+    df_period = read_period_data(dbx, mcm_period, columns=['gstin'])
+    return {_normalize_gstin(g) for g in df_period['gstin'].dropna()} if 'gstin' in df_period.columns else set()
+
+def _write_period_gstins(dbx, mcm_period, gstins):
+    return _update_json_file(dbx, MCM_DATA_KEY_INDEX_PATH, _parse_key_index,
+                             lambda key_index: _set_period_gstins(key_index, mcm_period, gstins),
+                             "the submitted GSTIN index")
+
+def refresh_submitted_gstins(dbx, mcm_period):
+    """Recomputes the key index entry of one MCM period from its data (after deletes or edits)."""
+    return _write_period_gstins(dbx, mcm_period, _period_gstins(dbx, mcm_period))
+
+def rebuild_submission_key_index(dbx):
+    """Rebuilds the whole key index from the data of every MCM period."""
+    periods = {mcm_period: sorted(_period_gstins(dbx, mcm_period)) for mcm_period in read_mcm_manifest(dbx)['partitions']}
+
+    def _apply(key_index):
+        key_index['periods'] = periods
+        return True
+    return _update_json_file(dbx, MCM_DATA_KEY_INDEX_PATH, _parse_key_index, _apply, "the submitted GSTIN index")
+
+# --- Append-only submission journal ---
+# A submission writes its rows as a new immutable delta file under
+# MCM_DATA_JOURNAL_PATH/<period>/, so its cost does not depend on the size of history.
+# Delta names start with a UTC timestamp and sort in submission order. A delta is named
+# before its upload finishes, so a name can sort before deltas that were compacted while it
+# was still uploading: each manifest entry therefore lists the deltas its partition contains
+# by name ('folded_deltas'), and only those are skipped on reads and archived.
+
+def get_period_journal_path(mcm_period):
+    """Returns the Dropbox folder holding the journal deltas of an MCM period."""
+    return f"{MCM_DATA_JOURNAL_PATH}/{_period_file_stem(mcm_period)}"
+
+def list_period_journal(dbx, mcm_period):
+    """Returns the FileMetadata of all journal deltas of a period, oldest first."""
+    return _list_folder_files(dbx, get_period_journal_path(mcm_period), "the submission journal")
+
+def _folded_deltas(entry, deltas):
+    """
+    Names of the `deltas` already contained in a manifest entry's partition. Entries written
+    before 'folded_deltas' existed only record the newest folded name ('journal_watermark').
+    """
+    if 'folded_deltas' in entry:
+        folded = set(entry['folded_deltas'])
+        return {d.name for d in deltas if d.name in folded}
+    watermark = entry.get('journal_watermark') or ''
+    return {d.name for d in deltas if d.name <= watermark}
+
+def _pending_deltas(entry, deltas):
+    """The `deltas` not yet contained in a manifest entry's partition, oldest first."""
+    folded = _folded_deltas(entry, deltas)
+    return [d for d in deltas if d.name not in folded]
+
+def _list_folder_files(dbx, folder_path, description):
+    """FileMetadata of the files in a folder (empty if it does not exist), sorted by name."""
+    entries = _recent_reads.get_listing(folder_path)
+    if entries is None:
+        try:
+            res = dbx.files_list_folder(folder_path)
+            entries = list(res.entries)
+            while res.has_more:
+                res = dbx.files_list_folder_continue(res.cursor)
+                entries.extend(res.entries)
+        except ApiError as e:
+            if not _is_not_found(e.error):
+                st.error(f"Dropbox API error while listing {description}: {e}")
+                return []
+            entries = []
+        _recent_reads.remember_listing(folder_path, entries)
+    files = [entry for entry in entries if isinstance(entry, dropbox.files.FileMetadata)]
+    return sorted(files, key=lambda entry: entry.name)
+
+def append_period_rows(dbx, mcm_period, df_rows):
+    """Appends rows to an MCM period by writing one immutable journal delta. Rows get a row_id if they have none."""
+    df_rows = df_rows.reset_index(drop=True)
+    row_ids = df_rows[MCM_ROW_ID_COLUMN] if MCM_ROW_ID_COLUMN in df_rows.columns else pd.Series(None, index=df_rows.index, dtype=object)
+    df_rows[MCM_ROW_ID_COLUMN] = [row_id if isinstance(row_id, str) and row_id else uuid.uuid4().hex for row_id in row_ids]
+    delta_path = f"{get_period_journal_path(mcm_period)}/{_new_object_name()}"
+    if not write_dataframe(dbx, df_rows, delta_path):
+        return False
+
+    # A new period needs a manifest entry so that it is listed; existing periods are left untouched
+    def _register_period(manifest):
+        if mcm_period in manifest['partitions']:
+            return False
+        manifest['partitions'][mcm_period] = {'path': None, 'rows': 0, 'folded_deltas': [],
+                                              'updated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        return True
+
+    if not update_mcm_manifest(dbx, _register_period):
+        st.error("Failed to register the new MCM period in the data manifest.")
+        return False
+    if 'gstin' in df_rows.columns:
+        add_submitted_gstins(dbx, mcm_period, df_rows['gstin'].dropna().unique())
+
+    schedule_compaction_if_needed(dbx, mcm_period)
+    return True
+
+def schedule_compaction_if_needed(dbx, mcm_period):
+    """Starts a background compaction once a period has MCM_JOURNAL_COMPACTION_THRESHOLD pending deltas."""
+    entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}
+    if len(_pending_deltas(entry, list_period_journal(dbx, mcm_period))) >= MCM_JOURNAL_COMPACTION_THRESHOLD:
+        schedule_journal_compaction(dbx, mcm_period)
+
+def compact_period_journal(dbx, mcm_period):
+    """Folds the pending journal deltas of a period into a new partition snapshot and archives them."""
+    entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}
+    # Without new deltas a rewrite would only add an identical partition and history entry
+    if _pending_deltas(entry, list_period_journal(dbx, mcm_period)):
+        if not update_period_data(dbx, mcm_period, lambda df_period: df_period,
+                                  description=f"the compacted data for {mcm_period}", reason='compaction'):
+            return False
+        entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}
+    # Deltas the partition contains (also from an earlier run that stopped before archiving) are archived
+    deltas = list_period_journal(dbx, mcm_period)
+    folded = _folded_deltas(entry, deltas)
+    for delta in deltas:
+        if delta.name in folded:
+            _archive_journal_delta(dbx, mcm_period, delta)
+    prune_period_history(dbx, mcm_period)
+    return True
+
+_compactions_in_progress = set()
+_compaction_lock = threading.Lock()
+
+def schedule_journal_compaction(dbx, mcm_period):
+    """Runs compact_period_journal in a background thread (at most one per period at a time)."""
+    with _compaction_lock:
+        if mcm_period in _compactions_in_progress:
+            return
+        _compactions_in_progress.add(mcm_period)
+
+    def _run():
+        try:
+            compact_period_journal(dbx, mcm_period)
+        except Exception as e:
+            print(f"Journal compaction failed for {mcm_period}: {e}")
+        finally:
+            with _compaction_lock:
+                _compactions_in_progress.discard(mcm_period)
+
+    threading.Thread(target=_run, name=f"journal-compaction-{mcm_period}", daemon=True).start()
+
+_compaction_scheduler_started = False
+
+def start_journal_compaction_scheduler(dbx):
+    """Starts (once per process) a timer that compacts every period's journal periodically."""
+    global _compaction_scheduler_started
+    with _compaction_lock:
+        if _compaction_scheduler_started:
+            return
+        _compaction_scheduler_started = True
+
+    def _tick():
+        try:
+            for mcm_period in read_mcm_manifest(dbx)['partitions']:
+                if list_period_journal(dbx, mcm_period):
+                    schedule_journal_compaction(dbx, mcm_period)
+        except Exception as e:
+            print(f"Scheduled journal compaction failed: {e}")
+        timer = threading.Timer(MCM_JOURNAL_COMPACTION_INTERVAL_SECONDS, _tick)
+        timer.daemon = True
+        timer.start()
+
+    threading.Thread(target=_tick, name="journal-compaction-scheduler", daemon=True).start()
+
+# --- Version history ---
+# Partition files are immutable and are no longer deleted when a period is rewritten, and
+# compacted journal deltas are moved to MCM_DATA_JOURNAL_ARCHIVE_PATH instead of being deleted.
+# Every manifest commit is appended to the period's history file, so any past state is the
+# partition that was current at that time plus the deltas written after it, and a rollback
+# can usually just point the manifest back at an old partition. Versions older than
+# MCM_DATA_HISTORY_RETENTION_DAYS are dropped by prune_period_history, together with the
+# files no remaining version uses.
+
+def _get_period_history_path(mcm_period):
+    return f"{MCM_DATA_HISTORY_PATH}/{_period_file_stem(mcm_period)}.json"
+
+def _get_journal_archive_path(mcm_period):
+    return f"{MCM_DATA_JOURNAL_ARCHIVE_PATH}/{_period_file_stem(mcm_period)}"
+
+def _parse_history(content):
+    if not content:
+        return {'versions': []}
+    try:
+        history = json.loads(content)
+    except ValueError as e:
+        st.error(f"Error reading the MCM data version history from Dropbox: {e}")
+        return {'versions': []}
+    history.setdefault('versions', [])
+    return history
+
+def _record_period_version(dbx, mcm_period, entry, reason, replaced_entry=None):
+    """Appends a committed manifest entry to the period's history (seeded with the entry it replaced)."""
+    version = dict(entry, committed_at=_utc_stamp(), reason=reason)
+
+    def _apply(history):
+        if not history['versions'] and replaced_entry:
+            # History starts now: the replaced entry stands for everything before it
+            history['versions'].append(dict(replaced_entry, committed_at='', reason='before history'))
+        history['versions'].append(version)
+        return True
+
+    if not _update_json_file(dbx, _get_period_history_path(mcm_period), _parse_history, _apply,
+                             "the MCM data version history"):
+        print(f"Could not record a new version of {mcm_period} in its history.")
+
+def _archive_journal_delta(dbx, mcm_period, delta):
+    """Moves a compacted journal delta to the period's journal archive (kept for point-in-time reads)."""
+    try:
+        dbx.files_move_v2(delta.path_display, f"{_get_journal_archive_path(mcm_period)}/{delta.name}")
+    except ApiError as e:
+        print(f"Could not archive {delta.path_display}: {e}")
+    _download_cache.invalidate(delta.path_display)
+    _recent_reads.invalidate(delta.path_display)
+    _recent_reads.invalidate(get_period_journal_path(mcm_period))
+
+def prune_period_history(dbx, mcm_period):
+    """
+    Drops the versions older than the retention window from a period's history, then deletes
+    the partitions and archived deltas that only the dropped versions used. The newest version
+    from before the window is kept: it is the base of the oldest state that can still be read.
+    """
+    cutoff = _utc_stamp(datetime.now(timezone.utc) - timedelta(days=MCM_DATA_HISTORY_RETENTION_DAYS))
+    dropped, kept = [], []
+
+    def _apply(history):
+        versions = history['versions']
+        keep_from = max((i for i, version in enumerate(versions) if version['committed_at'] <= cutoff), default=0)
+        dropped[:], kept[:] = versions[:keep_from], versions[keep_from:]
+        if not dropped:
+            return False
+        history['versions'] = kept[:]
+        return True
+
+    if not _update_json_file(dbx, _get_period_history_path(mcm_period), _parse_history, _apply,
+                             "the MCM data version history"):
+        return False
+    if not dropped:
+        return True
+    # Only files a dropped version points to are candidates, never a partition still being committed
+    current_path = (read_mcm_manifest(dbx)['partitions'].get(mcm_period) or {}).get('path')
+    used_paths = {version.get('path') for version in kept} | {current_path}
+    for partition_path in {version.get('path') for version in dropped} - used_paths - {None}:
+        _delete_quietly(dbx, partition_path)
+    # Deltas folded in before the oldest kept version are contained in it, so no readable state applies them
+    archived = _list_folder_files(dbx, _get_journal_archive_path(mcm_period), "the journal archive")
+    folded = set().union(*(_folded_deltas(version, archived) for version in dropped))
+    for delta in archived:
+        if delta.name in folded:
+            _delete_quietly(dbx, delta.path_display)
+    return True
+
+def _period_versions(dbx, mcm_period):
+    """Committed versions of a period, oldest first. Without a history, the current entry is the only one."""
+    versions = _parse_history(download_file(dbx, _get_period_history_path(mcm_period)))['versions']
+    if versions:
+        return versions
+    entry = read_mcm_manifest(dbx)['partitions'].get(mcm_period)
+    return [dict(entry, committed_at='', reason='before history')] if entry else []
+
+def _as_of_stamp(as_of):
+    """Cutoff stamp for a datetime (naive values are local time), 'YYYY-MM-DD' string or pd.Timestamp."""
+    if isinstance(as_of, str):
+        as_of = pd.Timestamp(as_of)
+    if isinstance(as_of, pd.Timestamp):
+        as_of = as_of.to_pydatetime()
+    return _utc_stamp(as_of)
+
+def _delta_stamp(delta):
+    return delta.name.split('_', 1)[0]
+
+def _period_state_as_of(dbx, mcm_period, as_of):
+    """The version current at `as_of` and the journal deltas (live or archived) not in it, up to `as_of`."""
+    cutoff = _as_of_stamp(as_of)
+    versions = [v for v in _period_versions(dbx, mcm_period) if v['committed_at'] <= cutoff]
+    if not versions:
+        return None, []
+    deltas = {d.name: d for d in _list_folder_files(dbx, _get_journal_archive_path(mcm_period), "the journal archive")}
+    deltas.update({d.name: d for d in list_period_journal(dbx, mcm_period)})
+    deltas = [deltas[name] for name in sorted(deltas)]
+    # Entries only list the deltas still live when they were committed, so every earlier
+    # version's list counts too (deltas undone by a rollback are listed as folded as well)
+    folded = set().union(*(_folded_deltas(version, deltas) for version in versions))
+    return versions[-1], [d for d in deltas if d.name not in folded and _delta_stamp(d) <= cutoff]
+
+def read_period_data_as_of(dbx, mcm_period, as_of, columns=None):
+    """
+    Reads the DAR data of an MCM period as it was at `as_of` (a datetime; naive values are
+    local time). Returns an empty DataFrame if the period had no data yet.
+    States from before the version history was started are approximated by its oldest entry.
+    """
+    base, deltas = _period_state_as_of(dbx, mcm_period, as_of)
+    if base is None:
+        return pd.DataFrame()
+    df_period = _materialize_period(dbx, base.get('path'), deltas, columns)
+    df_period.attrs['as_of'] = _as_of_stamp(as_of)
+    return df_period
+
+def list_period_versions(dbx, mcm_period):
+    """Returns the committed versions of an MCM period as a DataFrame, newest first."""
+    versions = pd.DataFrame(_period_versions(dbx, mcm_period),
+                            columns=['committed_at', 'reason', 'rows', 'updated_at', 'path'])
+    versions['committed_at'] = pd.to_datetime(versions['committed_at'], format='%Y%m%dT%H%M%S%f',
+                                              errors='coerce', utc=True)
+    return versions.iloc[::-1].reset_index(drop=True)
+
+def diff_period_versions(dbx, mcm_period, as_of_old, as_of_new=None, key_cols=MCM_ROW_KEY_COLUMNS):
+    """
+    Compares the data of a period at two points in time (`as_of_new=None` means now), matching
+    rows by `key_cols`. Returns {'added': df, 'removed': df, 'changed': df}; 'changed' holds the
+    new rows whose values differ, with the names of the changed columns in 'changed_columns'.
+    """
+    df_old = read_period_data_as_of(dbx, mcm_period, as_of_old)
+    df_new = read_period_data(dbx, mcm_period) if as_of_new is None else read_period_data_as_of(dbx, mcm_period, as_of_new)
+    if df_old.empty or df_new.empty:
+        return {'added': df_new, 'removed': df_old, 'changed': pd.DataFrame()}
+
+    # Rows are matched with a merge on the normalized key columns, not row by row
+    key_names = [f"_key_{i}" for i in range(len(key_cols))]
+    old_keys = _key_frame(df_old, key_cols, key_names).assign(_old_row=range(len(df_old)))
+    new_keys = _key_frame(df_new, key_cols, key_names).assign(_new_row=range(len(df_new)))
+    matched = new_keys.merge(old_keys.drop_duplicates(key_names, keep='last'), on=key_names,
+                             how='left', indicator=True)
+    in_new = old_keys.merge(new_keys[key_names].drop_duplicates(), on=key_names, how='left', indicator=True)
+    both = matched[matched['_merge'] == 'both']
+
+    common_cols = [col for col in df_new.columns if col in df_old.columns]
+    old_values = df_old.iloc[both['_old_row'].to_numpy()][common_cols].reset_index(drop=True)
+    new_values = df_new.iloc[both['_new_row'].to_numpy()][common_cols].reset_index(drop=True)
+    differs = ~(old_values.isna() & new_values.isna()) & (old_values.astype(str) != new_values.astype(str))
+    row_changed = differs.any(axis=1).to_numpy()
+    df_changed = df_new.iloc[both['_new_row'].to_numpy()[row_changed]].reset_index(drop=True)
+    df_changed['changed_columns'] = differs[row_changed].dot(pd.Index(common_cols) + ', ').str[:-2].to_numpy()
+    return {
+        'added': df_new.iloc[matched.loc[matched['_merge'] == 'left_only', '_new_row'].to_numpy()].reset_index(drop=True),
+        'removed': df_old.iloc[in_new.loc[in_new['_merge'] == 'left_only', '_old_row'].to_numpy()].reset_index(drop=True),
+        'changed': df_changed,
+    }
+
+def _key_frame(df, key_cols, key_names):
+    """The normalized key values of df's rows (see _normalized_key_values), one column per key."""
+    return pd.DataFrame({
+        name: df[col].astype(object).map(_normalized_key_values) if col in df.columns else ''
+        for name, col in zip(key_names, key_cols)
+    }, index=df.index).reset_index(drop=True)
+
+def rollback_period(dbx, mcm_period, as_of):
+    """
+    Restores the data of an MCM period to its state at `as_of`, as a new version (the versions
+    in between stay in the history). When no journal delta was written between that state's
+    partition and `as_of`, the manifest is pointed back at the old partition without copying data.
+    """
+    base, deltas = _period_state_as_of(dbx, mcm_period, as_of)
+    if base is None:
+        st.error(f"There is no data for {mcm_period} at the selected time.")
+        return False
+    if deltas or not base.get('path'):
+        committed = update_period_data(dbx, mcm_period,
+                                       lambda _: _materialize_period(dbx, base.get('path'), deltas),
+                                       description=f"the rollback of {mcm_period}", reason='rollback')
+    else:
+        # Every delta already written is either in the old partition or newer than `as_of`,
+        # so all are listed as folded: the newer ones are undone
+        live_deltas = list_period_journal(dbx, mcm_period)
+        state = {}
+
+        def _apply(manifest):
+            state['replaced'] = manifest['partitions'].get(mcm_period) or {}
+            state['entry'] = manifest['partitions'][mcm_period] = {
+                'path': base['path'], 'rows': base.get('rows', 0), 'folded_deltas': [d.name for d in live_deltas],
+                'updated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            return True
+
+        committed = update_mcm_manifest(dbx, _apply)
+        if committed:
+            _record_period_version(dbx, mcm_period, state['entry'], 'rollback', state['replaced'])
+    if not committed:
+        st.error(f"Failed to roll back the data for {mcm_period}.")
+        return False
+    refresh_submitted_gstins(dbx, mcm_period)
+    return True
+
+def migrate_master_to_partitions(dbx):
+    """
+    One-time split of the legacy single workbook (MCM_DATA_PATH) into period partitions.
+    Does nothing once a manifest exists.
+    """
+    if download_file(dbx, MCM_DATA_MANIFEST_PATH):
+        return True
+
+    partitions = {}
+    legacy_df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+    if not legacy_df.empty and 'mcm_period' in legacy_df.columns:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for mcm_period, df_period in legacy_df.dropna(subset=['mcm_period']).groupby('mcm_period', sort=False):
+            partition_path = new_period_partition_path(mcm_period)
+            if not write_dataframe(dbx, df_period.reset_index(drop=True), partition_path):
+                st.error(f"Failed to migrate data for {mcm_period}. Migration will be retried.")
+                return False
+            partitions[mcm_period] = {
+                'path': partition_path, 'rows': int(len(df_period)),
+                'folded_deltas': [], 'updated_at': timestamp
+            }
+
+    def _create_manifest(manifest):
+        if manifest['partitions']:
+            return False  # Another session finished the migration first
+        manifest['partitions'] = partitions
+        return True
+
+    if not update_mcm_manifest(dbx, _create_manifest):
+        return False
+    return rebuild_submission_key_index(dbx)
+# # dropbox_utils.py
 # import streamlit as st
 # import dropbox
 # from dropbox.exceptions import AuthError, ApiError
@@ -0,0 +1,113 @@
+# extraction_cache.py
+"""
+Content-addressed cache of DAR extraction work, stored in DAR_EXTRACTION_CACHE_PATH.
+
+- <sha256 of PDF>.text.json: the preprocessed page text (tagged with pdf_extract.PDF_TEXT_VERSION)
+- <sha256 of PDF>.<extraction version>.report.json: the validated ParsedDARReport
+
+The extraction version (dar_processor.DAR_EXTRACTION_VERSION) changes with the model and
+prompt, so re-uploading the same PDF reuses the AI result only while they are unchanged.
+Entries older than DAR_EXTRACTION_CACHE_TTL_SECONDS are ignored and removed, and the oldest
+entries are evicted once the folder grows past DAR_EXTRACTION_CACHE_MAX_BYTES. Files are
+read through dropbox_utils, so a repeat read is served from the local download cache.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import dropbox
+
+from config import DAR_EXTRACTION_CACHE_PATH, DAR_EXTRACTION_CACHE_TTL_SECONDS, DAR_EXTRACTION_CACHE_MAX_BYTES
+from dropbox_utils import download_file, upload_file, delete_file, list_folder_metadata
+from models import ParsedDARReport
+
+def pdf_digest(pdf_bytes):
+    """SHA-256 of the PDF content, the cache key of everything extracted from it."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+def _text_path(digest):
+    return f"{DAR_EXTRACTION_CACHE_PATH}/{digest}.text.json"
+
+def _report_path(digest, version):
+    return f"{DAR_EXTRACTION_CACHE_PATH}/{digest}.{version}.report.json"
+
+def _read_entry(dbx, dropbox_path, version):
+    """The payload of a cache entry, or None if it is missing, expired or from another version."""
+    content = download_file(dbx, dropbox_path)
+    if not content:
+        return None
+    try:
+        entry = json.loads(content)
+    except ValueError:
+        return None
+    if entry.get('version') != version:
+        return None
+    if time.time() - entry.get('created_at', 0) > DAR_EXTRACTION_CACHE_TTL_SECONDS:
+        delete_file(dbx, dropbox_path)
+        return None
+    return entry.get('payload')
+
+def _write_entry(dbx, dropbox_path, version, payload):
+    entry = {'version': version, 'created_at': time.time(), 'payload': payload}
+    if upload_file(dbx, json.dumps(entry).encode('utf-8'), dropbox_path):
+        schedule_cache_eviction(dbx)
+
+def get_cached_pdf_text(dbx, digest, text_version):
+    """Returns the cached preprocessed text of a PDF, or None."""
+    return _read_entry(dbx, _text_path(digest), text_version)
+
+def put_cached_pdf_text(dbx, digest, text_version, text):
+    """Caches the preprocessed text of a PDF (extraction errors are not cached)."""
+    if text and not text.startswith("Error"):
+        _write_entry(dbx, _text_path(digest), text_version, text)
+
+def get_cached_report(dbx, digest, extraction_version):
+    """Returns the cached ParsedDARReport of a PDF for this model/prompt version, or None."""
+    payload = _read_entry(dbx, _report_path(digest, extraction_version), extraction_version)
+    if payload is None:
+        return None
+    try:
+        return ParsedDARReport.model_validate(payload)
+    except ValueError:
+        return None
+
+def put_cached_report(dbx, digest, extraction_version, report):
+    """Caches a ParsedDARReport; reports with parsing errors are not cached, so they are retried."""
+    if report.parsing_errors:
+        return
+    _write_entry(dbx, _report_path(digest, extraction_version), extraction_version, report.model_dump(mode='json'))
+
+def evict_extraction_cache(dbx):
+    """Deletes expired entries, then the oldest ones until the cache fits DAR_EXTRACTION_CACHE_MAX_BYTES."""
+    children = list_folder_metadata(dbx, DAR_EXTRACTION_CACHE_PATH)
+    if not children:
+        return
+    files = sorted((entry for entry in children.values() if isinstance(entry, dropbox.files.FileMetadata)),
+                   key=lambda entry: entry.server_modified)
+    # server_modified is a naive UTC datetime, so the cutoff is made naive to compare with it
+    expired_before = (datetime.now(timezone.utc) - timedelta(seconds=DAR_EXTRACTION_CACHE_TTL_SECONDS)).replace(tzinfo=None)
+    total_bytes = sum(entry.size for entry in files)
+    for entry in files:
+        if entry.server_modified >= expired_before and total_bytes <= DAR_EXTRACTION_CACHE_MAX_BYTES:
+            break
+        delete_file(dbx, entry.path_display)
+        total_bytes -= entry.size
+
+_eviction_running = threading.Lock()
+
+def schedule_cache_eviction(dbx):
+    """Runs evict_extraction_cache in a background thread (skipped if one is already running)."""
+    if not _eviction_running.acquire(blocking=False):
+        return
+
+    def _run():
+        try:
+            evict_extraction_cache(dbx)
+        except Exception as e:
+            print(f"Extraction cache eviction failed: {e}")
+        finally:
+            _eviction_running.release()
+
+    threading.Thread(target=_run, name="extraction-cache-eviction", daemon=True).start()
@@ -0,0 +1,101 @@
+# pdf_extract.py
+"""
+Parallel layout-mode text extraction for DAR PDFs.
+
+pdfplumber's layout mode is CPU-bound, so the pages are split into ranges that worker
+processes extract independently; the text is reassembled in page order with the same
+"--- PAGE n ---" markers as a sequential run. The pool is shared by all sessions of the
+app process. Its size is capped by PDF_EXTRACT_MAX_WORKERS, and each worker is replaced
+after PDF_EXTRACT_MAX_TASKS_PER_CHILD ranges so pdfplumber's caches cannot keep growing.
+The PDF is written once to a temporary file that every worker opens, so its bytes are not
+pickled through the pool's pipes (and held by a worker) once per range.
+
+Workers import this module to run extract_page_range, so it only imports pdfplumber at the
+top (config pulls in Streamlit and its secrets); the settings are read in the app process.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import pdfplumber
+
+# Identifies the extraction settings; cached texts (extraction_cache.py) from other settings are not reused
+PDF_TEXT_VERSION = f"pdfplumber-{pdfplumber.__version__}-layout-x2-y2"
+
+def _page_text(page, page_number):
+    page_text = page.extract_text(x_tolerance=2, y_tolerance=2, layout=True)
+    if page_text is None:
+        return f"[INFO: Page {page_number} yielded no text directly]"
+    return page_text.replace("None", "")
+
+def extract_page_range(pdf_source, start, stop):
+    """
+    Returns the marked text of pages [start, stop) (0-based) of a PDF given as bytes or as a
+    file path. Runs in a worker process.
+    """
+    parts = []
+    with pdfplumber.open(pdf_source if isinstance(pdf_source, str) else BytesIO(pdf_source)) as pdf:
+        for i in range(start, min(stop, len(pdf.pages))):
+            page = pdf.pages[i]
+            parts.append(f"\n--- PAGE {i + 1} ---\n{_page_text(page, i + 1)}")
+            page.close()  # Frees the page's parsed objects before the next one
+    return "".join(parts)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(max_workers, max_tasks_per_child):
+    """Creates (once per process) the shared extraction pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Workers are spawned, not forked: the app process runs many threads
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=max_tasks_per_child
+            )
+        return _pool
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def extract_pdf_text(pdf_bytes):
+    """
+    Extracts the text of every page of a PDF, in page order, each page prefixed by
+    "--- PAGE n ---". Large PDFs are split across the worker pool; small ones (and any
+    run where the pool fails) are extracted in this process.
+    """
+    from config import (
+        PDF_EXTRACT_MAX_WORKERS, PDF_EXTRACT_PAGES_PER_TASK, PDF_EXTRACT_MAX_TASKS_PER_CHILD,
+        PDF_EXTRACT_PARALLEL_MIN_PAGES
+    )
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        num_pages = len(pdf.pages)
+    if num_pages < PDF_EXTRACT_PARALLEL_MIN_PAGES or PDF_EXTRACT_MAX_WORKERS <= 1:
+        return extract_page_range(pdf_bytes, 0, num_pages)
+
+    # At least one range per worker, but no range longer than PDF_EXTRACT_PAGES_PER_TASK
+    pages_per_task = max(1, min(PDF_EXTRACT_PAGES_PER_TASK, -(-num_pages // PDF_EXTRACT_MAX_WORKERS)))
+    ranges = [(start, start + pages_per_task) for start in range(0, num_pages, pages_per_task)]
+    fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(pdf_bytes)
+        pool = _get_pool(PDF_EXTRACT_MAX_WORKERS, PDF_EXTRACT_MAX_TASKS_PER_CHILD)
+        futures = [pool.submit(extract_page_range, pdf_path, start, stop) for start, stop in ranges]
+        return "".join(future.result() for future in futures)
+    except BrokenProcessPool as e:
+        print(f"PDF extraction pool failed ({e}); extracting in-process instead.")
+        _discard_pool()
+        return extract_page_range(pdf_bytes, 0, num_pages)
+    finally:
+        os.remove(pdf_path)
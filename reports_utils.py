@@ -2,52 +2,44 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from dropbox_utils import read_from_spreadsheet
-from config import LOG_FILE_PATH
-
-# Expected column names in the log sheet.
-LOG_SHEET_COLUMNS = ['Timestamp', 'Username', 'Role']
+from dropbox_utils import get_login_daily_counts, LOGIN_DAILY_COLUMNS
 
 @st.cache_data(ttl=300)
 def get_log_data(_dbx):
     """
-    Reads and caches data from the log spreadsheet in Dropbox.
+    Reads and caches the daily per-user login counts from Dropbox.
     The _dbx argument is prefixed with an underscore to indicate it's
     used for caching purposes and shouldn't be hashed.
     """
     if not _dbx:
-        return pd.DataFrame(columns=LOG_SHEET_COLUMNS)
-    
-    # Read the log file directly from the defined path in Dropbox
-    df = read_from_spreadsheet(_dbx, LOG_FILE_PATH)
-    
-    # Return an empty DataFrame with correct columns if the sheet is empty or has a different structure
-    if df.empty or list(df.columns) != LOG_SHEET_COLUMNS:
-         return pd.DataFrame(columns=LOG_SHEET_COLUMNS)
-         
-    return df
+        return pd.DataFrame(columns=LOGIN_DAILY_COLUMNS)
+    return get_login_daily_counts(_dbx)
+
+def _last_days(df_daily, days):
+    """Day buckets of the last `days` days (dates are ISO strings, so they compare as text)."""
+    cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    return df_daily[df_daily['Date'] >= cutoff_date]
 
-def generate_login_report(df_logs, days):
+def generate_login_report(df_daily, days):
     """
-    Processes the log DataFrame to generate the login activity report.
-    (This function requires no changes as it is platform-agnostic)
+    Sums the daily login buckets of the selected time period per user.
     """
-    if df_logs.empty:
+    if df_daily.empty:
         return pd.DataFrame()
 
-    # Ensure timestamp column is in datetime format
-    df_logs['Timestamp'] = pd.to_datetime(df_logs['Timestamp'], errors='coerce')
-    df_logs.dropna(subset=['Timestamp'], inplace=True)
-
-    # Filter logs for the selected time period
-    cutoff_date = datetime.now() - timedelta(days=days)
-    filtered_logs = df_logs[df_logs['Timestamp'] >= cutoff_date]
-
+    filtered_logs = _last_days(df_daily, days)
     if filtered_logs.empty:
         return pd.DataFrame()
 
     # Count logins and sort the results
-    login_counts = filtered_logs.groupby(['Username', 'Role']).size().reset_index(name='Login Count')
+    login_counts = filtered_logs.groupby(['Username', 'Role'])['Logins'].sum().reset_index(name='Login Count')
     report = login_counts.sort_values(by='Login Count', ascending=False).reset_index(drop=True)
-    
+
     return report
+
+def generate_login_trend(df_daily, days):
+    """Logins per day and user for the selected time period, for the trend chart."""
+    if df_daily.empty:
+        return pd.DataFrame()
+    filtered_logs = _last_days(df_daily, days)
+    return filtered_logs.sort_values(['Date', 'Username']).reset_index(drop=True)
@@ -0,0 +1,508 @@
+# storage_backends.py
+"""
+Storage backends for the app's file store, selected with STORAGE_BACKEND in config.py.
+
+All of dropbox_utils is written against the Dropbox client (`dbx`). Each backend here
+implements the part of that client API the app uses, returning the same metadata types
+and raising the same `ApiError`s for missing files and write conflicts. Every helper in
+dropbox_utils (and so every page) therefore runs unchanged on any backend:
+
+- "dropbox": the real Dropbox client (default)
+- "google":  files in a Google Drive folder (service account from st.secrets["google_credentials"])
+- "local":   files under a local directory, with optional injected latency for benchmarking
+
+TimedStorageClient wraps any backend and records how long each storage call takes,
+which separates storage/network time from CPU time in a flow.
+"""
+import abc
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from io import BytesIO
+from types import SimpleNamespace
+
+import dropbox
+from dropbox.exceptions import ApiError
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# --- Dropbox-compatible results and errors ---
+
+def _normalize_path(path):
+    return '/' + path.strip('/') if path.strip('/') else ''
+
+def _file_metadata(path, rev, size, content_hash=None):
+    path = _normalize_path(path)
+    # Dropbox reports modification times as naive UTC datetimes
+    modified = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    return dropbox.files.FileMetadata(
+        name=path.rsplit('/', 1)[-1], id='id:' + hashlib.md5(path.lower().encode('utf-8')).hexdigest(),
+        client_modified=modified, server_modified=modified,
+        rev=rev, size=size, path_lower=path.lower(), path_display=path, content_hash=content_hash
+    )
+
+def _folder_metadata(path):
+    path = _normalize_path(path)
+    return dropbox.files.FolderMetadata(
+        name=path.rsplit('/', 1)[-1], id='id:' + hashlib.md5(path.lower().encode('utf-8')).hexdigest(),
+        path_lower=path.lower(), path_display=path
+    )
+
+def _content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def _api_error(error):
+    return ApiError(uuid.uuid4().hex, error, None, None)
+
+def _not_found(error_type):
+    """ApiError saying a path does not exist, shaped like Dropbox's for the given error union."""
+    not_found = dropbox.files.LookupError.not_found
+    if error_type is dropbox.files.DeleteError:
+        return _api_error(dropbox.files.DeleteError.path_lookup(not_found))
+    if error_type is dropbox.files.RelocationError:
+        return _api_error(dropbox.files.RelocationError.from_lookup(not_found))
+    return _api_error(error_type.path(not_found))
+
+def _upload_conflict():
+    return _api_error(dropbox.files.UploadError.path(dropbox.files.UploadWriteFailed(
+        reason=dropbox.files.WriteError.conflict(dropbox.files.WriteConflictError.file), upload_session_id='')))
+
+def _folder_conflict():
+    return dropbox.files.WriteError.conflict(dropbox.files.WriteConflictError.folder)
+
+class StorageClient(abc.ABC):
+    """
+    Base class for non-Dropbox backends. Subclasses implement the abstract primitives
+    _stat, _read, _write, _list, _delete, _mkdir and _share (a backend missing one cannot be
+    created); the Dropbox-style methods used by dropbox_utils are built on top of them here.
+    """
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._sessions = {}
+
+    # Primitives (paths are normalized, e.g. '/e-MCM_App/file.xlsx')
+    @abc.abstractmethod
+    def _stat(self, path):
+        """Returns None if missing, ('folder', None, 0) or ('file', rev, size)."""
+
+    @abc.abstractmethod
+    def _read(self, path):
+        """Returns (content, rev) or None if the file does not exist."""
+
+    @abc.abstractmethod
+    def _write(self, path, content):
+        """Creates or replaces a file (creating parent folders) and returns its new rev."""
+
+    @abc.abstractmethod
+    def _list(self, path):
+        """Returns [(name, is_folder, rev, size)] of a folder's children, or None if it does not exist."""
+
+    @abc.abstractmethod
+    def _delete(self, path):
+        """Deletes a file or folder. Returns False if it did not exist."""
+
+    @abc.abstractmethod
+    def _mkdir(self, path):
+        """Creates a folder (and parents). Returns False if it already existed."""
+
+    @abc.abstractmethod
+    def _share(self, path):
+        """Returns a URL for viewing the file."""
+
+    # Dropbox client API used by the app
+    def users_get_current_account(self):
+        return SimpleNamespace(name=type(self).__name__)
+
+    def check_and_refresh_access_token(self):
+        pass
+
+    def files_get_metadata(self, path, **kwargs):
+        path = _normalize_path(path)
+        info = self._stat(path)
+        if info is None:
+            raise _not_found(dropbox.files.GetMetadataError)
+        kind, rev, size = info
+        return _folder_metadata(path) if kind == 'folder' else _file_metadata(path, rev, size)
+
+    def files_download(self, path, **kwargs):
+        path = _normalize_path(path)
+        result = self._read(path)
+        if result is None:
+            raise _not_found(dropbox.files.DownloadError)
+        content, rev = result
+        return _file_metadata(path, rev, len(content), _content_hash(content)), SimpleNamespace(content=content)
+
+    def files_upload(self, f, path, mode=None, autorename=False, **kwargs):
+        path = _normalize_path(path)
+        mode = mode or dropbox.files.WriteMode.add
+        with self._write_lock:
+            if not mode.is_overwrite():
+                info = self._stat(path)
+                current_rev = info[1] if info and info[0] == 'file' else None
+                if mode.is_add() and info is not None:
+                    raise _upload_conflict()
+                if mode.is_update() and current_rev != mode.get_update():
+                    raise _upload_conflict()
+            rev = self._write(path, f)
+        return _file_metadata(path, rev, len(f), _content_hash(f))
+
+    def files_list_folder(self, path, **kwargs):
+        path = _normalize_path(path)
+        children = self._list(path)
+        if children is None:
+            raise _not_found(dropbox.files.ListFolderError)
+        entries = [_folder_metadata(f"{path}/{name}") if is_folder else _file_metadata(f"{path}/{name}", rev, size)
+                   for name, is_folder, rev, size in children]
+        return SimpleNamespace(entries=entries, has_more=False, cursor='')
+
+    def files_list_folder_continue(self, cursor):
+        return SimpleNamespace(entries=[], has_more=False, cursor=cursor)
+
+    def files_delete_v2(self, path):
+        path = _normalize_path(path)
+        if not self._delete(path):
+            raise _not_found(dropbox.files.DeleteError)
+        return SimpleNamespace(metadata=_file_metadata(path, '0' * 9, 0))
+
+    def files_move_v2(self, from_path, to_path, autorename=False, **kwargs):
+        from_path, to_path = _normalize_path(from_path), _normalize_path(to_path)
+        with self._write_lock:
+            result = self._read(from_path)
+            if result is None:
+                raise _not_found(dropbox.files.RelocationError)
+            rev = self._write(to_path, result[0])
+            self._delete(from_path)
+        return SimpleNamespace(metadata=_file_metadata(to_path, rev, len(result[0])))
+
+    def files_create_folder_v2(self, path, autorename=False):
+        path = _normalize_path(path)
+        if not self._mkdir(path):
+            raise _api_error(dropbox.files.CreateFolderError.path(_folder_conflict()))
+        return SimpleNamespace(metadata=_folder_metadata(path))
+
+    def files_create_folder_batch(self, paths, autorename=False, force_async=False):
+        entries = []
+        for path in paths:
+            if self._mkdir(_normalize_path(path)):
+                entries.append(dropbox.files.CreateFolderBatchResultEntry.success(
+                    dropbox.files.CreateFolderEntryResult(metadata=_folder_metadata(path))))
+            else:
+                entries.append(dropbox.files.CreateFolderBatchResultEntry.failure(
+                    dropbox.files.CreateFolderEntryError.path(_folder_conflict())))
+        return dropbox.files.CreateFolderBatchLaunch.complete(dropbox.files.CreateFolderBatchResult(entries=entries))
+
+    def files_upload_session_start(self, f, close=False, **kwargs):
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = bytearray(f)
+        return dropbox.files.UploadSessionStartResult(session_id=session_id)
+
+    def _check_offset(self, cursor):
+        data = self._sessions.get(cursor.session_id)
+        if data is None:
+            raise _api_error(dropbox.files.UploadSessionAppendError.not_found)
+        if cursor.offset != len(data):
+            raise _api_error(dropbox.files.UploadSessionAppendError.incorrect_offset(
+                dropbox.files.UploadSessionOffsetError(correct_offset=len(data))))
+        return data
+
+    def files_upload_session_append_v2(self, f, cursor, close=False, **kwargs):
+        self._check_offset(cursor).extend(f)
+
+    def files_upload_session_finish(self, f, cursor, commit, **kwargs):
+        data = self._check_offset(cursor)
+        data.extend(f)
+        del self._sessions[cursor.session_id]
+        return self.files_upload(bytes(data), commit.path, mode=commit.mode)
+
+    def sharing_list_shared_links(self, path=None, cursor=None, direct_only=None):
+        # Links are derived from the path on these backends, so there is nothing to list
+        return SimpleNamespace(links=[], has_more=False, cursor='')
+
+    def sharing_create_shared_link_with_settings(self, path, settings=None):
+        path = _normalize_path(path)
+        return SimpleNamespace(url=self._share(path), path_lower=path.lower())
+
+# --- Local filesystem backend ---
+
+class LocalStorageClient(StorageClient):
+    """
+    Stores files under `root_dir`. Each API call sleeps `latency_seconds` (plus the transfer
+    time at `bandwidth_mbps`, if set) to imitate a remote store, so flows can be benchmarked
+    offline with realistic or exaggerated network cost.
+    """
+    def __init__(self, root_dir, latency_seconds=0.0, bandwidth_mbps=0.0):
+        super().__init__()
+        self.root_dir = os.path.abspath(root_dir)
+        self.latency_seconds = latency_seconds
+        self.bandwidth_mbps = bandwidth_mbps
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _delay(self, num_bytes=0):
+        delay = self.latency_seconds
+        if self.bandwidth_mbps and num_bytes:
+            delay += num_bytes * 8 / (self.bandwidth_mbps * 1_000_000)
+        if delay:
+            time.sleep(delay)
+
+    def _local(self, path):
+        return os.path.join(self.root_dir, *[part for part in path.split('/') if part])
+
+    @staticmethod
+    def _rev(local_path):
+        return f"{os.stat(local_path).st_mtime_ns:016x}"
+
+    def _stat(self, path):
+        self._delay()
+        local_path = self._local(path)
+        if os.path.isdir(local_path):
+            return ('folder', None, 0)
+        if os.path.isfile(local_path):
+            return ('file', self._rev(local_path), os.path.getsize(local_path))
+        return None
+
+    def _read(self, path):
+        local_path = self._local(path)
+        if not os.path.isfile(local_path):
+            self._delay()
+            return None
+        with open(local_path, 'rb') as fh:
+            content = fh.read()
+        self._delay(len(content))
+        return content, self._rev(local_path)
+
+    def _write(self, path, content):
+        self._delay(len(content))
+        local_path = self._local(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as fh:
+            fh.write(content)
+        os.replace(tmp_path, local_path)
+        # Guarantee a new rev even when two writes land within the filesystem's timestamp resolution
+        now_ns = max(time.time_ns(), os.stat(local_path).st_mtime_ns + 1)
+        os.utime(local_path, ns=(now_ns, now_ns))
+        return self._rev(local_path)
+
+    def _list(self, path):
+        self._delay()
+        local_path = self._local(path)
+        if not os.path.isdir(local_path):
+            return None
+        children = []
+        for name in sorted(os.listdir(local_path)):
+            if name.endswith('.tmp'):
+                continue
+            child = os.path.join(local_path, name)
+            is_folder = os.path.isdir(child)
+            children.append((name, is_folder, None if is_folder else self._rev(child),
+                             0 if is_folder else os.path.getsize(child)))
+        return children
+
+    def _delete(self, path):
+        self._delay()
+        local_path = self._local(path)
+        if os.path.isdir(local_path):
+            for dirpath, dirnames, filenames in os.walk(local_path, topdown=False):
+                for name in filenames:
+                    os.remove(os.path.join(dirpath, name))
+                os.rmdir(dirpath)
+            return True
+        if os.path.isfile(local_path):
+            os.remove(local_path)
+            return True
+        return False
+
+    def _mkdir(self, path):
+        self._delay()
+        local_path = self._local(path)
+        if os.path.isdir(local_path):
+            return False
+        os.makedirs(local_path)
+        return True
+
+    def _share(self, path):
+        self._delay()
+        return 'file://' + self._local(path)
+
+# --- Google Drive backend ---
+
+class GoogleDriveStorageClient(StorageClient):
+    """
+    Stores files in a Google Drive folder (`root_folder_id`), mapping '/a/b/file' to nested
+    folders. The file's Drive `version` is used as its rev. Conditional writes compare versions
+    under a process-wide lock, which is enough for the app's single-process deployment.
+    """
+    def __init__(self, drive_service, root_folder_id):
+        super().__init__()
+        self.drive = drive_service
+        self.root_folder_id = root_folder_id
+        self._folder_ids = {'': root_folder_id}
+        self._id_lock = threading.Lock()
+
+    @staticmethod
+    def _rev(item):
+        return f"{int(item.get('version', 0)):09x}"
+
+    def _find_child(self, parent_id, name):
+        safe_name = name.replace("\\", "\\\\").replace("'", "\\'")
+        response = self.drive.files().list(
+            q=f"name = '{safe_name}' and '{parent_id}' in parents and trashed = false",
+            spaces='drive', fields='files(id, name, mimeType, version, size)'
+        ).execute()
+        items = response.get('files', [])
+        return items[0] if items else None
+
+    def _folder_id(self, path, create=False):
+        """Returns the Drive id of a folder path, creating missing folders if `create`."""
+        with self._id_lock:
+            if path.lower() in self._folder_ids:
+                return self._folder_ids[path.lower()]
+        parent_path, _, name = path.rpartition('/')
+        parent_id = self._folder_id(parent_path, create=create)
+        if parent_id is None:
+            return None
+        item = self._find_child(parent_id, name)
+        if item is None or item['mimeType'] != FOLDER_MIME_TYPE:
+            if not create:
+                return None
+            item = self.drive.files().create(
+                body={'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]}, fields='id'
+            ).execute()
+        with self._id_lock:
+            self._folder_ids[path.lower()] = item['id']
+        return item['id']
+
+    def _item(self, path):
+        parent_path, _, name = path.rpartition('/')
+        parent_id = self._folder_id(parent_path)
+        return self._find_child(parent_id, name) if parent_id else None
+
+    def _stat(self, path):
+        item = self._item(path) if path else {'mimeType': FOLDER_MIME_TYPE}
+        if item is None:
+            return None
+        if item['mimeType'] == FOLDER_MIME_TYPE:
+            return ('folder', None, 0)
+        return ('file', self._rev(item), int(item.get('size', 0)))
+
+    def _read(self, path):
+        from googleapiclient.http import MediaIoBaseDownload
+        item = self._item(path)
+        if item is None or item['mimeType'] == FOLDER_MIME_TYPE:
+            return None
+        buffer = BytesIO()
+        downloader = MediaIoBaseDownload(buffer, self.drive.files().get_media(fileId=item['id']))
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        return buffer.getvalue(), self._rev(item)
+
+    def _write(self, path, content):
+        from googleapiclient.http import MediaIoBaseUpload
+        parent_path, _, name = path.rpartition('/')
+        parent_id = self._folder_id(parent_path, create=True)
+        media = MediaIoBaseUpload(BytesIO(content), mimetype='application/octet-stream', resumable=True)
+        item = self._find_child(parent_id, name)
+        if item is None:
+            item = self.drive.files().create(
+                body={'name': name, 'parents': [parent_id]}, media_body=media, fields='id, version'
+            ).execute()
+        else:
+            item = self.drive.files().update(fileId=item['id'], media_body=media, fields='id, version').execute()
+        return self._rev(item)
+
+    def _list(self, path):
+        folder_id = self._folder_id(path)
+        if folder_id is None:
+            return None
+        children, page_token = [], None
+        while True:
+            response = self.drive.files().list(
+                q=f"'{folder_id}' in parents and trashed = false", spaces='drive',
+                fields='nextPageToken, files(id, name, mimeType, version, size)', pageToken=page_token
+            ).execute()
+            for item in response.get('files', []):
+                is_folder = item['mimeType'] == FOLDER_MIME_TYPE
+                children.append((item['name'], is_folder, None if is_folder else self._rev(item),
+                                 0 if is_folder else int(item.get('size', 0))))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return sorted(children)
+
+    def _delete(self, path):
+        item = self._item(path)
+        if item is None:
+            return False
+        self.drive.files().delete(fileId=item['id']).execute()
+        with self._id_lock:
+            self._folder_ids.pop(path.lower(), None)
+        return True
+
+    def _mkdir(self, path):
+        if self._folder_id(path) is not None:
+            return False
+        self._folder_id(path, create=True)
+        return True
+
+    def _share(self, path):
+        item = self._item(path)
+        info = self.drive.files().get(fileId=item['id'], fields='webViewLink, permissions(type, role)').execute()
+        # Links are requested for every record shown, so the public permission is only added once
+        if not any(p.get('type') == 'anyone' for p in info.get('permissions', [])):
+            self.drive.permissions().create(fileId=item['id'], body={'type': 'anyone', 'role': 'reader'}).execute()
+        return info.get('webViewLink')
+
+def create_google_drive_client(credentials_info, root_folder_id):
+    """Builds a GoogleDriveStorageClient from service-account credentials."""
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+    creds = service_account.Credentials.from_service_account_info(
+        credentials_info, scopes=['https://www.googleapis.com/auth/drive']
+    )
+    return GoogleDriveStorageClient(build('drive', 'v3', credentials=creds), root_folder_id)
+
+# --- Timing instrumentation ---
+
+class TimedStorageClient:
+    """
+    Wraps a storage client and records the count and total duration of every API call,
+    i.e. the storage/network share of a flow's time. Thread-safe.
+    """
+    def __init__(self, client, backend_name):
+        self._client = client
+        self.backend_name = backend_name
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._stats_lock:
+                    op_stats = self._stats.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                    op_stats['calls'] += 1
+                    op_stats['seconds'] += elapsed
+        return timed
+
+    def get_stats(self):
+        """Returns {operation: {'calls', 'seconds'}} since the last reset."""
+        with self._stats_lock:
+            return {op: dict(op_stats) for op, op_stats in self._stats.items()}
+
+    def total_seconds(self):
+        with self._stats_lock:
+            return sum(op_stats['seconds'] for op_stats in self._stats.values())
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {}
@@ -0,0 +1,27 @@
+# conftest.py
+"""
+Test setup: config.py reads st.secrets when it is imported, so a secrets file selecting the
+local storage backend is written first, and every test gets an empty LocalStorageClient
+with fresh download and read caches.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+import streamlit as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_SECRETS_PATH = os.path.join(tempfile.mkdtemp(prefix="e_mcm_tests_"), "secrets.toml")
+with open(_SECRETS_PATH, 'w', encoding='utf-8') as fh:
+    fh.write('storage_backend = "local"\n')
+st.config.set_option('secrets.files', [_SECRETS_PATH])
+
+@pytest.fixture
+def dbx(tmp_path, monkeypatch):
+    import dropbox_utils
+    from storage_backends import LocalStorageClient
+    monkeypatch.setattr(dropbox_utils, '_download_cache', dropbox_utils.DownloadCache(str(tmp_path / "cache"), 10 ** 8, 100))
+    monkeypatch.setattr(dropbox_utils, '_recent_reads', dropbox_utils.RecentReadCache(0))
+    return LocalStorageClient(str(tmp_path / "store"))
@@ -0,0 +1,98 @@
+# test_period_store.py
+import pandas as pd
+
+import dropbox_utils as du
+
+PERIOD = "April 2025"
+
+def _rows(gstin, paras=(1,)):
+    return pd.DataFrame({'gstin': [gstin] * len(paras), 'audit_para_number': list(paras),
+                         'record_created_date': ["2025-04-01 10:00:00"] * len(paras)})
+
+def _gstins(dbx):
+    return sorted(du.read_period_data(dbx, PERIOD)['gstin'].astype(str).unique())
+
+def test_compaction_folds_and_archives_deltas(dbx):
+    du.append_period_rows(dbx, PERIOD, _rows("33AAAAA0000A1Z5"))
+    du.append_period_rows(dbx, PERIOD, _rows("33BBBBB0000B1Z5"))
+    assert du.compact_period_journal(dbx, PERIOD)
+    assert du.list_period_journal(dbx, PERIOD) == []
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5", "33BBBBB0000B1Z5"]
+
+def test_delta_uploaded_after_a_later_delta_was_compacted(dbx):
+    du.append_period_rows(dbx, PERIOD, _rows("33AAAAA0000A1Z5"))
+    # Named now, but its upload only finishes after the next delta has been compacted
+    late_name = du._new_object_name()
+    du.append_period_rows(dbx, PERIOD, _rows("33BBBBB0000B1Z5"))
+    assert du.compact_period_journal(dbx, PERIOD)
+
+    late_path = f"{du.get_period_journal_path(PERIOD)}/{late_name}"
+    assert du.write_dataframe(dbx, _rows("33CCCCC0000C1Z5"), late_path)
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5", "33BBBBB0000B1Z5", "33CCCCC0000C1Z5"]
+
+    assert du.compact_period_journal(dbx, PERIOD)
+    assert du.list_period_journal(dbx, PERIOD) == []
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5", "33BBBBB0000B1Z5", "33CCCCC0000C1Z5"]
+
+def test_rollback_restores_the_state_at_a_past_time(dbx):
+    du.append_period_rows(dbx, PERIOD, _rows("33AAAAA0000A1Z5"))
+    assert du.compact_period_journal(dbx, PERIOD)
+    as_of = du.list_period_versions(dbx, PERIOD).at[0, 'committed_at'].to_pydatetime()
+    du.append_period_rows(dbx, PERIOD, _rows("33BBBBB0000B1Z5"))
+    assert du.compact_period_journal(dbx, PERIOD)
+    du.append_period_rows(dbx, PERIOD, _rows("33CCCCC0000C1Z5"))
+
+    assert sorted(du.read_period_data_as_of(dbx, PERIOD, as_of)['gstin']) == ["33AAAAA0000A1Z5"]
+    assert du.rollback_period(dbx, PERIOD, as_of)
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5"]
+    assert du.compact_period_journal(dbx, PERIOD)
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5"]
+
+def test_gstin_listed_in_the_index_without_data_is_not_a_duplicate(dbx):
+    du.append_period_rows(dbx, PERIOD, _rows("33AAAAA0000A1Z5"))
+    # As if the process stopped after the index update but the delta never landed
+    du.add_submitted_gstins(dbx, PERIOD, ["33BBBBB0000B1Z5"])
+
+    assert du.is_gstin_submitted(dbx, PERIOD, "33AAAAA0000A1Z5")
+    assert not du.is_gstin_submitted(dbx, PERIOD, "33BBBBB0000B1Z5")
+    assert du.read_submission_key_index(dbx)['periods'][PERIOD] == ["33AAAAA0000A1Z5"]
+
+def test_delete_removes_only_the_selected_row_without_para_number(dbx):
+    header_rows = _rows("33AAAAA0000A1Z5", paras=(None, None))
+    du.append_period_rows(dbx, PERIOD, header_rows)
+    df_period = du.read_period_data(dbx, PERIOD)
+    assert df_period[du.MCM_ROW_ID_COLUMN].nunique() == 2
+
+    row_key = {col: df_period.at[0, col] for col in du.MCM_ROW_KEY_COLUMNS}
+    assert du.delete_period_rows(dbx, PERIOD, du.MCM_ROW_KEY_COLUMNS, [row_key])
+    assert du.read_period_data(dbx, PERIOD)[du.MCM_ROW_ID_COLUMN].tolist() == [df_period.at[1, du.MCM_ROW_ID_COLUMN]]
+
+def test_delete_matching_more_rows_than_selected_is_refused(dbx):
+    du.append_period_rows(dbx, PERIOD, _rows("33AAAAA0000A1Z5", paras=(None, None)))
+    # Without row_id (as for rows stored before it existed) the key matches both rows
+    key_cols = ['gstin', 'audit_para_number', 'record_created_date']
+    df_period = du.read_period_data(dbx, PERIOD)
+    row_key = {col: df_period.at[0, col] for col in key_cols}
+
+    assert not du.delete_period_rows(dbx, PERIOD, key_cols, [row_key])
+    assert len(du.read_period_data(dbx, PERIOD)) == 2
+
+def test_history_pruning_deletes_only_files_of_dropped_versions(dbx, monkeypatch):
+    for gstin in ["33AAAAA0000A1Z5", "33BBBBB0000B1Z5"]:
+        du.append_period_rows(dbx, PERIOD, _rows(gstin))
+        assert du.compact_period_journal(dbx, PERIOD)
+    assert len(du.list_period_versions(dbx, PERIOD)) == 3
+
+    monkeypatch.setattr(du, 'MCM_DATA_HISTORY_RETENTION_DAYS', 0)
+    du.append_period_rows(dbx, PERIOD, _rows("33CCCCC0000C1Z5"))
+    assert du.compact_period_journal(dbx, PERIOD)
+
+    versions = du.list_period_versions(dbx, PERIOD)
+    current_path = du.read_mcm_manifest(dbx)['partitions'][PERIOD]['path']
+    partition_folder = current_path.rsplit('/', 1)[0]
+    assert versions['path'].tolist() == [current_path]
+    assert [entry.path_display for entry in dbx.files_list_folder(partition_folder).entries] == [current_path]
+    # Only the delta folded into the kept version is still archived
+    archived = du._list_folder_files(dbx, du._get_journal_archive_path(PERIOD), "the journal archive")
+    assert [d.name for d in archived] == du.read_mcm_manifest(dbx)['partitions'][PERIOD]['folded_deltas']
+    assert _gstins(dbx) == ["33AAAAA0000A1Z5", "33BBBBB0000B1Z5", "33CCCCC0000C1Z5"]
@@ -0,0 +1,28 @@
+# test_visualisation_utils.py
+import warnings
+
+import pandas as pd
+import pytest
+
+import dropbox_utils as du
+
+pytest.importorskip("plotly")
+from visualisation_utils import get_detailed_classification_analysis
+
+PERIOD = "April 2025"
+
+def test_classification_breakdown_only_lists_codes_present(dbx):
+    codes = ['TP01', 'TP02', 'RC01', 'IT03']
+    du.append_period_rows(dbx, PERIOD, pd.DataFrame({
+        'gstin': ["33AAAAA0000A1Z5"] * len(codes), 'audit_para_number': range(1, len(codes) + 1),
+        'record_created_date': ["2025-04-01 10:00:00"] * len(codes), 'para_classification_code': codes,
+        'revenue_involved_rs': [100000.0] * len(codes), 'revenue_recovered_rs': [50000.0] * len(codes),
+    }))
+    # para_classification_code is categorical, so every other code is a category of each filtered frame
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        analysis = get_detailed_classification_analysis(dbx, PERIOD)
+
+    assert sorted(analysis) == ['IT', 'RC', 'TP']
+    assert analysis['TP']['detection_data']['para_classification_code'].tolist() == ['TP01', 'TP02']
+    assert analysis['RC']['recovery_data']['para_classification_code'].tolist() == ['RC01']
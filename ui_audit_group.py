@@ -12,31 +12,35 @@ import html
 # --- Custom Module Imports for Dropbox Version ---
 from dropbox_utils import (
     read_from_spreadsheet,
-    update_spreadsheet_from_df,
-    upload_file,
-    get_shareable_link
+    append_period_rows,
+    delete_period_rows,
+    MCM_ROW_KEY_COLUMNS,
+    upload_large_file,
+    get_shareable_link,
+    resolve_dar_pdf_urls,
+    is_gstin_submitted
+)
+from dar_index import query_dar_rows
+from dar_processor import (
+    preprocess_pdf_text, find_gstins_in_text, get_structured_data_from_llm, get_para_classifications_from_llm,
+    pre_extract_header, HEADER_MIN_CONFIDENCE, DAR_EXTRACTION_VERSION
+)
+from pdf_extract import PDF_TEXT_VERSION
+from extraction_cache import (
+    pdf_digest, get_cached_pdf_text, put_cached_pdf_text, get_cached_report, put_cached_report
 )
-from dar_processor import preprocess_pdf_text, get_structured_data_from_llm, get_para_classifications_from_llm
 from validation_utils import validate_data_for_sheet, VALID_CATEGORIES, VALID_PARA_STATUSES
 from config import (
     USER_CREDENTIALS,
     MCM_PERIODS_INFO_PATH,
-    MCM_DATA_PATH,
     DAR_PDFS_PATH,
     TAXPAYER_CLASSIFICATION_OPTIONS,
-    GST_RISK_PARAMETERS
+    GST_RISK_PARAMETERS,
+    SHEET_DATA_COLUMNS_ORDER
 )
 from models import ParsedDARReport
 
 # --- Constants and Configuration ---
-SHEET_DATA_COLUMNS_ORDER = [
-    "mcm_period", "audit_group_number", "audit_circle_number", "gstin", "trade_name",
-    "category", "taxpayer_classification", "total_amount_detected_overall_rs",
-    "total_amount_recovered_overall_rs", "audit_para_number", "audit_para_heading",
-    "revenue_involved_rs", "revenue_recovered_rs", "status_of_para",
-    "para_classification_code", "risk_flags_data", "dar_pdf_path", "record_created_date"
-]
-
 DISPLAY_COLUMN_ORDER_EDITOR = [
     "audit_group_number", "audit_circle_number", "gstin", "trade_name", "category",
     "total_amount_detected_overall_rs", "total_amount_recovered_overall_rs",
@@ -178,21 +182,62 @@ def upload_dar_tab(dbx, active_periods, api_key):
         pdf_bytes = st.session_state.ag_current_uploaded_file_obj.getvalue()
         st.session_state.ag_pdf_bytes = pdf_bytes
         progress_bar.progress(33, text="▶️ Stage 1/3: Pre-processing PDF content...")
-        preprocessed_text = preprocess_pdf_text(BytesIO(pdf_bytes))
+        # A PDF that was extracted before (same bytes) reuses the cached text and AI result
+        digest = pdf_digest(pdf_bytes)
+        preprocessed_text = get_cached_pdf_text(dbx, digest, PDF_TEXT_VERSION)
+        if preprocessed_text is None:
+            preprocessed_text = preprocess_pdf_text(BytesIO(pdf_bytes))
+            put_cached_pdf_text(dbx, digest, PDF_TEXT_VERSION, preprocessed_text)
         if preprocessed_text.startswith("Error"):
             st.error(f"❌ Failed: {preprocessed_text}")
             st.stop()
+
+        # Skip the AI extraction for a DAR that is already in this period. Only the GSTIN read
+        # from the header pages is certain enough to stop here; the check at submit is the authoritative one
+        pre_header, confidences = pre_extract_header(preprocessed_text)
+        if confidences.get('gstin', 0) >= HEADER_MIN_CONFIDENCE:
+            if is_gstin_submitted(dbx, selected_period_str, pre_header.gstin):
+                progress_bar.empty()
+                st.error(f"❌ A DAR for GSTIN {pre_header.gstin} has already been submitted for {selected_period_str}. First delete the entries if you want to re-upload!")
+                st.stop()
+        else:
+            gstins_in_pdf = find_gstins_in_text(preprocessed_text)
+            if gstins_in_pdf and is_gstin_submitted(dbx, selected_period_str, gstins_in_pdf[0]):
+                st.warning(f"⚠️ This PDF mentions GSTIN {gstins_in_pdf[0]}, which already has a DAR for {selected_period_str}. Please check that this is not a re-upload.")
         
         #progress_bar.progress(66, text="▶️ Stage 2/3: Extracting with AI...")
         progress_bar.progress(66)
-        st.markdown(
-            "<div style='padding: 10px; background-color: #e3f2fd; border-left: 4px solid #2196f3; margin: 10px 0;'>"
-            "<strong style='color: #1976d2; font-size: 16px;'>▶️ Stage 2/3: Extracting with AI</strong><br>"
-            "<span style='color: #424242;'>(It may take 2 minutes..Pls wait)</span>"
-            "</div>", 
-            unsafe_allow_html=True
-        )
-        parsed_data = get_structured_data_from_llm(preprocessed_text)
+        parsed_data = get_cached_report(dbx, digest, DAR_EXTRACTION_VERSION)
+        if parsed_data is None:
+            # Header fields with fixed patterns are shown right away, before the AI call
+            if confidences:
+                st.dataframe(
+                    pd.DataFrame([{"Field": field, "Value": str(getattr(pre_header, field)), "Confidence": conf}
+                                  for field, conf in confidences.items()]),
+                    column_config={"Confidence": st.column_config.ProgressColumn("Confidence", min_value=0, max_value=1)},
+                    hide_index=True, use_container_width=True
+                )
+            st.markdown(
+                "<div style='padding: 10px; background-color: #e3f2fd; border-left: 4px solid #2196f3; margin: 10px 0;'>"
+                "<strong style='color: #1976d2; font-size: 16px;'>▶️ Stage 2/3: Extracting with AI</strong><br>"
+                "<span style='color: #424242;'>(It may take 2 minutes..Pls wait)</span>"
+                "</div>", 
+                unsafe_allow_html=True
+            )
+            # Paras are shown as they stream in; the editable grid follows once the answer is complete
+            live_preview = st.empty()
+
+            def show_progress(header, paras):
+                with live_preview.container():
+                    if header:
+                        st.caption(f"Header received: {header.trade_name or '-'} ({header.gstin or 'GSTIN not found'})")
+                    if paras:
+                        st.caption(f"{len(paras)} para(s) received so far...")
+                        st.dataframe(pd.DataFrame([para.model_dump() for para in paras]),
+                                     hide_index=True, use_container_width=True)
+
+            parsed_data = get_structured_data_from_llm(preprocessed_text, on_progress=show_progress)
+            put_cached_report(dbx, digest, DAR_EXTRACTION_VERSION, parsed_data)
         if parsed_data.parsing_errors:
             st.warning(f"AI Parsing Issues: {parsed_data.parsing_errors}")
        
@@ -327,22 +372,21 @@ def upload_dar_tab(dbx, active_periods, api_key):
                 return
 
             status_area.info("✅ Step 1/7: Validation successful. \n\n▶️ Step 2/7: Checking for duplicates...")
-            master_df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
             current_gstin = df_to_submit['gstin'].iloc[0]
-            if not master_df.empty and 'gstin' in master_df.columns and 'mcm_period' in master_df.columns:
-                is_duplicate = not master_df[(master_df['gstin'] == current_gstin) & (master_df['mcm_period'] == selected_period_str)].empty
-                if is_duplicate:
-                    status_area.error(f"❌ Submission Failed: A DAR for GSTIN {current_gstin} has already been submitted for {selected_period_str}.First Delete the entries if u want to re-upload!")
-                    st.session_state.ag_submission_in_progress = False  # Reset on error
-                    return
+            if is_gstin_submitted(dbx, selected_period_str, current_gstin):
+                status_area.error(f"❌ Submission Failed: A DAR for GSTIN {current_gstin} has already been submitted for {selected_period_str}.First Delete the entries if u want to re-upload!")
+                st.session_state.ag_submission_in_progress = False  # Reset on error
+                return
 
             status_area.info("✅ Step 2/7: No duplicates found. \n\n▶️ Step 3/7: Uploading PDF...")
             dar_filename = f"AG{st.session_state.audit_group_no}_{st.session_state.ag_current_uploaded_file_name}"
             pdf_path = f"{DAR_PDFS_PATH}/{dar_filename}"
-            if not upload_file(dbx, st.session_state.ag_pdf_bytes, pdf_path):
+            if not upload_large_file(dbx, st.session_state.ag_pdf_bytes, pdf_path):
                 status_area.error("❌ Submission Failed: Could not upload PDF.")
                 st.session_state.ag_submission_in_progress = False  # Reset on error
                 return
+            # Stored with the rows so that listing the uploads never has to look links up
+            pdf_url = get_shareable_link(dbx, pdf_path)
             
             status_area.info("✅ Step 3/7: PDF uploaded. \n\n▶️ Step 4/7: Classifying paras with AI...")
             headings = df_to_submit[df_to_submit['audit_para_number'].notna()]['audit_para_heading'].tolist()
@@ -357,22 +401,25 @@ def upload_dar_tab(dbx, active_periods, api_key):
                 para_rows = df_to_submit['audit_para_number'].notna()
                 df_to_submit.loc[para_rows, 'para_classification_code'] = classifications[:len(df_to_submit[para_rows])]
 
-            status_area.info("✅ Step 4/7: Classification complete. \n\n▶️ Step 5/7: Reading master data (final check)...")
-            master_df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+            status_area.info("✅ Step 4/7: Classification complete. \n\n▶️ Step 5/7: Re-checking for duplicates (final check)...")
+            if is_gstin_submitted(dbx, selected_period_str, current_gstin):
+                status_area.error(f"❌ Submission Failed: A DAR for GSTIN {current_gstin} was submitted for {selected_period_str} while this upload was in progress.")
+                st.session_state.ag_submission_in_progress = False  # Reset on error
+                return
             
-            status_area.info("✅ Step 5/7: Master data read. \n\n▶️ Step 6/7: Preparing final data...")
+            status_area.info("✅ Step 5/7: No duplicates found. \n\n▶️ Step 6/7: Preparing final data...")
             df_to_submit['mcm_period'] = selected_period_str
             df_to_submit['dar_pdf_path'] = pdf_path
+            df_to_submit['dar_pdf_url'] = pdf_url
             df_to_submit['record_created_date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             risk_json = json.dumps(st.session_state.ag_risk_flags_data) if not st.session_state.get('ag_no_risk_flags', False) else None
             df_to_submit['risk_flags_data'] = pd.Series([risk_json] + [None] * (len(df_to_submit) - 1))
             for col in SHEET_DATA_COLUMNS_ORDER:
-                if col not in master_df.columns: master_df[col] = pd.NA
                 if col not in df_to_submit.columns: df_to_submit[col] = pd.NA
 
             status_area.info("✅ Step 6/7: Data prepared. \n\n▶️ Step 7/7: Saving to Dropbox...")
-            final_df = pd.concat([master_df, df_to_submit[SHEET_DATA_COLUMNS_ORDER]], ignore_index=True)
-            if update_spreadsheet_from_df(dbx, final_df, MCM_DATA_PATH):
+            # Only the new rows are written (as a journal delta); the period file is not re-uploaded
+            if append_period_rows(dbx, selected_period_str, df_to_submit[SHEET_DATA_COLUMNS_ORDER]):
                 status_area.success("✅ Submission complete! Data saved successfully.")
                 st.balloons()
                 time.sleep(2)
@@ -584,26 +631,15 @@ def view_uploads_tab(dbx):
     if not selected_period: return
 
     with st.spinner("Loading your uploaded reports..."):
-        df_all_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
-        if df_all_data.empty:
-            st.info("No reports have been submitted yet.")
-            return
-        df_all_data['audit_group_number'] = pd.to_numeric(df_all_data['audit_group_number'], errors='coerce')
-        my_uploads = df_all_data[(df_all_data['audit_group_number'] == st.session_state.audit_group_no) & (df_all_data['mcm_period'] == selected_period)].copy()
+        my_uploads = query_dar_rows(dbx, selected_period, audit_group_number=st.session_state.audit_group_no)
         if my_uploads.empty:
             st.info(f"You have not submitted any reports for {selected_period}.")
             return
         
         st.markdown(f"<h4>Your Uploads for {selected_period}:</h4>", unsafe_allow_html=True)
         
-        @st.cache_data(ttl=600)
-        def get_link(_dbx, path):
-            return get_shareable_link(_dbx, path)
-
-        if 'dar_pdf_path' in my_uploads.columns:
-            my_uploads['pdf_url'] = my_uploads['dar_pdf_path'].apply(
-                lambda path: get_link(dbx, path) if pd.notna(path) else None
-            )
+        # Stored links first; older rows fall back to the shared link cache (no per-row API calls)
+        my_uploads['pdf_url'] = resolve_dar_pdf_urls(dbx, my_uploads)
 
         risk_flags_str = ""
         risk_data_json = my_uploads['risk_flags_data'].dropna().iloc[0] if 'risk_flags_data' in my_uploads.columns and not my_uploads['risk_flags_data'].dropna().empty else None
@@ -644,34 +680,29 @@ def delete_entries_tab(dbx):
     period_options_map = {f"{row['month_name']} {row['year']}": f"{row['month_name']} {row['year']}" for _, row in all_periods.iterrows()}
     selected_period = st.selectbox("Select MCM Period to Manage", options=list(period_options_map.keys()))
     if not selected_period: return
-    master_df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
-    if master_df.empty:
-        st.info("Master data file is empty.")
-        return
-    master_df['original_index'] = master_df.index
-    master_df['audit_group_number'] = pd.to_numeric(master_df['audit_group_number'], errors='coerce')
-    my_entries = master_df[(master_df['audit_group_number'] == st.session_state.audit_group_no) & (master_df['mcm_period'] == selected_period)].copy()
+    my_entries = query_dar_rows(dbx, selected_period, audit_group_number=st.session_state.audit_group_no)
     if my_entries.empty:
         st.info(f"You have no entries in {selected_period} to delete.")
         return
     my_entries['delete_label'] = ("TN: " + my_entries['trade_name'].astype(str).str.slice(0, 25) + "... | " +
                                   "Para: " + my_entries['audit_para_number'].astype(str) + " | " +
                                   "Date: " + my_entries['record_created_date'].astype(str))
-    deletable_map = my_entries.set_index('delete_label')['original_index'].to_dict()
+    deletable_map = {label: idx for idx, label in my_entries['delete_label'].items()}
     options = ["--Select an entry--"] + list(deletable_map.keys())
     selected_label = st.selectbox("Select Entry to Delete:", options=options)
     if selected_label != "--Select an entry--":
         index_to_delete = deletable_map.get(selected_label)
         if index_to_delete is not None:
-            details = master_df.loc[index_to_delete]
+            details = my_entries.loc[index_to_delete]
             st.warning(f"Confirm Deletion: **{details['trade_name']}**, Para: **{details['audit_para_number']}**")
             with st.form(key=f"delete_form_{index_to_delete}"):
                 password = st.text_input("Enter your password to confirm:", type="password")
                 if st.form_submit_button("Yes, Delete This Entry", type="primary"):
                     if password == USER_CREDENTIALS.get(st.session_state.username):
                         with st.spinner("Deleting entry..."):
-                            df_after_delete = master_df.drop(index=index_to_delete).drop(columns=['original_index'])
-                            if update_spreadsheet_from_df(dbx, df_after_delete, MCM_DATA_PATH):
+                            # Delete by row key so that concurrent changes to the period are not lost
+                            row_key = {col: details.get(col) for col in MCM_ROW_KEY_COLUMNS}
+                            if delete_period_rows(dbx, selected_period, MCM_ROW_KEY_COLUMNS, [row_key]):
                                 st.success("Entry deleted successfully!")
                                 time.sleep(1)
                                 st.rerun()
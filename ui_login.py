@@ -44,6 +44,7 @@ def login_page():
     if st.button("Login", key="login_button_styled", use_container_width=True):
         if username in USER_CREDENTIALS and USER_CREDENTIALS[username] == password:
             st.session_state.logged_in = True
+            st.session_state.login_logged = False
             st.session_state.username = username
             st.session_state.role = USER_ROLES[username]
             if st.session_state.role == "AuditGroup":
@@ -18,8 +18,12 @@ from PyPDF2 import PdfWriter, PdfReader
 from reportlab.pdfgen import canvas
 
 # Dropbox-based imports
-from dropbox_utils import read_from_spreadsheet, download_file, update_spreadsheet_from_df
-from config import MCM_PERIODS_INFO_PATH, MCM_DATA_PATH
+from dropbox_utils import (
+    read_from_spreadsheet, download_file, update_spreadsheet_from_df,
+    read_period_data, patch_rows, MCM_ROW_KEY_COLUMNS
+)
+from config import MCM_PERIODS_INFO_PATH
+from dar_schema import fill_missing
 
 # --- NEW IMPORTS for Report Generation ---
 from mcm_report_generator import PDFReportGenerator
@@ -242,7 +246,7 @@ def mcm_agenda_tab(dbx):
     with st.container(border=True):
         st.markdown("<h5>Overall Remarks for the Meeting</h5>", unsafe_allow_html=True)
 
-        df_periods_for_remarks = read_from_spreadsheet(dbx, MCM_PERIODS_INFO_PATH)
+        df_periods_for_remarks = df_periods.copy()
         if df_periods_for_remarks is None:
             df_periods_for_remarks = pd.DataFrame(columns=['key', 'overall_remarks'])
         if 'overall_remarks' not in df_periods_for_remarks.columns:
@@ -295,24 +299,18 @@ def mcm_agenda_tab(dbx):
     # --- Data Loading using Session State ---
     if 'df_period_data' not in st.session_state or st.session_state.get('current_period_key') != selected_period:
         with st.spinner(f"Loading data for {month_year_str}..."):
-            df = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+            df = read_period_data(dbx, selected_period)
             if df is None or df.empty:
                 st.info(f"No data found in the spreadsheet for {month_year_str}.")
                 st.session_state.df_period_data = pd.DataFrame()
                 return
             
-            # Filter data for selected period
-            df = df[df['mcm_period'] == selected_period].copy()
-            
-            # Convert numeric columns
-            cols_to_convert_numeric = ['audit_group_number', 'audit_circle_number', 'total_amount_detected_overall_rs',
-                                       'total_amount_recovered_overall_rs', 'audit_para_number',
-                                       'revenue_involved_lakhs_rs', 'revenue_recovered_lakhs_rs']
-            for col_name in cols_to_convert_numeric:
-                if col_name in df.columns:
-                    df[col_name] = df[col_name].astype(str).str.replace(r'[^\d.]', '', regex=True)
-                    df[col_name] = pd.to_numeric(df[col_name], errors='coerce')
-                else:
+            # Numeric columns arrive typed from read_period_data (see dar_schema); add any that are missing
+            cols_numeric = ['audit_group_number', 'audit_circle_number', 'total_amount_detected_overall_rs',
+                            'total_amount_recovered_overall_rs', 'audit_para_number',
+                            'revenue_involved_lakhs_rs', 'revenue_recovered_lakhs_rs']
+            for col_name in cols_numeric:
+                if col_name not in df.columns:
                     df[col_name] = 0 if "amount" in col_name.lower() or "revenue" in col_name.lower() else pd.NA
             
             st.session_state.df_period_data = df
@@ -325,7 +323,7 @@ def mcm_agenda_tab(dbx):
 
     # --- Code to derive Audit Circle and set up UI loops ---
     circle_col_to_use = 'audit_circle_number'
-    if 'audit_circle_number' not in df_period_data_full.columns or not df_period_data_full['audit_circle_number'].notna().any() or not pd.to_numeric(df_period_data_full['audit_circle_number'], errors='coerce').fillna(0).astype(int).gt(0).any():
+    if 'audit_circle_number' not in df_period_data_full.columns or not df_period_data_full['audit_circle_number'].notna().any() or not df_period_data_full['audit_circle_number'].fillna(0).gt(0).any():
         if 'audit_group_number' in df_period_data_full.columns and df_period_data_full['audit_group_number'].notna().any():
             df_period_data_full['derived_audit_circle_number'] = df_period_data_full['audit_group_number'].apply(calculate_audit_circle_agenda).fillna(0).astype(int)
             circle_col_to_use = 'derived_audit_circle_number'
@@ -626,6 +624,7 @@ def mcm_agenda_tab(dbx):
                                     
                                     new_chair_remark = st.session_state.get(chair_remark_key, "")
 
+                                    row_updates = []
                                     for index, row in df_trade_paras_item.iterrows():
                                         para_num_str = str(int(row["audit_para_number"])) if pd.notna(row["audit_para_number"]) and row["audit_para_number"] != 0 else "N/A"
                                         decision_key = f"mcm_decision_{trade_name_item}_{para_num_str}_{index}"
@@ -634,11 +633,16 @@ def mcm_agenda_tab(dbx):
                                         # Update both decision and remark in the main session state dataframe
                                         st.session_state.df_period_data.loc[index, 'mcm_decision'] = selected_decision
                                         st.session_state.df_period_data.loc[index, 'chair_remarks'] = new_chair_remark
+                                        row_update = {col: row.get(col) for col in MCM_ROW_KEY_COLUMNS}
+                                        row_update.update({'mcm_decision': selected_decision, 'chair_remarks': new_chair_remark})
+                                        row_updates.append(row_update)
                                     
-                                    success = update_spreadsheet_from_df(
+                                    # Only the changed cells of this assessee's paras are written
+                                    success = patch_rows(
                                         dbx=dbx,
-                                        df_to_write=st.session_state.df_period_data,
-                                        dropbox_path=MCM_DATA_PATH
+                                        mcm_period=selected_period,
+                                        key_cols=MCM_ROW_KEY_COLUMNS,
+                                        updates=row_updates
                                     )
                                     
                                     if success:
@@ -688,7 +692,7 @@ def mcm_agenda_tab(dbx):
 
                 # Filter and sort data for PDF
                 df_for_pdf = df_period_data_full.dropna(subset=['dar_pdf_path', 'trade_name', circle_col_to_use]).copy()
-                df_for_pdf[circle_col_to_use] = pd.to_numeric(df_for_pdf[circle_col_to_use], errors='coerce').fillna(0).astype(int)
+                df_for_pdf[circle_col_to_use] = df_for_pdf[circle_col_to_use].astype(int)
 
                 # Get unique DARs, sorted for consistent processing order
                 unique_dars_to_process = df_for_pdf.sort_values(by=[circle_col_to_use, 'trade_name', 'dar_pdf_path']).drop_duplicates(subset=['dar_pdf_path'])
@@ -901,7 +905,7 @@ def mcm_agenda_tab(dbx):
             mcm_date = st.session_state.get(mcm_date_key)
             with st.spinner("Generating Short PDF Summary... Please wait."):
                 # 1. Fetch data and charts
-                vital_stats, charts = get_visualization_data(dbx, selected_period)
+                vital_stats, charts = get_visualization_data(dbx, selected_period, df_periods=df_periods)
                 if not vital_stats or not charts:
                     st.error("Could not fetch visualization data to generate the report.")
                     return
@@ -909,9 +913,9 @@ def mcm_agenda_tab(dbx):
                 vital_stats['mcm_date'] = mcm_date.strftime("%d %B, %Y") if mcm_date else None
             
                 # 2. ENHANCE with MCM detailed data for new sections
-                df_mcm_current = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+                df_mcm_current = st.session_state.df_period_data  # Already loaded for the agenda above
                 if df_mcm_current is not None and not df_mcm_current.empty:
-                    df_mcm_filtered = df_mcm_current[df_mcm_current['mcm_period'] == selected_period].copy()
+                    df_mcm_filtered = df_mcm_current.copy()
                     
                     # Prepare MCM detailed data for Section VIII
                     mcm_columns = [
@@ -942,27 +946,11 @@ def mcm_agenda_tab(dbx):
                         df_mcm_paras['revenue_recovered_lakhs_rs'] = pd.to_numeric(df_mcm_paras['revenue_recovered_lakhs_rs'], errors='coerce').fillna(0)
                         df_mcm_paras['chair_remarks'] = df_mcm_paras['chair_remarks'].fillna('')
                         df_mcm_paras['mcm_decision'] = df_mcm_paras['mcm_decision'].fillna('Decision pending')
-                        df_mcm_paras['status_of_para'] = df_mcm_paras['status_of_para'].fillna('Status not updated')
+                        df_mcm_paras['status_of_para'] = fill_missing(df_mcm_paras, 'status_of_para', 'Status not updated')
                         
                         # Update vital_stats with MCM data
                         vital_stats['mcm_detailed_data'] = df_mcm_paras[mcm_columns].to_dict('records')
                         
-                        # Get overall remarks from periods data
-                        df_periods_remarks = read_from_spreadsheet(dbx, MCM_PERIODS_INFO_PATH)
-                        if df_periods_remarks is not None and 'overall_remarks' in df_periods_remarks.columns:
-                            try:
-                                month_name, year_str = selected_period.split(" ")
-                                year_val = int(year_str)
-                                period_row = df_periods_remarks[
-                                    (df_periods_remarks['month_name'] == month_name) & 
-                                    (df_periods_remarks['year'] == year_val)
-                                ]
-                                if not period_row.empty:
-                                    overall_remarks = period_row.iloc[0].get('overall_remarks', '')
-                                    if pd.notna(overall_remarks):
-                                        vital_stats['overall_remarks'] = overall_remarks
-                            except:
-                                pass
                 
                 # 3. Convert Plotly charts to images in memory
                 chart_images = [BytesIO(chart.to_image(format="svg", width=520, height=300)) for chart in charts]
@@ -996,7 +984,7 @@ def mcm_agenda_tab(dbx):
             mcm_date = st.session_state.get(mcm_date_key)
             with st.spinner("Generating Detailed PDF Summary... This may take a moment."):
                 # 1. Fetch data and charts  
-                vital_stats, charts = get_visualization_data(dbx, selected_period)
+                vital_stats, charts = get_visualization_data(dbx, selected_period, df_periods=df_periods)
                 if not vital_stats or not charts:
                     st.error("Could not fetch visualization data to generate the report.")
                     return
@@ -1004,9 +992,9 @@ def mcm_agenda_tab(dbx):
                 vital_stats['mcm_date'] = mcm_date.strftime("%d %B, %Y") if mcm_date else None
             
                 # 2. ENHANCE with MCM detailed data (same as above)
-                df_mcm_current = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+                df_mcm_current = st.session_state.df_period_data  # Already loaded for the agenda above
                 if df_mcm_current is not None and not df_mcm_current.empty:
-                    df_mcm_filtered = df_mcm_current[df_mcm_current['mcm_period'] == selected_period].copy()
+                    df_mcm_filtered = df_mcm_current.copy()
                     
                     mcm_columns = [
                         'audit_group_number', 'gstin', 'trade_name', 'category', 
@@ -1033,25 +1021,10 @@ def mcm_agenda_tab(dbx):
                         df_mcm_paras['revenue_recovered_lakhs_rs'] = pd.to_numeric(df_mcm_paras['revenue_recovered_lakhs_rs'], errors='coerce').fillna(0)
                         df_mcm_paras['chair_remarks'] = df_mcm_paras['chair_remarks'].fillna('')
                         df_mcm_paras['mcm_decision'] = df_mcm_paras['mcm_decision'].fillna('Decision pending')
-                        df_mcm_paras['status_of_para'] = df_mcm_paras['status_of_para'].fillna('Status not updated')
+                        df_mcm_paras['status_of_para'] = fill_missing(df_mcm_paras, 'status_of_para', 'Status not updated')
                         
                         vital_stats['mcm_detailed_data'] = df_mcm_paras[mcm_columns].to_dict('records')
                         
-                        df_periods_remarks = read_from_spreadsheet(dbx, MCM_PERIODS_INFO_PATH)
-                        if df_periods_remarks is not None and 'overall_remarks' in df_periods_remarks.columns:
-                            try:
-                                month_name, year_str = selected_period.split(" ")
-                                year_val = int(year_str)
-                                period_row = df_periods_remarks[
-                                    (df_periods_remarks['month_name'] == month_name) & 
-                                    (df_periods_remarks['year'] == year_val)
-                                ]
-                                if not period_row.empty:
-                                    overall_remarks = period_row.iloc[0].get('overall_remarks', '')
-                                    if pd.notna(overall_remarks):
-                                        vital_stats['overall_remarks'] = overall_remarks
-                            except:
-                                pass
     
                 # 3. Convert Plotly charts to images in memory
                 chart_images = [BytesIO(chart.to_image(format="png", scale=2)) for chart in charts]
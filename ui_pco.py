@@ -7,8 +7,13 @@ from streamlit_option_menu import option_menu
 import json
 import numpy as np
 # Dropbox-based imports
-from dropbox_utils import read_from_spreadsheet, update_spreadsheet_from_df
-from config import MCM_PERIODS_INFO_PATH, MCM_DATA_PATH,USER_CREDENTIALS
+from dropbox_utils import (
+    read_from_spreadsheet, update_spreadsheet_from_df, read_period_data, patch_rows, diff_edited_rows, MCM_ROW_KEY_COLUMNS,
+    read_all_period_data, export_dataframe_to_excel,
+    list_period_versions, diff_period_versions, rollback_period
+)
+from config import MCM_PERIODS_INFO_PATH, USER_CREDENTIALS
+from dar_schema import fill_missing, to_plain_dtypes
 
 # Import tab modules
 from ui_mcm_agenda import mcm_agenda_tab
@@ -457,23 +462,17 @@ def pco_dashboard(dbx):
         if not selected_period:
             return
 
-        with st.spinner("Loading all report data..."):
-            df_all_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+        with st.spinner("Loading report data for the period..."):
+            df_period_data = read_period_data(dbx, selected_period)
 
-        if df_all_data is None or df_all_data.empty:
-            st.info("No DARs have been submitted by any group yet.")
-            return
-
-        df_filtered = df_all_data[df_all_data['mcm_period'] == selected_period].copy()
-
-        if df_filtered.empty:
+        if df_period_data is None or df_period_data.empty:
             st.info(f"No data found for the period: {selected_period}")
             return
 
+        df_filtered = df_period_data.copy()
+
         # Summary section
         st.markdown("#### Summary of Uploads")
-        df_filtered['audit_group_number'] = pd.to_numeric(df_filtered['audit_group_number'], errors='coerce')
-        df_filtered['audit_circle_number'] = pd.to_numeric(df_filtered['audit_circle_number'], errors='coerce')
         
         # Table 1: DARs & Audit Paras per Group (FULL WIDTH)
         st.markdown("**DARs & Audit Paras Uploaded per Group:**")
@@ -519,18 +518,48 @@ def pco_dashboard(dbx):
         # Table 3: Para Status Summary (FULL WIDTH)
         st.markdown("**Para Status Summary:**")
         if 'status_of_para' in df_filtered.columns:
-            status_summary = df_filtered['status_of_para'].value_counts().reset_index(name='Count')
+            status_summary = df_filtered['status_of_para'].value_counts()[lambda counts: counts > 0].reset_index(name='Count')
             status_summary.columns = ['Status of Para', 'Count']
             st.dataframe(status_summary, use_container_width=True, hide_index=True)
         else:
             st.info("Para status information not available in the data")
 
+        # Excel is only an export format; the master data itself is stored as Parquet partitions
+        st.markdown("---")
+        st.markdown("**Export Data:**")
+        export_col1, export_col2 = st.columns(2)
+        with export_col1:
+            # The workbook is only built on request, not on every rerun of this view
+            if st.button(f"Prepare Excel of {selected_period}", use_container_width=True):
+                with st.spinner("Building the Excel file..."):
+                    period_excel = export_dataframe_to_excel(df_filtered)
+                st.download_button(
+                    label=f"📥 Download {selected_period} as Excel",
+                    data=period_excel,
+                    file_name=f"mcm_dar_data_{selected_period.replace(' ', '_')}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
+        with export_col2:
+            if st.button("Prepare Excel of All Periods", use_container_width=True):
+                with st.spinner("Combining data of all MCM periods..."):
+                    df_full_history = read_all_period_data(dbx)
+                st.download_button(
+                    label="📥 Download All Periods as Excel",
+                    data=export_dataframe_to_excel(df_full_history),
+                    file_name="mcm_dar_data_all_periods.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
+
         st.markdown("<hr>")
         st.markdown(f"#### Edit Detailed Data for {selected_period}")
         st.info("You can edit data below. Click 'Save Changes' to update the master file.", icon="✍️")
 
+        # Categoricals would limit the editor to existing values, so it edits plain-typed data
+        df_editable = to_plain_dtypes(df_filtered)
         edited_df = st.data_editor(
-            df_filtered, 
+            df_editable, 
             use_container_width=True, 
             hide_index=True, 
             num_rows="dynamic", 
@@ -539,15 +568,54 @@ def pco_dashboard(dbx):
 
         if st.button("Save Changes to Master File", type="primary"):
             with st.spinner("Saving changes to Dropbox..."):
-                # Update the master dataframe with edited rows
-                df_all_data.update(edited_df)
-                if update_spreadsheet_from_df(dbx, df_all_data, MCM_DATA_PATH):
+                # Only the edited cells are written, as a patch keyed by each row's identity
+                row_updates = diff_edited_rows(df_editable, edited_df, MCM_ROW_KEY_COLUMNS)
+                if not row_updates:
+                    st.info("No changes to save.")
+                elif patch_rows(dbx, selected_period, MCM_ROW_KEY_COLUMNS, row_updates):
                     st.success("Changes saved successfully!")
                     time.sleep(1)
                     st.rerun()
                 else:
                     st.error("Failed to save changes.")
 
+        # Only loaded on request: the rest of this view reruns on every edit
+        st.markdown(f"#### 🕘 Version History for {selected_period}")
+        if st.toggle("Show version history", key=f"pco_show_history_{selected_period}"):
+            df_versions = list_period_versions(dbx, selected_period)
+            df_versions = df_versions[df_versions['committed_at'].notna()].reset_index(drop=True)
+            if df_versions.empty:
+                st.info("No earlier versions have been recorded for this period yet.")
+            else:
+                version_labels = [
+                    f"{row.committed_at.to_pydatetime().astimezone():%d-%m-%Y %H:%M:%S} ({row.reason}, {row.rows} rows)"
+                    for row in df_versions.itertuples()
+                ]
+                version_idx = st.selectbox("Select a version", options=range(len(version_labels)),
+                                           format_func=lambda i: version_labels[i], key=f"pco_version_{selected_period}")
+                as_of = df_versions.at[version_idx, 'committed_at'].to_pydatetime()
+                diff_key = f"pco_version_diff_{selected_period}"
+                if st.button("Compare With Current Data", key=f"pco_compare_{selected_period}"):
+                    with st.spinner("Comparing the selected version with the current data..."):
+                        st.session_state[diff_key] = (as_of, diff_period_versions(dbx, selected_period, as_of))
+                compared_as_of, changes = st.session_state.get(diff_key, (None, None))
+                if changes is not None and compared_as_of == as_of:
+                    c1, c2, c3 = st.columns(3)
+                    c1.metric("Rows added since", len(changes['added']))
+                    c2.metric("Rows removed since", len(changes['removed']))
+                    c3.metric("Rows changed since", len(changes['changed']))
+                    for label, df_change in changes.items():
+                        if not df_change.empty:
+                            st.markdown(f"**{label.capitalize()}**")
+                            st.dataframe(df_change, use_container_width=True, hide_index=True)
+                if st.button("Restore This Version", key=f"pco_rollback_{selected_period}"):
+                    with st.spinner("Restoring the selected version..."):
+                        if rollback_period(dbx, selected_period, as_of):
+                            st.session_state.pop(diff_key, None)
+                            st.success("The selected version was restored.")
+                            time.sleep(1)
+                            st.rerun()
+
     # ========================== MCM AGENDA TAB ==========================
     elif selected_tab == "MCM Agenda":
         mcm_agenda_tab(dbx)
@@ -570,11 +638,7 @@ def pco_dashboard(dbx):
     
         # --- 2. Load and Filter Core Visualization Data ---
         with st.spinner("Loading data for visualizations..."):
-            df_viz_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
-            if df_viz_data is None or df_viz_data.empty:
-                st.info("No data available to visualize.")
-                return
-            df_viz_data = df_viz_data[df_viz_data['mcm_period'] == selected_period].copy()
+            df_viz_data = read_period_data(dbx, selected_period)
     
         if df_viz_data.empty:
             st.info(f"No data to visualize for {selected_period}.")
@@ -587,22 +651,23 @@ def pco_dashboard(dbx):
         ]
         for col in amount_cols:
             if col in df_viz_data.columns:
-                df_viz_data[col] = pd.to_numeric(df_viz_data[col], errors='coerce').fillna(0)
+                df_viz_data[col] = df_viz_data[col].fillna(0)
     
         df_viz_data['Detection in Lakhs'] = df_viz_data.get('total_amount_detected_overall_rs', 0) / 100000.0
         df_viz_data['Recovery in Lakhs'] = df_viz_data.get('total_amount_recovered_overall_rs', 0) / 100000.0
         df_viz_data['Para Detection in Lakhs'] = df_viz_data.get('revenue_involved_rs', 0) / 100000.0
         df_viz_data['Para Recovery in Lakhs'] = df_viz_data.get('revenue_recovered_rs', 0) / 100000.0
         
-        df_viz_data['audit_group_number'] = pd.to_numeric(df_viz_data.get('audit_group_number'), errors='coerce').fillna(0).astype(int)
-        df_viz_data['audit_circle_number'] = pd.to_numeric(df_viz_data.get('audit_circle_number'), errors='coerce').fillna(0).astype(int)
+        # Columns arrive typed from read_period_data (see dar_schema); only the gaps are filled here
+        df_viz_data['audit_group_number'] = fill_missing(df_viz_data, 'audit_group_number', 0).astype(int)
+        df_viz_data['audit_circle_number'] = fill_missing(df_viz_data, 'audit_circle_number', 0).astype(int)
         df_viz_data['audit_group_number_str'] = df_viz_data['audit_group_number'].astype(str)
         df_viz_data['circle_number_str'] = df_viz_data['audit_circle_number'].astype(str)
         
-        df_viz_data['category'] = df_viz_data.get('category', 'Unknown').fillna('Unknown')
-        df_viz_data['trade_name'] = df_viz_data.get('trade_name', 'Unknown Trade Name').fillna('Unknown Trade Name')
-        df_viz_data['taxpayer_classification'] = df_viz_data.get('taxpayer_classification', 'Unknown').fillna('Unknown')
-        df_viz_data['para_classification_code'] = df_viz_data.get('para_classification_code', 'UNCLASSIFIED').fillna('UNCLASSIFIED')
+        df_viz_data['category'] = fill_missing(df_viz_data, 'category', 'Unknown')
+        df_viz_data['trade_name'] = fill_missing(df_viz_data, 'trade_name', 'Unknown Trade Name')
+        df_viz_data['taxpayer_classification'] = fill_missing(df_viz_data, 'taxpayer_classification', 'Unknown')
+        df_viz_data['para_classification_code'] = fill_missing(df_viz_data, 'para_classification_code', 'UNCLASSIFIED')
 
         # Unique reports for DAR-level analysis
         if 'dar_pdf_path' in df_viz_data.columns and df_viz_data['dar_pdf_path'].notna().any():
@@ -624,13 +689,13 @@ def pco_dashboard(dbx):
 
         # --- This block prepares the data for the table ---
         categories_order = ['Large', 'Medium', 'Small']
-        dar_summary = df_unique_reports.groupby('category').agg(
+        dar_summary = df_unique_reports.groupby('category', observed=True).agg(
             dars_submitted=('dar_pdf_path', 'nunique'),
             total_detected=('Detection in Lakhs', 'sum'),
             total_recovered=('Recovery in Lakhs', 'sum')
         )
         df_actual_paras = df_viz_data[df_viz_data['audit_para_number'].notna() & (~df_viz_data['audit_para_heading'].astype(str).isin(["N/A - Header Info Only (Add Paras Manually)", "Manual Entry Required", "Manual Entry - PDF Error", "Manual Entry - PDF Upload Failed"]))]
-        para_summary = df_actual_paras.groupby('category').size().reset_index(name='num_audit_paras').set_index('category')
+        para_summary = df_actual_paras.groupby('category', observed=True).size().reset_index(name='num_audit_paras').set_index('category')
         summary_df = pd.concat([dar_summary, para_summary], axis=1).reindex(categories_order).fillna(0)
         summary_df.reset_index(inplace=True)
         total_row = {
@@ -789,7 +854,7 @@ def pco_dashboard(dbx):
                 st.info("No audit paras with status information found for this period.")
             else:
                 # Aggregate data by status
-                status_agg = df_status_analysis.groupby('status_of_para').agg(
+                status_agg = df_status_analysis.groupby('status_of_para', observed=True).agg(
                     Para_Count=('status_of_para', 'count'),
                     Total_Detection=('Para Detection in Lakhs', 'sum'),
                     Total_Recovery=('Para Recovery in Lakhs', 'sum')
@@ -1004,7 +1069,7 @@ def pco_dashboard(dbx):
 
         with tc_tab1:
             if 'taxpayer_classification' in df_unique_reports.columns:
-                class_counts = df_unique_reports['taxpayer_classification'].value_counts().reset_index()
+                class_counts = df_unique_reports['taxpayer_classification'].value_counts()[lambda counts: counts > 0].reset_index()
                 class_counts.columns = ['classification', 'count']
                 
                 fig_pie_dars = px.pie(class_counts, names='classification', values='count',
@@ -1019,7 +1084,7 @@ def pco_dashboard(dbx):
 
         with tc_tab2:
             if 'taxpayer_classification' in df_unique_reports.columns:
-                class_agg = df_unique_reports.groupby('taxpayer_classification').agg(
+                class_agg = df_unique_reports.groupby('taxpayer_classification', observed=True).agg(
                     Total_Detection=('Detection in Lakhs', 'sum'),
                     Total_Recovery=('Recovery in Lakhs', 'sum')
                 ).reset_index()
@@ -1122,7 +1187,7 @@ def pco_dashboard(dbx):
                 unique_major_codes_det = df_paras[df_paras['Para Detection in Lakhs'] > 0]['major_code'].unique()
                 for code in sorted(unique_major_codes_det):
                     df_filtered = df_paras[df_paras['major_code'] == code].copy()
-                    df_agg = df_filtered.groupby('para_classification_code')['Para Detection in Lakhs'].sum().reset_index()
+                    df_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Detection in Lakhs'].sum().reset_index()
                     df_agg['description'] = df_agg['para_classification_code'].map(DETAILED_CLASSIFICATION_DESC)
                     
                     fig = px.bar(df_agg, 
@@ -1145,7 +1210,7 @@ def pco_dashboard(dbx):
                 unique_major_codes_rec = df_paras[df_paras['Para Recovery in Lakhs'] > 0]['major_code'].unique()
                 for code in sorted(unique_major_codes_rec):
                     df_filtered = df_paras[df_paras['major_code'] == code].copy()
-                    df_agg = df_filtered.groupby('para_classification_code')['Para Recovery in Lakhs'].sum().reset_index()
+                    df_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Recovery in Lakhs'].sum().reset_index()
                     df_agg['description'] = df_agg['para_classification_code'].map(DETAILED_CLASSIFICATION_DESC)
 
                     fig = px.bar(df_agg, 
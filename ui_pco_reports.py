@@ -4,7 +4,11 @@ import pandas as pd
 from reports_utils import get_log_data, generate_login_report
 # ui_pco_reports.py
 import streamlit as st
-from reports_utils import get_log_data, generate_login_report
+import plotly.express as px
+from reports_utils import get_log_data, generate_login_report, generate_login_trend
+from dropbox_utils import (
+    get_write_conflict_stats, get_read_cache_stats, get_download_cache_stats, get_storage_timing_stats
+)
 
 def pco_reports_dashboard(dbx):
     """
@@ -16,7 +20,7 @@ def pco_reports_dashboard(dbx):
         st.error("Dropbox client is not available. Reporting is unavailable.")
         st.stop()
     
-    report_options = ["Login Activity Report"]
+    report_options = ["Login Activity Report", "Storage Health"]
     selected_report = st.selectbox("Select a report to view:", report_options)
 
     if selected_report == "Login Activity Report":
@@ -46,3 +50,49 @@ def pco_reports_dashboard(dbx):
                         use_container_width=True,
                         hide_index=True
                     )
+
+                    trend_df = generate_login_trend(log_df, days_option)
+                    fig_trend = px.bar(
+                        trend_df, x='Date', y='Logins', color='Username',
+                        title=f"Logins per Day per User (last {days_option} days)"
+                    )
+                    fig_trend.update_layout(xaxis_type='category', legend_title_text='User')
+                    st.plotly_chart(fig_trend, use_container_width=True)
+
+    elif selected_report == "Storage Health":
+        st.markdown("<h4>Storage Health</h4>", unsafe_allow_html=True)
+        st.markdown("Write conflicts happen when two users save the same data at the same time; "
+                    "they are retried automatically. Counters cover this app process since it started.")
+
+        conflict_stats = get_write_conflict_stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Write Conflicts", conflict_stats['conflicts'])
+        col2.metric("Retried", conflict_stats['retries'])
+        col3.metric("Failed", conflict_stats['failures'])
+        if conflict_stats['by_path']:
+            st.dataframe(
+                pd.DataFrame(list(conflict_stats['by_path'].items()), columns=['Dropbox Path', 'Conflicts']),
+                use_container_width=True,
+                hide_index=True
+            )
+
+        st.markdown("**Read Cache**")
+        download_stats = get_download_cache_stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Download Hit Rate", f"{download_stats['hit_rate']:.0%}")
+        col2.metric("Parsed Frames Reused", download_stats['frame_hits'])
+        col3.metric("Cached Files", download_stats['entries'])
+        read_stats = get_read_cache_stats()
+        if read_stats:
+            df_read_stats = pd.DataFrame.from_dict(read_stats, orient='index').rename_axis('Dropbox Path').reset_index()
+            df_read_stats = df_read_stats.rename(columns={'reads': 'Reads', 'round_trips_saved': 'Round Trips Saved',
+                                                          'invalidations': 'Invalidated by Writes'})
+            st.dataframe(df_read_stats.sort_values('Reads', ascending=False), use_container_width=True, hide_index=True)
+
+        st.markdown("**Storage Calls**")
+        timing_stats = get_storage_timing_stats(dbx)
+        if timing_stats:
+            df_timing = pd.DataFrame.from_dict(timing_stats, orient='index').rename_axis('Operation').reset_index()
+            df_timing['Avg (ms)'] = (df_timing['seconds'] / df_timing['calls'] * 1000).round(1)
+            df_timing = df_timing.rename(columns={'calls': 'Calls', 'seconds': 'Total (s)'})
+            st.dataframe(df_timing.sort_values('Total (s)', ascending=False), use_container_width=True, hide_index=True)
@@ -11,9 +11,10 @@ import time
 from dropbox_utils import (
     read_from_spreadsheet,
     update_spreadsheet_from_df,
-    upload_file,
-    create_folder
+    upload_large_file,
+    read_excel_bytes
 )
+from dar_index import query_smart_audit_rows
 from config import SMART_AUDIT_DATA_PATH, OFFICE_ORDERS_PATH
 
 # --- Helper Functions ---
@@ -59,8 +60,7 @@ def smart_audit_tracker_dashboard(dbx):
     st.markdown("<h2 class='page-main-title'>Smart Audit Tracker</h2>", unsafe_allow_html=True)
     st.markdown("<p class='page-app-subtitle'>Manage the complete lifecycle of audit assignments.</p>", unsafe_allow_html=True)
     
-    # Ensure the Office Orders folder exists
-    create_folder(dbx, OFFICE_ORDERS_PATH)
+    # The Office Orders folder is created once per process at app start (app.initialize_dropbox_structure)
 
     selected_main_tab = option_menu(
         menu_title=None,
@@ -256,7 +256,7 @@ def process_allocation_upload(dbx, excel_file, pdf_file, fin_year, alloc_date):
     """Validates and processes the uploaded allocation files."""
     with st.spinner("Processing file..."):
         try:
-            df = pd.read_excel(excel_file)
+            df = read_excel_bytes(excel_file.getvalue())
             master_df = read_from_spreadsheet(dbx, SMART_AUDIT_DATA_PATH)
         except Exception as e:
             st.error(f"Error reading Excel file: {e}")
@@ -272,7 +272,7 @@ def process_allocation_upload(dbx, excel_file, pdf_file, fin_year, alloc_date):
         
         pdf_filename = f"OfficeOrder_{fin_year.replace('-', '_')}_{int(time.time())}.pdf"
         pdf_path = f"{OFFICE_ORDERS_PATH}/{pdf_filename}"
-        if not upload_file(dbx, pdf_file.getvalue(), pdf_path):
+        if not upload_large_file(dbx, pdf_file.getvalue(), pdf_path):
             st.error("Failed to upload Office Order PDF. Aborting data save.")
             return
 
@@ -297,7 +297,7 @@ def process_reassignment(dbx, master_df, record_index, old_details, new_group, n
     with st.spinner("Processing reassignment..."):
         pdf_filename = f"ReallocOrder_{old_details['Financial Year']}_{old_details['GSTIN']}_{int(time.time())}.pdf"
         pdf_path = f"{OFFICE_ORDERS_PATH}/{pdf_filename}"
-        if not upload_file(dbx, realloc_pdf.getvalue(), pdf_path):
+        if not upload_large_file(dbx, realloc_pdf.getvalue(), pdf_path):
             st.error("Failed to upload Reallocation Office Order PDF. Aborting update.")
             return
 
@@ -325,11 +325,8 @@ def audit_group_tracker_view(dbx):
     st.markdown("<h2 class='page-main-title'>My Smart Audit Tracker</h2>", unsafe_allow_html=True)
     st.info("This section shows your assigned units and their current status.")
     
-    master_df = read_from_spreadsheet(dbx, SMART_AUDIT_DATA_PATH)
-    if not master_df.empty and 'Allocated Audit Group Number' in master_df.columns:
-        # Ensure column is numeric for comparison
-        master_df['Allocated Audit Group Number'] = pd.to_numeric(master_df['Allocated Audit Group Number'], errors='coerce')
-        my_assignments = master_df[master_df['Allocated Audit Group Number'] == st.session_state.audit_group_no]
+    my_assignments = query_smart_audit_rows(dbx, allocated_group=st.session_state.audit_group_no)
+    if not my_assignments.empty:
         st.dataframe(my_assignments, use_container_width=True, hide_index=True)
     else:
         st.info("No units have been assigned to you yet.")
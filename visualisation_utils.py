@@ -4,10 +4,19 @@ import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 import json
-from dropbox_utils import read_from_spreadsheet
-from config import MCM_DATA_PATH
+from dropbox_utils import read_from_spreadsheet, read_period_data
+from dar_schema import fill_missing
 from plotly.subplots import make_subplots
 
+# Columns read by get_visualization_data; the rest of the partition is not loaded.
+VISUALIZATION_DATA_COLUMNS = [
+    'audit_group_number', 'audit_circle_number', 'gstin', 'trade_name', 'category',
+    'taxpayer_classification', 'total_amount_detected_overall_rs', 'total_amount_recovered_overall_rs',
+    'audit_para_number', 'audit_para_heading', 'revenue_involved_rs', 'revenue_recovered_rs',
+    'revenue_involved_lakhs_rs', 'revenue_recovered_lakhs_rs', 'status_of_para',
+    'para_classification_code', 'risk_flags_data', 'dar_pdf_path', 'mcm_decision', 'chair_remarks'
+]
+
 def wrap_text(text, max_length=15):
     """
     Helper function to wrap long text into multiple lines
@@ -79,24 +88,20 @@ def wrap_text_for_labels(text, max_chars_per_line=20, max_lines=3):# for nature
     
     return '<br>'.join(lines)
 
-def get_visualization_data(dbx, selected_period):
+def get_visualization_data(dbx, selected_period, df_periods=None):
     """
     COMPREHENSIVE helper function that extracts ALL visualization data and charts 
     from the Visualizations tab in ui_pco.py. This function preserves EVERY chart,
     analysis, and feature from the original implementation.
+    Pass `df_periods` if the caller has already loaded the MCM periods file.
     
     Returns vital_stats dict and list of plotly charts with all analysis features.
     """
     try:
         # --- 1. Load and Filter Core Visualization Data (EXACT REPLICA) ---
-        df_viz_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+        df_viz_data = read_period_data(dbx, selected_period, columns=VISUALIZATION_DATA_COLUMNS)
         if df_viz_data is None or df_viz_data.empty:
             return None, None
-            
-        df_viz_data = df_viz_data[df_viz_data['mcm_period'] == selected_period].copy()
-        
-        if df_viz_data.empty:
-            return None, None
         
         # --- 2. Data Cleaning and Preparation (CONSOLIDATED - EXACT REPLICA) ---
         amount_cols = [
@@ -105,22 +110,23 @@ def get_visualization_data(dbx, selected_period):
         ]
         for col in amount_cols:
             if col in df_viz_data.columns:
-                df_viz_data[col] = pd.to_numeric(df_viz_data[col], errors='coerce').fillna(0)
+                df_viz_data[col] = df_viz_data[col].fillna(0)
         
         df_viz_data['Detection in Lakhs'] = df_viz_data.get('total_amount_detected_overall_rs', 0) / 100000.0
         df_viz_data['Recovery in Lakhs'] = df_viz_data.get('total_amount_recovered_overall_rs', 0) / 100000.0
         df_viz_data['Para Detection in Lakhs'] = df_viz_data.get('revenue_involved_rs', 0) / 100000.0
         df_viz_data['Para Recovery in Lakhs'] = df_viz_data.get('revenue_recovered_rs', 0) / 100000.0
         
-        df_viz_data['audit_group_number'] = pd.to_numeric(df_viz_data.get('audit_group_number'), errors='coerce').fillna(0).astype(int)
-        df_viz_data['audit_circle_number'] = pd.to_numeric(df_viz_data.get('audit_circle_number'), errors='coerce').fillna(0).astype(int)
+        # Columns arrive typed from read_period_data (see dar_schema); only the gaps are filled here
+        df_viz_data['audit_group_number'] = fill_missing(df_viz_data, 'audit_group_number', 0).astype(int)
+        df_viz_data['audit_circle_number'] = fill_missing(df_viz_data, 'audit_circle_number', 0).astype(int)
         df_viz_data['audit_group_number_str'] = df_viz_data['audit_group_number'].astype(str)
         df_viz_data['circle_number_str'] = df_viz_data['audit_circle_number'].astype(str)
         
-        df_viz_data['category'] = df_viz_data.get('category', 'Unknown').fillna('Unknown')
-        df_viz_data['trade_name'] = df_viz_data.get('trade_name', 'Unknown Trade Name').fillna('Unknown Trade Name')
-        df_viz_data['taxpayer_classification'] = df_viz_data.get('taxpayer_classification', 'Unknown').fillna('Unknown')
-        df_viz_data['para_classification_code'] = df_viz_data.get('para_classification_code', 'UNCLASSIFIED').fillna('UNCLASSIFIED')
+        df_viz_data['category'] = fill_missing(df_viz_data, 'category', 'Unknown')
+        df_viz_data['trade_name'] = fill_missing(df_viz_data, 'trade_name', 'Unknown Trade Name')
+        df_viz_data['taxpayer_classification'] = fill_missing(df_viz_data, 'taxpayer_classification', 'Unknown')
+        df_viz_data['para_classification_code'] = fill_missing(df_viz_data, 'para_classification_code', 'UNCLASSIFIED')
 
         # Unique reports for DAR-level analysis (EXACT REPLICA)
         if 'dar_pdf_path' in df_viz_data.columns and df_viz_data['dar_pdf_path'].notna().any():
@@ -141,7 +147,7 @@ def get_visualization_data(dbx, selected_period):
         
         # --- 4. Prepare Performance Summary Table Data (EXACT REPLICA) ---
         categories_order = ['Large', 'Medium', 'Small']
-        dar_summary = df_unique_reports.groupby('category').agg(
+        dar_summary = df_unique_reports.groupby('category', observed=True).agg(
             dars_submitted=('dar_pdf_path', 'nunique'),
             total_detected=('Detection in Lakhs', 'sum'),
             total_recovered=('Recovery in Lakhs', 'sum')
@@ -153,7 +159,7 @@ def get_visualization_data(dbx, selected_period):
                                          "Manual Entry - PDF Error", 
                                          "Manual Entry - PDF Upload Failed"
                                      ]))]
-        para_summary = df_actual_paras.groupby('category').size().reset_index(name='num_audit_paras').set_index('category')
+        para_summary = df_actual_paras.groupby('category', observed=True).size().reset_index(name='num_audit_paras').set_index('category')
         summary_df = pd.concat([dar_summary, para_summary], axis=1).reindex(categories_order).fillna(0)
         summary_df.reset_index(inplace=True)
         
@@ -170,7 +176,7 @@ def get_visualization_data(dbx, selected_period):
             ].copy()
             
             if not df_status_analysis.empty:
-                status_agg = df_status_analysis.groupby('status_of_para').agg(
+                status_agg = df_status_analysis.groupby('status_of_para', observed=True).agg(
                     Para_Count=('status_of_para', 'count'),
                     Total_Detection=('Para Detection in Lakhs', 'sum'),
                     Total_Recovery=('Para Recovery in Lakhs', 'sum')
@@ -326,7 +332,7 @@ def get_visualization_data(dbx, selected_period):
             ].copy()
             
             if not df_status_analysis.empty:
-                status_agg = df_status_analysis.groupby('status_of_para').agg(
+                status_agg = df_status_analysis.groupby('status_of_para', observed=True).agg(
                     Para_Count=('status_of_para', 'count'),
                     Total_Detection=('Para Detection in Lakhs', 'sum'),
                     Total_Recovery=('Para Recovery in Lakhs', 'sum')
@@ -413,12 +419,12 @@ def get_visualization_data(dbx, selected_period):
         # CHARTS 8-10: Taxpayer Classification Analysis (ULTRA COMPACT - NO TITLE)
       
         if 'taxpayer_classification' in df_unique_reports.columns:
-            class_counts = df_unique_reports['taxpayer_classification'].value_counts().reset_index()
+            class_counts = df_unique_reports['taxpayer_classification'].value_counts()[lambda counts: counts > 0].reset_index()
             class_counts.columns = ['classification', 'count']
             class_counts = class_counts[class_counts['count'] > 0]
             
             # Detection and Recovery aggregations
-            class_agg = df_unique_reports.groupby('taxpayer_classification').agg(
+            class_agg = df_unique_reports.groupby('taxpayer_classification', observed=True).agg(
                 Total_Detection=('Detection in Lakhs', 'sum'),
                 Total_Recovery=('Recovery in Lakhs', 'sum')
             ).reset_index()
@@ -1032,7 +1038,7 @@ def get_visualization_data(dbx, selected_period):
                 df_filtered = df_paras[df_paras['major_code'] == code].copy()
                 
                 if not df_filtered.empty:
-                    df_agg = df_filtered.groupby('para_classification_code')['Para Detection in Lakhs'].sum().reset_index()
+                    df_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Detection in Lakhs'].sum().reset_index()
                     df_agg = df_agg[df_agg['Para Detection in Lakhs'] > 0]
                 else:
                     df_agg = pd.DataFrame()  # Empty dataframe
@@ -1091,7 +1097,7 @@ def get_visualization_data(dbx, selected_period):
                 df_filtered = df_paras[df_paras['major_code'] == code].copy()
                 
                 if not df_filtered.empty:
-                    df_agg = df_filtered.groupby('para_classification_code')['Para Recovery in Lakhs'].sum().reset_index()
+                    df_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Recovery in Lakhs'].sum().reset_index()
                     df_agg = df_agg[df_agg['Para Recovery in Lakhs'] > 0]
                 else:
                     df_agg = pd.DataFrame()  # Empty dataframe
@@ -1174,7 +1180,7 @@ def get_visualization_data(dbx, selected_period):
         # ADD SECTORAL SUMMARY DATA (after chart generation)
         sectoral_summary = []
         if 'taxpayer_classification' in df_unique_reports.columns:
-            sectoral_agg = df_unique_reports.groupby('taxpayer_classification').agg(
+            sectoral_agg = df_unique_reports.groupby('taxpayer_classification', observed=True).agg(
                 dar_count=('dar_pdf_path', 'nunique'),
                 total_detection=('Detection in Lakhs', 'sum'),
                 total_recovery=('Recovery in Lakhs', 'sum')
@@ -1419,7 +1425,7 @@ def get_visualization_data(dbx, selected_period):
             df_mcm_data['revenue_recovered_lakhs_rs'] = pd.to_numeric(df_mcm_data['revenue_recovered_lakhs_rs'], errors='coerce').fillna(0)
             df_mcm_data['chair_remarks'] = df_mcm_data['chair_remarks'].fillna('')
             df_mcm_data['mcm_decision'] = df_mcm_data['mcm_decision'].fillna('Decision pending')
-            df_mcm_data['status_of_para'] = df_mcm_data['status_of_para'].fillna('Status not updated')
+            df_mcm_data['status_of_para'] = fill_missing(df_mcm_data, 'status_of_para', 'Status not updated')
             
             # Convert to list of dictionaries
             mcm_detailed_data = df_mcm_data[mcm_columns].to_dict('records')
@@ -1432,13 +1438,13 @@ def get_visualization_data(dbx, selected_period):
             try:
                 from config import MCM_PERIODS_INFO_PATH
                 
-                # Load MCM periods data
-                df_periods = read_from_spreadsheet(dbx, MCM_PERIODS_INFO_PATH)
-                if df_periods is None or df_periods.empty:
+                # Load MCM periods data (unless the caller already has it)
+                df_periods_info = df_periods if df_periods is not None else read_from_spreadsheet(dbx, MCM_PERIODS_INFO_PATH)
+                if df_periods_info is None or df_periods_info.empty:
                     return ""
                 
                 # Ensure overall_remarks column exists
-                if 'overall_remarks' not in df_periods.columns:
+                if 'overall_remarks' not in df_periods_info.columns:
                     return ""
                 
                 # Parse the selected period to get month and year
@@ -1449,9 +1455,9 @@ def get_visualization_data(dbx, selected_period):
                     return ""
                 
                 # Find the matching period
-                period_row = df_periods[
-                    (df_periods['month_name'] == month_name) & 
-                    (df_periods['year'] == year_val)
+                period_row = df_periods_info[
+                    (df_periods_info['month_name'] == month_name) & 
+                    (df_periods_info['year'] == year_val)
                 ]
                 
                 if not period_row.empty:
@@ -1507,14 +1513,9 @@ def get_agreed_yet_to_pay_analysis(dbx, selected_period):
     This replicates the specific analysis from the original visualization tab
     """
     try:
-        df_viz_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+        df_viz_data = read_period_data(dbx, selected_period)
         if df_viz_data is None or df_viz_data.empty:
             return None
-            
-        df_viz_data = df_viz_data[df_viz_data['mcm_period'] == selected_period].copy()
-        
-        if df_viz_data.empty:
-            return None
         
         # Data preparation
         df_viz_data['Para Detection in Lakhs'] = df_viz_data.get('revenue_involved_rs', 0) / 100000.0
@@ -1572,14 +1573,9 @@ def get_detailed_classification_analysis(dbx, selected_period):
     This replicates the comprehensive classification breakdown from the original
     """
     try:
-        df_viz_data = read_from_spreadsheet(dbx, MCM_DATA_PATH)
+        df_viz_data = read_period_data(dbx, selected_period)
         if df_viz_data is None or df_viz_data.empty:
             return None
-            
-        df_viz_data = df_viz_data[df_viz_data['mcm_period'] == selected_period].copy()
-        
-        if df_viz_data.empty:
-            return None
         
         # DETAILED_CLASSIFICATION_DESC from original code
         DETAILED_CLASSIFICATION_DESC = {
@@ -1628,11 +1624,11 @@ def get_detailed_classification_analysis(dbx, selected_period):
             df_filtered = df_paras[df_paras['major_code'] == code].copy()
             
             # Detection analysis
-            det_agg = df_filtered.groupby('para_classification_code')['Para Detection in Lakhs'].sum().reset_index()
+            det_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Detection in Lakhs'].sum().reset_index()
             det_agg['description'] = det_agg['para_classification_code'].map(DETAILED_CLASSIFICATION_DESC)
             
             # Recovery analysis  
-            rec_agg = df_filtered.groupby('para_classification_code')['Para Recovery in Lakhs'].sum().reset_index()
+            rec_agg = df_filtered.groupby('para_classification_code', observed=True)['Para Recovery in Lakhs'].sum().reset_index()
             rec_agg['description'] = rec_agg['para_classification_code'].map(DETAILED_CLASSIFICATION_DESC)
             
             detailed_analysis[code] = {